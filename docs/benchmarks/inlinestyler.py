@@ -0,0 +1,97 @@
+"""Compare the classic and the indexed cascade of the inline styler.
+
+Run it in the buildout, no site is needed:
+
+    bin/zopepy docs/benchmarks/inlinestyler.py [repeat] [issue.html ...]
+
+Every issue (by default the OSHMail issues of the static mockup in
+Osha-main-site-hybrid) is converted by osha.theme.cssselect.Converter with
+cascade='classic' and cascade='indexed'; the linked stylesheets are read
+from the directory of the issue. The outputs must be byte-identical.
+Then both cascades are timed on the issues and on an issue of about
+200 KB, made by repeating the body of the first one.
+"""
+import os
+import sys
+import time
+
+from osha.theme.cssselect import Converter
+from osha.theme.stylesheets import FileStylesheetLoader
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    os.pardir, os.pardir)
+FIXTURES = (
+    os.path.join(ROOT, 'Osha-main-site-hybrid', 'oshmail.html'),
+    os.path.join(ROOT, 'Osha-main-site-hybrid', 'Pig', 'en', 'news',
+                 'oshmail.html'),
+)
+LARGE_SIZE = 200 * 1024
+
+
+def convert(cascade, html, directory):
+    converter = Converter(
+        cascade=cascade, loader=FileStylesheetLoader(directory))
+    return converter.perform(html)
+
+
+def enlarge(html, size):
+    """ html with the content of its body repeated up to size bytes """
+    start = html.index('>', html.index('<body')) + 1
+    end = html.rindex('</body>')
+    body = html[start:end]
+    count = max(1, (size - len(html)) // max(len(body), 1) + 1)
+    return html[:start] + body * count + html[end:]
+
+
+def compare(label, directory, html):
+    classic = convert('classic', html, directory)
+    indexed = convert('indexed', html, directory)
+    if classic != indexed:
+        print '%s: the outputs differ' % label
+        return False
+    print '%s: identical (%d bytes)' % (label, len(classic))
+    return True
+
+
+def timeit(cascade, html, directory, repeat):
+    # the first conversion fills the process-wide caches
+    convert(cascade, html, directory)
+    start = time.time()
+    for i in xrange(repeat):
+        convert(cascade, html, directory)
+    return (time.time() - start) / repeat
+
+
+def main(args):
+    repeat = args and int(args[0]) or 5
+    filenames = args[1:] or FIXTURES
+    issues = []
+    for filename in filenames:
+        f = open(filename)
+        try:
+            issues.append((filename, os.path.dirname(filename), f.read()))
+        finally:
+            f.close()
+    filename, directory, html = issues[0]
+    issues.append(('%s (enlarged)' % filename, directory,
+                   enlarge(html, LARGE_SIZE)))
+
+    identical = True
+    for label, directory, html in issues:
+        identical = compare(label, directory, html) and identical
+    if not identical:
+        sys.exit(1)
+
+    print
+    print '%10s %14s %14s %8s' % ('size (KB)', 'classic (ms)', 'indexed (ms)',
+                                  'speedup')
+    for label, directory, html in issues:
+        classic = timeit('classic', html, directory, repeat)
+        indexed = timeit('indexed', html, directory, repeat)
+        print '%10d %14.1f %14.1f %8.1f' % (
+            len(html) // 1024, classic * 1000, indexed * 1000,
+            classic / indexed)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
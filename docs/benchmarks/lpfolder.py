@@ -0,0 +1,85 @@
+"""Time the conversion of a Large Plone Folder to a Folder.
+
+Run it in the buildout against a site:
+
+    bin/instance run docs/benchmarks/lpfolder.py [site id] [children ...]
+
+For every number of children a Large Plone Folder is filled with that many
+minimal items and converted with osha.theme.browser.maintenance.
+convertLPFolder and with the previous implementation, which rebuilt
+_objects of both folders for every child. The transaction is aborted
+afterwards, the site is left unchanged.
+"""
+import sys
+import time
+
+import transaction
+from Acquisition import aq_base
+from OFS.SimpleItem import SimpleItem
+from Products.ATContentTypes.content.folder import ATBTreeFolder, ATFolder
+
+from osha.theme.browser.maintenance import convertLPFolder
+
+
+def convertLPFolderQuadratic(parent, folder):
+    """ the implementation before 1.5.56, for comparison """
+    id = folder.getId()
+    newfolder = ATFolder(id)
+    newfolder._setId(id)
+    newfolder = newfolder.__of__(parent)
+    uid = folder._at_uid
+    for item_id, item in folder.objectItems():
+        folder._objects = tuple(
+            [i for i in folder._objects if i['id'] != item_id])
+        folder._delOb(item_id)
+        newfolder._objects = newfolder._objects + (
+            {'id': item_id, 'meta_type': item.meta_type},)
+        newfolder._setOb(item_id, aq_base(item))
+    parent._objects = tuple([i for i in parent._objects if i['id'] != id])
+    parent._delOb(id)
+    newfolder._at_uid = uid
+    parent._objects = parent._objects + (
+        {'id': id, 'meta_type': newfolder.meta_type},)
+    parent._setOb(id, aq_base(newfolder))
+
+
+class Item(SimpleItem):
+    meta_type = 'Benchmark Item'
+
+
+def makeLPFolder(parent, id, children):
+    folder = ATBTreeFolder(id)
+    folder._setId(id)
+    folder._at_uid = 'benchmark-%s' % id
+    parent._setObject(id, folder, suppress_events=True)
+    folder = parent._getOb(id)
+    for i in xrange(children):
+        item_id = 'item-%d' % i
+        item = Item()
+        item.id = item_id
+        folder._setObject(item_id, item, suppress_events=True)
+    return folder
+
+
+def timeit(convert, parent, children):
+    folder = makeLPFolder(parent, 'lpfolder-benchmark', children)
+    start = time.time()
+    convert(parent, folder)
+    elapsed = time.time() - start
+    transaction.abort()
+    return elapsed
+
+
+def main(app, args):
+    site_id = args and args[0] or 'osha'
+    sizes = [int(arg) for arg in args[1:]] or [1000, 5000, 20000]
+    parent = getattr(app, site_id)
+    print '%10s %12s %12s' % ('children', 'linear (s)', 'before (s)')
+    for children in sizes:
+        linear = timeit(convertLPFolder, parent, children)
+        before = timeit(convertLPFolderQuadratic, parent, children)
+        print '%10d %12.2f %12.2f' % (children, linear, before)
+
+
+if __name__ == '__main__':
+    main(app, sys.argv[1:])
@@ -0,0 +1,101 @@
+"""Time how the month view puts events on the visible days.
+
+Run it in the buildout, no site is needed:
+
+    bin/zopepy docs/benchmarks/month.py [events] [repeat]
+
+A few hundred events lasting up to two years are put on the days of a
+visible month (six weeks, like the calendar grid) with the clipping of
+osha.theme.browser.month.MonthView._fill_events and with the previous
+implementation, which stepped through every day of every event. Both must
+put the same events on the same days. Events that end before their start or
+lie completely outside the visible days are checked separately.
+"""
+import datetime
+import random
+import sys
+import time
+
+from osha.theme.browser.month import visibleSpan
+
+
+def makeEvents(count, first):
+    random.seed(count)
+    events = []
+    for i in xrange(count):
+        start = first + datetime.timedelta(random.randint(-400, 400))
+        end = start + datetime.timedelta(random.randint(0, 730))
+        events.append((i, start, end))
+    return events
+
+
+def fillClipped(events, days):
+    first = min(days)
+    last = max(days)
+    for id, start, end in events:
+        span = visibleSpan(start, end, first, last)
+        if span is None:
+            continue
+        dt, dtend = span
+        for offset in range((dtend - dt).days + 1):
+            day = days.get(dt + datetime.timedelta(offset), None)
+            if day is not None:
+                day.append(id)
+
+
+def fillDaily(events, days):
+    """ the implementation before 1.5.56, for comparison """
+    for id, dt, dtend in events:
+        dt_list = dt in days and [dt] or []
+        while dt != dtend:
+            dt = dt + datetime.timedelta(1)
+            if dt in days:
+                dt_list.append(dt)
+        for dt in dt_list:
+            days[dt].append(id)
+
+
+def makeDays(first):
+    return dict([(first + datetime.timedelta(offset), [])
+                 for offset in range(42)])
+
+
+def timeit(fill, events, first, repeat):
+    start = time.time()
+    for i in xrange(repeat):
+        days = makeDays(first)
+        fill(events, days)
+    return (time.time() - start) / repeat, days
+
+
+def checkEdges(first):
+    last = first + datetime.timedelta(41)
+    day = datetime.timedelta(1)
+    # ends before it starts: shown on its start day only
+    assert visibleSpan(first + 3 * day, first, first, last) == (
+        first + 3 * day, first + 3 * day)
+    # ends before its start and before the visible days
+    assert visibleSpan(first - 2 * day, first - 5 * day, first, last) is None
+    # completely before or after the visible days
+    assert visibleSpan(first - 9 * day, first - day, first, last) is None
+    assert visibleSpan(last + day, last + 9 * day, first, last) is None
+    # runs across all visible days
+    assert visibleSpan(first - 99 * day, last + 99 * day, first, last) == (
+        first, last)
+
+
+def main(args):
+    count = args and int(args[0]) or 500
+    repeat = len(args) > 1 and int(args[1]) or 10
+    first = datetime.date(2010, 3, 1)
+    checkEdges(first)
+    events = makeEvents(count, first)
+    clipped, clipped_days = timeit(fillClipped, events, first, repeat)
+    daily, daily_days = timeit(fillDaily, events, first, repeat)
+    assert clipped_days == daily_days
+    print '%8s %14s %14s' % ('events', 'clipped (ms)', 'before (ms)')
+    print '%8d %14.2f %14.2f' % (count, clipped * 1000, daily * 1000)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
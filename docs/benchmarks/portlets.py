@@ -0,0 +1,84 @@
+"""Count the ZODB loads and time a render of the news and events portlets.
+
+Run it in the buildout against a site with a Solr connection:
+
+    bin/instance run docs/benchmarks/portlets.py [site id] [language] \
+        [count] [repeat]
+
+Both portlets are rendered the way they are now, from the Solr results
+completed with osha.theme.browser.utils.completeFlares, and the way they
+were before 1.5.56, from the woken up items. Before every render the
+object cache of the connection is emptied, so that the number of objects
+loaded from the ZODB (getTransferCounts) is that of a render on a cold
+cache. The render cache is bypassed. The transaction is aborted
+afterwards, the site is left unchanged.
+"""
+import sys
+import time
+
+import transaction
+from Testing.makerequest import makerequest
+from zope.component.hooks import setSite
+
+from osha.theme.portlets import oshevents, oshnews
+
+
+def wakingUp(renderer_class):
+    """ a renderer that renders from the items instead of the results """
+
+    class Renderer(renderer_class):
+
+        def _data(self):
+            return [item.getObject() for item in
+                    renderer_class._data(self)]
+
+    return Renderer
+
+
+def render(renderer_class, context, assignment):
+    """ render the portlet on a cold cache, returns (seconds, loads) """
+    connection = context._p_jar
+    connection.cacheMinimize()
+    connection.getTransferCounts(True)
+    start = time.time()
+    renderer = renderer_class(context, context.REQUEST, None, None,
+                              assignment)
+    renderer.update()
+    renderer._template()
+    elapsed = time.time() - start
+    loads, stores = connection.getTransferCounts(True)
+    transaction.abort()
+    return elapsed, loads
+
+
+def measure(renderer_class, context, assignment, repeat):
+    results = [render(renderer_class, context, assignment)
+               for i in xrange(repeat)]
+    elapsed = sum([seconds for seconds, loads in results]) / repeat
+    loads = max([loads for seconds, loads in results])
+    return elapsed, loads
+
+
+def main(app, args):
+    site_id = args and args[0] or 'osha'
+    language = len(args) > 1 and args[1] or 'en'
+    count = len(args) > 2 and int(args[2]) or 5
+    repeat = len(args) > 3 and int(args[3]) or 10
+    site = getattr(makerequest(app), site_id)
+    setSite(site)
+    context = getattr(site, language, site)
+
+    print '%8s %12s %12s %12s %12s' % (
+        'portlet', 'flares (ms)', 'loads', 'before (ms)', 'loads')
+    for name, module in (('news', oshnews), ('events', oshevents)):
+        assignment = module.Assignment(count=count)
+        flares, flare_loads = measure(
+            module.Renderer, context, assignment, repeat)
+        before, before_loads = measure(
+            wakingUp(module.Renderer), context, assignment, repeat)
+        print '%8s %12.1f %12d %12.1f %12d' % (
+            name, flares * 1000, flare_loads, before * 1000, before_loads)
+
+
+if __name__ == '__main__':
+    main(app, sys.argv[1:])
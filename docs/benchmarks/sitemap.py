@@ -0,0 +1,101 @@
+"""Time the full and the incremental generation of the sitemap.
+
+Run it in the buildout against a site:
+
+    bin/instance run docs/benchmarks/sitemap.py [site id] [items] [folders]
+
+A synthetic index of items (500000 by default) in second level folders is
+served by osha.theme.browser.utils.FakeSolrSearch, one per shard, so no
+Solr server or catalog of that size is needed. The folders are spread over
+the shards with osha.theme.browser.sitemap.shardForPrefix. The sitemap is
+generated in full, then again after a few shards were marked dirty, which
+is what markSitemapDirty does when content changes. At last the folders of
+a shard are removed and it is checked that its part files are deleted
+with them. Cache purging is skipped and the transaction is aborted
+afterwards, the site is left unchanged.
+"""
+import sys
+import time
+
+import transaction
+from DateTime import DateTime
+from Testing.makerequest import makerequest
+from zope.component.hooks import setSite
+
+from osha.theme.browser.sitemap import getSitemapJournal, shardForPrefix, \
+    SiteMapView
+from osha.theme.browser.utils import FakeSolrSearch
+
+
+class BenchmarkSiteMapView(SiteMapView):
+    """ answers every shard from its own FakeSolrSearch """
+
+    searches = {}
+
+    def batches(self, shard=None):
+        search = self.searches.get(shard, FakeSolrSearch([]))
+        records = self._solrRecords(self.solrQuery(shard), search=search)
+        for batch in self._extract(records):
+            yield batch
+
+    def _purgeFilenamesFromCache(self, filenames):
+        pass
+
+
+def makeSearches(portal_path, items, folders):
+    modified = DateTime() - 10
+    docs = {}
+    for folder in range(folders):
+        prefix = 'en/folder-%d' % folder
+        shard_docs = docs.setdefault(shardForPrefix(prefix), [])
+        for i in xrange(folder, items, folders):
+            shard_docs.append({'path_string': '%s/%s/doc-%d' % (
+                                   portal_path, prefix, i),
+                               'modified': modified, 'effective': modified,
+                               'portal_type': 'Document', 'outdated': False})
+    return dict([(shard, FakeSolrSearch(shard_docs))
+                 for shard, shard_docs in docs.items()])
+
+
+def timeit(view):
+    start = time.time()
+    view.generate()
+    return time.time() - start
+
+
+def main(app, args):
+    site_id = args and args[0] or 'osha'
+    items = len(args) > 1 and int(args[1]) or 500000
+    folders = len(args) > 2 and int(args[2]) or 1000
+    site = getattr(makerequest(app), site_id)
+    setSite(site)
+    portal_path = '/'.join(site.getPhysicalPath())
+    BenchmarkSiteMapView.searches = makeSearches(portal_path, items, folders)
+    request = site.REQUEST
+
+    request.other['full'] = '1'
+    full = timeit(BenchmarkSiteMapView(site, request))
+    del request.other['full']
+
+    journal = getSitemapJournal(site)
+    for shard in sorted(BenchmarkSiteMapView.searches)[:3]:
+        journal.markDirty(shard)
+    incremental = timeit(BenchmarkSiteMapView(site, request))
+
+    removed = sorted(BenchmarkSiteMapView.searches)[0]
+    filenames = journal.parts[removed][0]
+    del BenchmarkSiteMapView.searches[removed]
+    journal.markDirty(removed)
+    timeit(BenchmarkSiteMapView(site, request))
+    assert removed not in journal.parts
+    assert not [f for f in filenames if f in site.objectIds()]
+
+    print '%8s %8s %8s %10s %17s' % ('items', 'folders', 'shards',
+                                     'full (s)', 'incremental (s)')
+    print '%8d %8d %8d %10.2f %17.2f' % (
+        items, folders, len(journal.parts), full, incremental)
+    transaction.abort()
+
+
+if __name__ == '__main__':
+    main(app, sys.argv[1:])
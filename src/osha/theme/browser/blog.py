@@ -1,7 +1,76 @@
 from Products.Five.browser import BrowserView
+from Products.LinguaPlone.config import RELATIONSHIP
 from plone import api
 from plone.app.discussion.interfaces import IConversation
 
+# how many entries BlogItems resolves at once, the page size of the views
+CHUNK_SIZE = 20
+
+
+class BlogItems(object):
+    """The Blog Entries of a folder as a lazy sequence. An entry is replaced
+    by its translation into lang and woken up only when it is accessed, so
+    a Batch over the sequence only loads the entries on its page.
+
+    The translations of a chunk of entries are found with one query to the
+    reference catalog and one to the portal catalog. The number of comments
+    of the resolved entries is kept in comments, by path.
+    """
+
+    def __init__(self, brains, lang):
+        self._brains = brains
+        self._lang = lang
+        self._objects = {}
+        self.comments = {}
+
+    def __len__(self):
+        return len(self._brains)
+
+    def __nonzero__(self):
+        return len(self._brains) > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index not in self._objects:
+            self._resolve(index)
+        return self._objects[index]
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def _resolve(self, start):
+        """ wake up the translations of the entries from start on """
+        indexes = [index for index in
+                   range(start, min(start + CHUNK_SIZE, len(self)))
+                   if index not in self._objects]
+        brains = [self._brains[index] for index in indexes]
+        canonical = dict([(brain.UID, brain) for brain in brains])
+
+        reference_catalog = api.portal.get_tool('reference_catalog')
+        catalog = api.portal.get_tool('portal_catalog')
+        sources = dict([
+            (reference.sourceUID, reference.targetUID) for reference in
+            reference_catalog(targetUID=canonical.keys(),
+                              relationship=RELATIONSHIP)])
+        translations = {}
+        if sources:
+            for brain in catalog(UID=sources.keys(), Language=self._lang):
+                translations[sources[brain.UID]] = brain
+
+        for index, brain in zip(indexes, brains):
+            brain = translations.get(brain.UID, brain)
+            obj = brain.getObject()
+            total_comments = getattr(brain, 'total_comments', None)
+            if total_comments is not None:
+                self.comments[brain.getPath()] = total_comments
+            self._objects[index] = obj
+
 
 class BlogView(BrowserView):
     """View for the front page of the Blog section."""
@@ -14,15 +83,17 @@ class BlogView(BrowserView):
         return self._get_blog_items(folder=self.context.aq_parent)
 
     def _get_blog_items(self, folder=None):
-        """Return a list of blog items. If blog entry is not available in
-        currently selected language, use the canonical version ('en').
+        """Return the blog items, newest first. If blog entry is not
+        available in currently selected language, use the canonical version
+        ('en').
 
         :param folder: folder where to get the blog items from
-        :returns: a list of 'Blog Entry' objects
+        :returns: a lazy sequence of 'Blog Entry' objects, see BlogItems
         """
         if not folder:
             return
         catalog = api.portal.get_tool('portal_catalog')
+        lang = api.portal.get_tool('portal_languages').getPreferredLanguage()
         path_en = '/'.join(folder.getCanonical().getPhysicalPath())
         items_en = catalog(
             portal_type=['Blog Entry'],
@@ -31,20 +102,15 @@ class BlogView(BrowserView):
             sort_on='effective',
             sort_order='descending'
         )
-
-        results = []
-        for item in items_en:
-            obj = item.getObject()
-            obj_translation = obj.getTranslation()
-
-            if obj_translation:
-                results.append(obj_translation)
-            else:
-                results.append(obj)
-
-        return results
+        self._blog_items = BlogItems(items_en, lang)
+        return self._blog_items
 
     def total_comments(self, obj):
+        items = getattr(self, '_blog_items', None)
+        if items is not None:
+            path = '/'.join(obj.getPhysicalPath())
+            if path in items.comments:
+                return items.comments[path]
         return IConversation(obj).total_comments
 
 class DirectorCornerView(BlogView):
@@ -75,5 +141,10 @@ class BlogRssView(BlogView):
         return self.index()
 
     def blog_items(self):
-        """Return blog items from this folder."""
-        return self._get_blog_items(folder=self.context)
+        """Return the latest blog items from this folder, as many as the
+        feed is configured to show."""
+        items = self._get_blog_items(folder=self.context)
+        if items is None:
+            return items
+        syn = api.portal.get_tool('portal_syndication')
+        return items[:syn.getMaxItems(self.context)]
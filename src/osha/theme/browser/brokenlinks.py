@@ -1,8 +1,16 @@
 import Acquisition
+import csv
+from cStringIO import StringIO
+from operator import itemgetter
 from Products.Five.browser import BrowserView
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from Products.CMFCore.utils import getToolByName
 
+# columns of the csv export
+CSV_COLUMNS = ('path', 'url', 'state', 'reason', 'lastcheck', 'link')
+# rows written to the response at once by the csv export
+CSV_CHUNK_SIZE = 500
+
 class BrokenLinkLog(BrowserView):
     """View for displaying the broken links in PM format
     """
@@ -16,13 +24,25 @@ class BrokenLinkLog(BrowserView):
 
     def broken_links(self):
         """ return all links sorted by path which need PM attention 
+            The documents containing them are looked up with a single
+            portal_catalog query and are not woken up
         """
         context = Acquisition.aq_inner(self.context)
         link_catalog = getToolByName(context, 'portal_linkchecker').database.link_catalog
-        uid_catalog = getToolByName(context, 'uid_catalog')
+        portal_catalog = getToolByName(context, 'portal_catalog')
         results = link_catalog(state=['red', 'orange'])
+
+        uids = set([link.object for link in results])
+        urls = {}
+        if uids:
+            # unrestricted, the report covers documents in every state;
+            # uid_catalog brains have no usable getURL, their paths are
+            # relative to the portal
+            for brain in portal_catalog.unrestrictedSearchResults(
+                    UID=list(uids)):
+                urls[brain.UID] = brain.getURL()
+
         links = []
-        uids = []
         for link in results:
             item = {}
             item["url"] = link.url
@@ -32,13 +52,38 @@ class BrokenLinkLog(BrowserView):
             item["link"] = link.link
             item["state"] = link.state
             item["object"] = link.object
+            # the document may have been removed since the last check
+            item['path'] = urls.get(link.object, '')
             links.append(item)
-            ob = uid_catalog(UID=link.object)[0].getObject()
-            item["document"] = ob
-            item['path'] = ob.absolute_url()
-            
-        links.sort(lambda x,y: cmp(x['path'], y['path']))
+
+        links.sort(key=itemgetter('path'))
         return links
-        
-        
-   
\ No newline at end of file
+
+
+    def csv(self):
+        """ the broken links as csv, written to the response in chunks """
+        response = self.request.response
+        response.setHeader('Content-Type', 'text/csv; charset=utf-8')
+        response.setHeader('Content-Disposition',
+                           'attachment; filename="broken-links.csv"')
+        links = self.broken_links()
+
+        out = StringIO()
+        writer = csv.writer(out)
+        writer.writerow(CSV_COLUMNS)
+        for count, link in enumerate(links):
+            row = []
+            for column in CSV_COLUMNS:
+                value = link[column]
+                if isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                elif value is None:
+                    value = ''
+                row.append(str(value))
+            writer.writerow(row)
+            if not (count + 1) % CSV_CHUNK_SIZE:
+                response.write(out.getvalue())
+                out.seek(0)
+                out.truncate()
+        response.write(out.getvalue())
+        return ''
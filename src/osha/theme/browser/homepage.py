@@ -1,9 +1,13 @@
 from BeautifulSoup import BeautifulSoup
 from DateTime import DateTime
+import Missing
 from Products.CMFCore.utils import getToolByName
 from Products.Five.browser import BrowserView
 from zope.i18nmessageid import MessageFactory
 
+from osha.theme.cache import LRUCache
+from osha.theme.generations import getGenerations, homepageGenerationKey
+
 _ = MessageFactory('osha.theme')
 
 ALLOWED_TAGS = [
@@ -12,6 +16,13 @@ ALLOWED_TAGS = [
 ]
 
 
+HIGHLIGHTS_LIMIT = 4
+IN_FOCUS_LIMIT = 6
+
+# a snapshot of the homepage per language, see getHomepageSnapshot
+homepage_snapshots = LRUCache(maxsize=64)
+
+
 def stripHTML(text):
     soup = BeautifulSoup(text)
     for tag in soup.findAll(True):
@@ -20,6 +31,130 @@ def stripHTML(text):
     return soup.renderContents()
 
 
+def _query(portal_path, lang, folder, **kw):
+    query = dict(
+        portal_type=['News Item'],
+        Language=[lang, ''],
+        review_state='published',
+        path=['%s/%s/%s' % (portal_path, lang, folder)],
+    )
+    query.update(kw)
+    return query
+
+
+def _metadata(brain, columns, name):
+    """ the catalog metadata name of brain, None if there is no such column
+        or the brain was cataloged before it was added
+    """
+    if name not in columns:
+        return None
+    value = brain[name]
+    if value is Missing.Value:
+        return None
+    return value
+
+
+def _snapshotItem(brain, columns, scale):
+    """ an item of the snapshot as plain data, from the catalog metadata;
+        the item is woken up only for what the metadata does not have
+    """
+    obj = None
+    has_image = _metadata(brain, columns, 'hasImage')
+    external_link = _metadata(brain, columns, 'getExternalLink')
+    description = brain.Description
+    if has_image is None or external_link is None or \
+            not (description and description.strip()):
+        obj = brain.getObject()
+    if has_image is None:
+        has_image = bool(obj.getImage())
+    if external_link is None:
+        field = obj.getField('external_link')
+        external_link = field and field.getRaw(obj) or ''
+    if not (description and description.strip()):
+        description = obj.getText()
+    if not isinstance(description, unicode):
+        description = description.decode('utf-8')
+    return dict(
+        path=brain.getPath(),
+        image=has_image and scale or '',
+        description=description,
+        title=brain.Title,
+        date=brain.effective,
+        external_link=external_link,
+    )
+
+
+def _snapshotItems(catalog, portal_path, lang, folder, scale, limit, now):
+    """ the latest limit published News Items in folder as plain data, and
+        the date they have to be fetched again at, when one of them expires
+        or the next item becomes effective
+    """
+    res = catalog(**_query(
+        portal_path, lang, folder,
+        sort_order='reverse', sort_on='effective',
+        expires={'query': now, 'range': 'min'},
+        effective={'query': now, 'range': 'max'},
+        sort_limit=limit,
+    ))[:limit]
+    # unrestricted, items that are not effective yet are hidden otherwise
+    pending = catalog.unrestrictedSearchResults(**_query(
+        portal_path, lang, folder,
+        sort_on='effective',
+        effective={'query': now, 'range': 'min'},
+        sort_limit=1,
+    ))[:1]
+
+    dates = [brain.expires for brain in res] + \
+        [brain.effective for brain in pending]
+    dates = [date for date in dates if isinstance(date, DateTime)]
+    valid_until = dates and min(dates) or None
+
+    columns = catalog.schema()
+    items = []
+    for brain in res:
+        items.append(_snapshotItem(brain, columns, scale))
+    return tuple(items), valid_until
+
+
+def getHomepageSnapshot(context, lang):
+    """ the highlights and in focus items of the homepage in lang as plain
+        data, without urls, so that the homepage can be rendered without
+        querying the catalog or waking up the items.
+
+        A snapshot is taken once per process and language and taken again
+        when the homepage generation of the language is bumped (see
+        osha.theme.generations), when one of its items expires or when the
+        next item becomes effective.
+    """
+    portal = getToolByName(context, 'portal_url').getPortalObject()
+    portal_path = '/'.join(portal.getPhysicalPath())
+    key = (portal_path, lang)
+    stamp = getGenerations(homepageGenerationKey(lang))
+    now = DateTime()
+    entry = homepage_snapshots.lookup(key)
+    if entry is not None and entry['stamp'] == stamp and \
+            (entry['valid_until'] is None or now < entry['valid_until']):
+        return entry
+
+    catalog = getToolByName(context, 'portal_catalog')
+    highlights, highlights_until = _snapshotItems(
+        catalog, portal_path, lang, 'teaser', 'image_mini',
+        HIGHLIGHTS_LIMIT, now)
+    in_focus, in_focus_until = _snapshotItems(
+        catalog, portal_path, lang, 'in-focus', 'image_thumb',
+        IN_FOCUS_LIMIT, now)
+    dates = [date for date in (highlights_until, in_focus_until)
+             if date is not None]
+    entry = dict(
+        stamp=stamp,
+        valid_until=dates and min(dates) or None,
+        highlights=highlights,
+        in_focus=in_focus,
+    )
+    homepage_snapshots.set(key, entry)
+    return entry
+
+
 class HomepageView(BrowserView):
 
     def __init__(self, context, request=None):
@@ -44,26 +179,28 @@ class HomepageView(BrowserView):
         else:
             return dict(link=intro.absolute_url())
 
+    def _snapshot(self):
+        """ the snapshot of the homepage in the preferred language, see
+            getHomepageSnapshot
+        """
+        return getHomepageSnapshot(self.context, self.pref_lang)
+
+    def _item(self, item):
+        url = self.request.physicalPathToURL(item['path'])
+        return dict(
+            link=url,
+            img_url=item['image'] and '%s/%s' % (url, item['image']) or '',
+            description=item['description'],
+            title=item['title'],
+            date=item['date'],
+            external_link=item['external_link'],
+        )
+
     @property
-    def highlights(self, limit=4):
+    def highlights(self):
         """Fetch the latest X teasers"""
-        pc = getToolByName(self.context, 'portal_catalog')
-        portal_transforms = getToolByName(self.context, 'portal_transforms')
-        ploneview = self.context.restrictedTraverse('@@plone')
-        now = DateTime()
-        res = pc(
-            portal_type=['News Item'],
-            Language=[self.pref_lang, ''],
-            sort_order='reverse', sort_on='effective',
-            expires={'query': now, 'range': 'min'},
-            effective={'query': now, 'range': 'max'},
-            review_state='published',
-            path=['%s/%s/teaser' % (self.portal_path, self.pref_lang)],
-        )
-        if len(res) and limit > 0:
-            res = res[:limit]
-        if len(res) == 0:
-            now = DateTime()
+        items = self._snapshot()['highlights']
+        if len(items) == 0:
             return [
                 dict(
                     link='',
@@ -73,75 +210,21 @@ class HomepageView(BrowserView):
                     date=DateTime(),
                 )
             ]
-        ret = list()
-        for r in res:
-            obj = r.getObject()
-            link = obj.absolute_url()
-            img_url = obj.getImage() and \
-                obj.getImage().absolute_url() or ''
-            # use 'mini' scale
-            img_url = img_url.replace('/image', '/image_mini')
-            description = obj.Description().strip() != '' and \
-                obj.Description() or obj.getText()
-            if not isinstance(description, unicode):
-                description = description.decode('utf-8')
-            date = obj.effective()
-            ret.append(
-                dict(
-                    link=link,
-                    img_url=img_url,
-                    description=description,
-                    title=obj.Title(),
-                    date=date,
-                )
-            )
-        return ret
+        return [self._item(item) for item in items]
 
     @property
-    def in_focus(self, limit=6):
+    def in_focus(self):
         """Fetch the latest X In Focus news"""
-        pc = getToolByName(self.context, 'portal_catalog')
-        now = DateTime()
-        res = pc(
-            portal_type=['News Item'],
-            Language=[self.pref_lang, ''],
-            sort_order='reverse', sort_on='effective',
-            expires={'query': now, 'range': 'min'},
-            effective={'query': now, 'range': 'max'},
-            review_state='published',
-            path=['%s/%s/in-focus' % (self.portal_path, self.pref_lang)]
-        )
-        if len(res) and limit > 0:
-            res = res[:limit]
-        if len(res) == 0:
-            now = DateTime()
-            yield dict(
-                link='',
-                description='No items for In Focus were found',
-                title='No Focus',
-                img_url='',
-                external_link='',
-                date=DateTime(),
-            )
-        for r in res:
-            obj = r.getObject()
-            link = obj.absolute_url()
-            field = obj.getField('external_link')
-            external_link = field and field.getRaw(obj) or ''
-            img_url = obj.getImage() and \
-                obj.getImage().absolute_url() or ''
-            # use 'thumb' scale
-            img_url = img_url.replace('/image', '/image_thumb')
-            description = obj.Description().strip() != '' and \
-                obj.Description() or obj.getText()
-            if not isinstance(description, unicode):
-                description = description.decode('utf-8')
-            date = obj.effective()
-            yield dict(
-                link=link,
-                img_url=img_url,
-                description=description,
-                title=obj.Title(),
-                date=date,
-                external_link=external_link,
-            )
+        items = self._snapshot()['in_focus']
+        if len(items) == 0:
+            return [
+                dict(
+                    link='',
+                    description='No items for In Focus were found',
+                    title='No Focus',
+                    img_url='',
+                    external_link='',
+                    date=DateTime(),
+                )
+            ]
+        return [self._item(item) for item in items]
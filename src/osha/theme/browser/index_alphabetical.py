@@ -3,6 +3,25 @@ from plone.memoize import ram
 from Products.Five.browser import BrowserView
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from Products.CMFCore.utils import getToolByName
+from osha.theme.browser.utils import allowedRolesAndUsers, search_facets, \
+    showInactive
+from osha.theme.thesaurus import getCaptionTable
+
+def getTermCounts(context, term_ids=None):
+    """ returns a dict with the number of published items of each thesaurus
+        term in term_ids, all terms if term_ids is None.
+
+        The counts are one Solr facet on multilingual_thesaurus, restricted
+        to the items the current user may view, instead of a catalog query
+        per term.
+    """
+    counts = search_facets(context, 'review_state:published',
+                           ['multilingual_thesaurus'])
+    counts = counts['multilingual_thesaurus']
+    if term_ids is None:
+        return counts
+    return dict([(term_id, counts.get(term_id, 0)) for term_id in term_ids])
+
 
 class IndexAlphabetical(BrowserView):
     """View for displaying the thesaurus by alphabet
@@ -18,7 +37,7 @@ class IndexAlphabetical(BrowserView):
         
         self.lang = portal_languages.getPreferredLanguage()
         self.manager = portal_vocabularies.MultilingualThesaurus._getManager() 
-        self.term_dict = self.manager.term_dict
+        self.table = getCaptionTable(context, self.lang, self.manager)
         self.letter = str(self.request.get('letter', '')).upper()
         if len(self.letter)==2:
             try:
@@ -30,23 +49,10 @@ class IndexAlphabetical(BrowserView):
         return self.template() 
 
 
-    def _getInitials_cachekey(method, self):
-        return ("thesaurusinitials", self.lang)    
-        
-    @ram.cache(_getInitials_cachekey)
     def getInitials(self):
         """ fetch the whole alphabet """
-        initials = {}
-        for term_id in self.term_dict.keys():   
-            term = self.term_dict[term_id]
-            caption = self.manager.getTermCaptionById(term_id, self.lang).strip()
-            if len(caption)==0:
-                continue
-            initial = caption[0].upper()
-            section = initials.get(initial, [])
-            section.append((caption, term_id))
-            initials[initial] = section
-        return initials
+        return dict([(initial, self.table.items(initial))
+                     for initial in self.table.initials()])
         
     def getAlphabet(self):
         """ fetch the whole alphabet """
@@ -101,32 +107,26 @@ class IndexAlphabetical(BrowserView):
         return self.term_id
 
     def getCaptionById(self, term_id):
-        return self.manager.getTermCaptionById(term_id, self.lang)
+        return self.table.caption(term_id)
 
     def getIdByCaption(self, caption):
-        return self.caption_termid.get(caption, '')        
-        
+        return self.table.termId(caption)        
         
-    def _searchCatalogForTerm_cachekey(method, self, term_id):
-        return ("termresults", term_id)    
         
-    @ram.cache(_searchCatalogForTerm_cachekey)
-    def _searchCatalogForTerm(self, term_id):
-        """ search the catalog for all items on a subject 
-            this is to be cached 
-        """
-        start = time.time()
-        context = Acquisition.aq_inner(self.context)        
-        portal_catalog = getToolByName(context, 'portal_catalog')
+    def _getTermCounts_cachekey(method, self):
+        # recounted every 10 minutes, per allowedRolesAndUsers of the user
+        context = Acquisition.aq_inner(self.context)
+        return ("termcounts", allowedRolesAndUsers(context),
+                showInactive(context), time.time() // 600)
 
-        query = {'multilingual_thesaurus': term_id,
-                 'Language': '', 
-                 'review_state': 'published'
-                }
-        results = portal_catalog(query)                
-        stop = time.time() 
-        print "SearchTerm %s time is %s" % (self.term_id, stop-start)
-        return len(results)
+    @ram.cache(_getTermCounts_cachekey)
+    def getTermCounts(self):
+        """ the number of published items of every term """
+        return getTermCounts(Acquisition.aq_inner(self.context))
+
+    def _searchCatalogForTerm(self, term_id):
+        """ the number of published items on a term """
+        return self.getTermCounts().get(term_id, 0)
         
     def getTerm(self):
         portal_languages = getToolByName(self.context, 'portal_languages')
@@ -135,7 +135,7 @@ class IndexAlphabetical(BrowserView):
         term_id = self.term_id
         TERM = self.manager.getTermById(term_id)
         
-        caption = self.manager.getTermCaptionById(term_id, self.lang)
+        caption = self.table.caption(term_id)
         term = dict(id=self.term_id, Title=caption)
 
         results = self._searchCatalogForTerm(self.term_id)
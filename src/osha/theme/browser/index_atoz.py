@@ -1,24 +1,182 @@
-import Acquisition, time
-from plone.memoize import ram
+import Acquisition
+from BTrees.Length import Length
+from BTrees.OIBTree import OIBTree
+from BTrees.OOBTree import OOBTree, OOTreeSet
+from persistent import Persistent
+from zope.annotation.interfaces import IAnnotations
+from zope.app.component.hooks import getSite
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
 from Products.Five.browser import BrowserView
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from Products.CMFCore.utils import getToolByName
+from zLOG import LOG, INFO
+from osha.theme.browser.utils import getIndexableValues, getOldPath
+from osha.theme.cache import LRUCache
+from osha.theme.thesaurus import getCaptionTable
+
+ATOZ_KEY = 'osha.theme.atoz'
+# the catalog query for the items the A-Z index holds
+ATOZ_QUERY = {'review_state': 'published',
+              'allowedRolesAndUsers': ['Anonymous']}
+
+# initial -> caption -> (count, term ids) per Subject and language, see
+# IndexAtoZView._getCaptions
+atoz_captions = LRUCache(maxsize=64)
+
+
+class AtoZIndex(Persistent):
+    """Maps a Subject to the thesaurus terms of the published items
+    categorized on it, and every term to the paths of those items. The
+    subject '' stands for all published items.
+
+    Only items that are published, viewable by Anonymous and have terms are
+    held, so that the index is the same for every user; the results are
+    looked up in the catalog for the current user when they are shown. The
+    index is built by buildAtoZIndex and kept up to date by updateAtoZIndex.
+    The number of items per term is kept as well, so that the counts can be
+    shown without loading the paths.
+    """
+
+    built = False
+
+    def __init__(self):
+        # subject -> OOBTree(term id -> OOTreeSet of paths)
+        self.subjects = OOBTree()
+        # subject -> OIBTree(term id -> number of paths)
+        self.counts = OOBTree()
+        # bumped on every change, for caches of the counts
+        self.changes = Length()
+        # path -> (subjects, term ids)
+        self.records = OOBTree()
+
+    def build(self, brains):
+        """ index the items from catalog brains """
+        for brain in brains:
+            self.index(brain.getPath(), brain.Subject or (),
+                       brain.getMTSubject or ())
+        self.built = True
+
+    def index(self, path, subjects, term_ids):
+        self.unindex(path)
+        subjects = tuple(subjects)
+        term_ids = tuple(term_ids)
+        if not term_ids:
+            return
+        for subject in subjects + ('', ):
+            terms = self.subjects.get(subject)
+            if terms is None:
+                terms = self.subjects[subject] = OOBTree()
+                self.counts[subject] = OIBTree()
+            counts = self.counts[subject]
+            for term_id in term_ids:
+                paths = terms.get(term_id)
+                if paths is None:
+                    paths = terms[term_id] = OOTreeSet()
+                if paths.insert(path):
+                    counts[term_id] = counts.get(term_id, 0) + 1
+        self.records[path] = (subjects, term_ids)
+        self.changes.change(1)
+
+    def unindex(self, path):
+        record = self.records.get(path)
+        if record is None:
+            return
+        del self.records[path]
+        self.changes.change(1)
+        subjects, term_ids = record
+        for subject in subjects + ('', ):
+            terms = self.subjects.get(subject)
+            if terms is None:
+                continue
+            counts = self.counts[subject]
+            for term_id in term_ids:
+                paths = terms.get(term_id)
+                if paths is None or not paths.has_key(path):
+                    continue
+                paths.remove(path)
+                if not paths:
+                    del terms[term_id]
+                    del counts[term_id]
+                else:
+                    counts[term_id] -= 1
+            if not terms:
+                del self.subjects[subject]
+                del self.counts[subject]
+
+    def terms(self, subject):
+        """ term id -> number of items on subject """
+        return self.counts.get(subject, {})
+
+    def paths(self, subject, term_id):
+        """ the paths of the items on subject categorized with term_id """
+        return self.subjects.get(subject, {}).get(term_id, ())
+
+
+def getAtoZIndex(site, create=False):
+    """ returns the A-Z index of site, None if it has never been used unless
+        create is True
+    """
+    ann = IAnnotations(site)
+    if create:
+        return ann.setdefault(ATOZ_KEY, AtoZIndex())
+    return ann.get(ATOZ_KEY)
+
+
+def buildAtoZIndex(portal):
+    """ async job: build the A-Z index of portal from the catalog. The A-Z
+        page queries the catalog directly until the index is built.
+    """
+    portal_catalog = getToolByName(portal, 'portal_catalog')
+    index = AtoZIndex()
+    query = dict(ATOZ_QUERY)
+    query['multilingual_thesaurus'] = list(
+        portal_catalog.uniqueValuesFor('multilingual_thesaurus'))
+    index.build(portal_catalog.unrestrictedSearchResults(query))
+    IAnnotations(portal)[ATOZ_KEY] = index
+    LOG('osha.theme.index_atoz', INFO,
+        'Built the A-Z index, %d items' % len(index.records))
+
+
+def updateAtoZIndex(obj, event):
+    """ event handler: reindex obj in the A-Z index """
+    site = getSite()
+    if site is None:
+        return
+    index = getAtoZIndex(site)
+    if index is None or not index.built:
+        return
+    if 'portal_factory' in obj.getPhysicalPath():
+        return
+    path = '/'.join(obj.getPhysicalPath())
+    if IObjectMovedEvent.providedBy(event):
+        oldPath = getOldPath(obj, event)
+        if oldPath is not None:
+            index.unindex(oldPath)
+        if event.newParent is None:
+            # removed
+            return
+    values = getIndexableValues(obj, (
+        'review_state', 'allowedRolesAndUsers', 'Subject', 'getMTSubject'))
+    if values['review_state'] != ATOZ_QUERY['review_state'] or \
+            'Anonymous' not in (values['allowedRolesAndUsers'] or ()):
+        index.unindex(path)
+        return
+    index.index(path, values['Subject'] or (), values['getMTSubject'] or ())
+
 
 class IndexAtoZView(BrowserView):
     """View for displaying the publications overview page at /xx/publications
     """
     template = ViewPageTemplateFile('templates/atoz.pt')
-    
+
     def __call__(self):
         self.request.set('disable_border', True)
-        context = Acquisition.aq_inner(self.context)        
-        
-        portal_vocabularies = getToolByName(context, 'portal_vocabularies')
+        context = Acquisition.aq_inner(self.context)
+
         portal_languages = getToolByName(context, 'portal_languages')
-        
+
         self.lang = portal_languages.getPreferredLanguage()
-        self.manager = portal_vocabularies.MultilingualThesaurus._getManager() 
-        self.term_dict = self.manager.term_dict
+        self.table = getCaptionTable(context, self.lang)
         self.Subject = self.request.get('Subject', context.getProperty('keyword', None))
         self.letter = str(self.request.get('letter', '')).upper()
         if len(self.letter)==2:
@@ -27,121 +185,98 @@ class IndexAtoZView(BrowserView):
             except:
                 print "index_atoz:: could not convert to unicode"
         self.term_id = self.request.get('term_id', '')
-                
-        return self.template() 
-        
-        
+
+        return self.template()
+
+
     def getAlphabet(self):
         """ fetch the whole alphabet """
-        
-        initials = {}
-        for term_id in self.term_dict.keys():   
-            caption = self.manager.getTermCaptionById(term_id, self.lang).strip()
-            if len(caption)==0:
-                continue
-            initial = caption[0].upper()
-            section = initials.get(initial, [])
-            section.append(caption)
-            initials[initial] = section
-            
-        self.initials = initials
-        alphabet = initials.keys()
-        alphabet.sort()
+        alphabet = self.table.initials()
+        self.initials = dict([(initial, self.table.captions(initial))
+                              for initial in alphabet])
         self.alphabet = alphabet
         return alphabet
 
-    def _searchCatalog_cachekey(method, self):
-        return ("published_by_subject_alllanguages", self.Subject)
-        
-    @ram.cache(_searchCatalog_cachekey)
-    def _searchCatalog(self):
-        """ search the catalog for all items on a subject 
-            this is to be cached 
+    def _getIndex(self):
+        """ the A-Z index; until it is built, a transient one made from the
+            catalog results of the current Subject
         """
-        start = time.time()
+        portal = getToolByName(self.context, 'portal_url').getPortalObject()
+        index = getAtoZIndex(portal)
+        if index is not None and index.built:
+            return index
+        portal_catalog = getToolByName(portal, 'portal_catalog')
+        index = AtoZIndex()
+        index.build(portal_catalog(Language='', Subject=self.Subject or '',
+                                   review_state='published'))
+        return index
+
+    def _getCaptions(self):
+        """ initial -> caption -> (number of items, term ids) of the terms
+            used on the current Subject, cached per Subject and language
+            until the index or the caption table change
+        """
+        subject = self.Subject or ''
+        portal = getToolByName(self.context, 'portal_url').getPortalObject()
+        key = ('/'.join(portal.getPhysicalPath()), subject, self.lang)
+        # a transient index is not cached
+        persistent = self.index._p_jar is not None
+        stamp = self.index.changes()
+        entry = persistent and atoz_captions.lookup(key) or None
+        if entry is not None and entry[0] == stamp and \
+                entry[1] is self.table:
+            return entry[2]
+
+        captions = {}
+        for term_id, count in self.index.terms(subject).items():
+            caption = self.table.caption(term_id)
+            if not caption:
+                continue
+            initial = caption[0].upper()
+            section = captions.setdefault(initial, {})
+            total, term_ids = section.get(caption, (0, ()))
+            section[caption] = (total + count, term_ids + (term_id, ))
+        if persistent:
+            atoz_captions.set(key, (stamp, self.table, captions))
+        return captions
 
-        context = Acquisition.aq_inner(self.context)
-        portal_catalog = getToolByName(context, 'portal_catalog')
-
-        query = {'Language': '', 
-                 'Subject': self.Subject or '', 
-                 'review_state': 'published'
-                }
-        results = portal_catalog(query)
-        stop = time.time()
-        print "Catalog time is %s" % (stop-start)
-        # The brain objects fetch the values potentially lazy only if needed. 
-        # This may be bad for caching and seems to result in the hard to debug 
-        # ConnectionStateError: Shouldn't load state for 0x3768d0 when the connection is closed error. 
-        # I therefore copy the results over into a static datastructure.
-        sres = []
-        schema = portal_catalog.schema()
-        for result in results:
-            staticbrain = {}
-            for key in schema:
-                staticbrain[key] = result[key]
-            staticbrain['getURL'] = result.getURL()
-            staticbrain['getPath'] = result.getPath()
-            
-            sres.append(staticbrain)
-            
-        return sres
-        
-        
     def resultsByKeyword(self):
-        """ search all objects which are categorized on given Subject
-            and order them by alphabetical thesaurus term 
+        """ the number of objects which are categorized on given Subject
+            per thesaurus term, ordered by alphabetical thesaurus term
             E.g.
-                {'A': [brain, brain]}
+                {'A': {caption: count}}
         """
-        start = time.time()
+        self.index = self._getIndex()
+        self.captions = self._getCaptions()
+        captions = dict([
+            (initial, dict([(caption, count) for caption, (count, term_ids)
+                            in section.items()]))
+            for initial, section in self.captions.items()])
 
-        results = self._searchCatalog()
-        
-        caption_termid = {}
-        captions = {}
-        for result in results:
-            term_ids = result['getMTSubject'] or []
-            for term_id in term_ids:
-                caption = self.manager.getTermCaptionById(term_id, self.lang)
-                caption_termid[caption] = term_id
-                if not caption or len(caption)==0:
-                    print "Caption error", caption
-                    continue
-                initial = caption[0].upper()
-                section = captions.get(initial, {})
-                captionmap = section.get(caption, [])
-                captionmap.append(result)
-                section[caption] = captionmap
-                captions[initial] = section
-                
-        self.captions = captions
-        self.caption_termid = caption_termid
-
-        initials = self.captions.keys()
+        initials = captions.keys()
         initials.sort()
         if not self.letter:
             self.letter = len(initials) and initials[0] or 'A'
-            
-        stop = time.time()
-        print "search duration %s secs" % (stop-start)
+
         return captions
-        
 
-        
+
+
     def resultsByLetter(self, letter=None):
         """ returns the sorted resultmap by letter based on the search above """
         if letter is None:
             letter = self.getLetter()
         if letter == '':
             return [[], {}]
-            
-        results = self.captions.get(letter, {})
+
+        section = self.captions.get(letter, {})
+        results = dict([(caption, count) for caption, (count, term_ids)
+                        in section.items()])
         reskeys = results.keys()
         reskeys.sort(lambda x,y: cmp(x.lower(), y.lower()))
         return (reskeys, results)
-        
-        
+
+
     def resultsByTermId(self, letter=None, term_id=None):
         """ returns the results sorted by ? based on letter and term_id
         """
@@ -155,11 +290,21 @@ class IndexAtoZView(BrowserView):
         if term_id == '':
             return []
 
-        resmap = self.captions.get(letter, {})        
-        results = resmap.get(self.getCaptionById(term_id), [])
-        return results
-        
-        
+        resmap = self.captions.get(letter, {})
+        count, term_ids = resmap.get(self.getCaptionById(term_id), (0, ()))
+        subject = self.Subject or ''
+        paths = set()
+        for term_id in term_ids:
+            paths.update(self.index.paths(subject, term_id))
+        if not paths:
+            return []
+        # the catalog applies the roles of the current user and the
+        # effective dates
+        portal_catalog = getToolByName(self.context, 'portal_catalog')
+        return portal_catalog(path={'query': sorted(paths), 'depth': 0},
+                              Language='', review_state='published')
+
+
     def getSubject(self):
         return self.Subject
 
@@ -170,7 +315,7 @@ class IndexAtoZView(BrowserView):
         return self.term_id
 
     def getCaptionById(self, term_id):
-        return self.manager.getTermCaptionById(term_id, self.lang)
+        return self.table.caption(term_id)
 
     def getIdByCaption(self, caption):
-        return self.caption_termid.get(caption, '')        
\ No newline at end of file
+        return self.table.termId(caption)
@@ -1,7 +1,7 @@
 import Acquisition
 from Products.Five.browser import BrowserView
 from Products.CMFCore.utils import getToolByName
-from zope.component import getMultiAdapter
+from osha.theme.browser.utils import search_facets
 
 class IndexROMetadataView(BrowserView):
     """View for displaying the ro content filter page 
@@ -32,68 +32,54 @@ class IndexROMetadataView(BrowserView):
         else:
             return ''   
 
-    def findDistinctValues(self, act_md, act_mdval):
-        """ search the catalog for all entries which are within the riskob and match the given keyword """
-        portal_catalog = getToolByName(self.context, 'portal_catalog')
-        portal_countryutils = getToolByName(self.context, 'portal_countryutils')
-        
-        portal_state = getMultiAdapter((self.context, self.request), name=u'plone_portal_state')
-        navigation_root_path = portal_state.navigation_root_path()
-            
-        query = {
-                 'Language': 'all',
-                 'review_state': 'published'
-                    }
-        if act_md=='country':
-            query[act_md] = act_mdval
+    def _facetCounts(self, act_md, act_mdval):
+        """ one Solr query with facets on osha_metadata and country for the
+            published entries matching the given keyword that the user may
+            view
+            returns {'ero_topic': {value: count}, 'country': {..}, ..}
+        """
+        if act_md == 'country':
+            field = 'country'
         else:
-            query['osha_metadata'] = "%s::%s" %(act_md, act_mdval)
-        results = portal_catalog(query)
+            field = 'osha_metadata'
+            act_mdval = "%s::%s" % (act_md, act_mdval)
+        query = '%s:"%s" AND review_state:published' % (
+            field, act_mdval.replace('\\', '\\\\').replace('"', '\\"'))
+        facets = search_facets(self.context, query,
+                               ['osha_metadata', 'country'])
 
-        TO = set()
-        CO = set()
-        TG = set()
-        for result in results:
-            if result['getCountry']:
-                CO = CO.union(result['getCountry'])                    
-            if result['getOsha_metadata']:
-                for elem in result['getOsha_metadata']:
-                    if elem.find('::'):
-                        key, val = elem.split('::')
-                        if key=='ero_topic':
-                            TO.add(val)
-                        if key=='ero_target_group':
-                            TG.add(val)
+        counts = dict([(md, {}) for md in self.mdelems])
+        counts['country'].update(facets['country'])
+        for elem, count in facets['osha_metadata'].items():
+            if '::' not in elem:
+                continue
+            key, val = elem.split('::', 1)
+            if key in counts:
+                counts[key][val] = count
+        return counts
 
-        TO = list(TO)
-        CO = list(CO)
-        TG = list(TG)
-        
-        COS = []        
-        path = self.context.absolute_url()+"/search_ro?"+act_md+'='+act_mdval+'&country=%s'  
-        for country in CO:
-            COS.append((portal_countryutils.getCountryByIsoCode(country).name, country, path%country)) 
-        COS.sort(lambda x,y: cmp(x[0], y[0]))
+    def findDistinctValues(self, act_md, act_mdval):
+        """ the distinct topics, countries and target groups of the entries
+            which are within the riskob and match the given keyword, as
+            (title, value, url) sorted by title
+        """
+        portal_countryutils = getToolByName(self.context, 'portal_countryutils')
+        counts = self._facetCounts(act_md, act_mdval)
 
-        TGS = []
-        path = self.context.absolute_url()+"/search_ro?"+act_md+'='+act_mdval+'&ero_target_group=%s'  
-        for tg in TG:
-            tgn = self.pretty(tg)
-            TGS.append((tgn, tg, path%tg))
-        TGS.sort(lambda x,y: cmp(x[0], y[0]))
+        path = self.context.absolute_url()+"/search_ro?"+act_md+'='+act_mdval+'&%s=%s'
+        distinct = {}
+        for md in self.mdelems:
+            values = []
+            for value in counts[md]:
+                if md == 'country':
+                    title = portal_countryutils.getCountryByIsoCode(value).name
+                else:
+                    title = self.pretty(value)
+                values.append((title, value, path % (md, value)))
+            values.sort(lambda x,y: cmp(x[0], y[0]))
+            distinct[md] = values
+        return distinct
 
-        TOS = []
-        path = self.context.absolute_url()+"/search_ro?"+act_md+'='+act_mdval+'&ero_topic=%s'  
-        for to in TO:
-            ton = self.pretty(to)
-            TOS.append((ton, to, path%to))
-        TOS.sort(lambda x,y: cmp(x[0], y[0]))
-        
-        return {'ero_topic': TOS, 
-                'country': COS, 
-                'ero_target_group': TGS}
-                        
-                        
     def summary(self):
         """ check if summary exists and return its description if so """
         if self.act_md=='ero_topic' and 'summary_html' in self.context.objectIds():
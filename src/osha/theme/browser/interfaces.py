@@ -15,6 +15,24 @@ class IMaintenanceView(Interface):
     def convertLPFolders():
         """ convert Large Plone Folders to Folders """
 
+    def queueLPFolderConversion():
+        """ convert Large Plone Folders to Folders with plone.app.async """
+
+    def queueROMetadataIndexBuild():
+        """ build the Risk Observatory search index with plone.app.async """
+
+    def queueAtoZIndexBuild():
+        """ build the A-Z index with plone.app.async """
+
+class ILinguaToolsView(Interface):
+    """ do one thing for all language versions of the context """
+
+    def submit(operation, *args):
+        """ run operation for all languages as a background job """
+
+    def jobs():
+        """ the background jobs of the context, newest first """
+
 class IOSHmailView(Interface):
     """ oshmail overview including subscription """
 
@@ -298,3 +316,41 @@ class ICompetitionsView(Interface):
 
 class ICompetitionDetail(Interface):
     """ Detail view of one competition """
+
+class IOSHARequestContext(Interface):
+    """ Values that every viewlet and portlet needs, computed once per
+    request and shared (adapt the request to get it)
+    """
+
+    def preferredLanguage(context):
+        """ the preferred language of portal_languages """
+
+    def defaultLanguage(context):
+        """ the default language of portal_languages """
+
+    def portalState(context):
+        """ the plone_portal_state view of context """
+
+    def oshaview(context):
+        """ the oshaview of context """
+
+    def navigationRootPath(context):
+        """ the navigation root path of context """
+
+    def navigationRootUrl(context):
+        """ the navigation root url of context """
+
+    def subsiteRootPath(context):
+        """ the path of the subsite context is in """
+
+    def currentSingleEntryPoint():
+        """ the SEP in the published path, None if there is none """
+
+    def currentSubsite():
+        """ the subsite in the published path, None if there is none """
+
+    def serverURL():
+        """ the SERVER_URL of the request """
+
+    def info():
+        """ a dict with the number of computed and of shared lookups """
@@ -1,5 +1,13 @@
 import Acquisition, types
+import logging
+import transaction
 from time import time
+from BTrees.OOBTree import OOBTree
+from DateTime import DateTime
+from persistent import Persistent
+from persistent.mapping import PersistentMapping
+from ZODB.POSException import ConflictError
+from zope.annotation.interfaces import IAnnotations
 from osha.theme.browser.interfaces import ILinguaToolsView
 from Products.CMFCore.utils import getToolByName
 from Products.Five import BrowserView
@@ -9,7 +17,7 @@ from plone.memoize import ram
 from plone.portlets.constants import CONTEXT_CATEGORY, GROUP_CATEGORY, CONTENT_TYPE_CATEGORY
 from plone.app.portlets.portlets import navigation, news, classic, events, search
 from plone.app.portlets.utils import assignment_mapping_from_key
-from zope.component import getMultiAdapter, getUtility
+from zope.component import getMultiAdapter, getUtility, queryUtility
 from plone.portlets.interfaces import IPortletManager, ILocalPortletAssignmentManager
 from zope.event import notify
 from zope.lifecycleevent import ObjectCopiedEvent
@@ -20,11 +28,104 @@ from OFS.event import ObjectClonedEvent
 from Products.PloneLanguageTool.LanguageTool import LanguageTool
 from p4a.subtyper.interfaces import ISubtyper
 from slc.subsite.root import getSubsiteRoot
+from plone.app.async.interfaces import IAsyncService
 
 from zope.i18n import translate
 
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 
+log = logging.getLogger('osha.theme.linguatools')
+
+JOBS_KEY = 'osha.theme.linguatools.jobs'
+# objects handled per transaction by fixTranslationReference(recursive=True)
+FIX_CHUNK_SIZE = 100
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+# the operations that run per language (through _forAllLangs) and can
+# therefore be run as resumable background jobs
+JOB_OPERATIONS = frozenset([
+    'blockPortlets', 'setExcludeFromNav', 'setEnableNextPrevious',
+    'setTitle', 'renamer', 'fixOrder', 'deleter', 'propagatePortlets',
+    'setProperty', 'delProperty', 'setTranslatedTitle',
+    'setTranslatedDescription', 'addLanguageTool', 'subtyper', 'reindexer',
+    'publisher', 'hider', 'setRichDocAttachments',
+])
+
+
+class LinguaToolsJob(Persistent):
+    """ A LinguaTools operation on all languages, run in the background by
+    runLinguaToolsJob. Every language is committed on its own and keeps its
+    status and messages, so that a job can be resumed after a restart and a
+    failed language retried without touching the others.
+    """
+
+    def __init__(self, id, operation, args, langs):
+        self.id = id
+        self.operation = operation
+        self.args = tuple(args)
+        self.langs = tuple(langs)
+        self.created = DateTime()
+        # lang -> PENDING, DONE or FAILED
+        self.status = PersistentMapping([(lang, PENDING) for lang in langs])
+        # lang -> messages of the last run
+        self.messages = PersistentMapping()
+
+    def setStatus(self, lang, status, messages=()):
+        self.status[lang] = status
+        self.messages[lang] = tuple(messages)
+
+    def pending(self):
+        """ the languages that are not done yet """
+        return [lang for lang in self.langs if self.status.get(lang) != DONE]
+
+    def failed(self):
+        return [lang for lang in self.langs if self.status.get(lang) == FAILED]
+
+    def progress(self):
+        """ (number of languages done, number of languages) """
+        return len(self.langs) - len(self.pending()), len(self.langs)
+
+
+def getLinguaToolsJobs(context, create=False):
+    """ the jobs of context by id, None if there are none unless create is
+        True
+    """
+    ann = IAnnotations(context)
+    if create:
+        return ann.setdefault(JOBS_KEY, OOBTree())
+    return ann.get(JOBS_KEY)
+
+
+def runLinguaToolsJob(context, jobid, langs=None):
+    """ run the job for langs, by default all languages that are not done
+        yet. Called by plone.app.async.
+    """
+    jobs = getLinguaToolsJobs(context)
+    job = jobs is not None and jobs.get(jobid) or None
+    if job is None:
+        log.warn('No LinguaTools job %s on %s' % (
+            jobid, '/'.join(context.getPhysicalPath())))
+        return
+    view = LinguaToolsView(context, getattr(context, 'REQUEST', None))
+    if langs is None:
+        langs = job.pending()
+    for lang in langs:
+        view.langs = [lang]
+        try:
+            messages = getattr(view, job.operation)(*job.args)
+        except ConflictError:
+            # let zc.async retry, the languages done so far are committed
+            raise
+        except Exception, e:
+            transaction.abort()
+            log.exception('LinguaTools job %s failed for %s' % (jobid, lang))
+            job.setStatus(lang, FAILED, ['%s: %s' % (e.__class__.__name__, e)])
+        else:
+            job.setStatus(lang, DONE, messages or ())
+        transaction.commit()
+
 
 class LinguaToolsView(BrowserView):
     implements(ILinguaToolsView)
@@ -38,61 +139,61 @@ class LinguaToolsView(BrowserView):
 #        self.lang = portal_languages.getPreferredLanguage()
         if self.request.has_key("form.button.UpdateTitle"):
             title = self.request.get('title', "no Title")
-            self.result=self.setTitle(title) 
+            self.result=self.submit('setTitle', title) 
             
         if self.request.has_key("form.button.propagatePortlets"):
-            self.result=self.propagatePortlets() 
+            self.result=self.submit('propagatePortlets') 
 
         if self.request.has_key("form.button.addLanguageTool"):
             languages = self.request.get('languages', [])
-            self.result=self.addLanguageTool(languages) 
+            self.result=self.submit('addLanguageTool', languages) 
 
         if self.request.has_key("form.button.reindexer"):
-            self.result=self.reindexer() 
+            self.result=self.submit('reindexer') 
 
         if self.request.has_key("form.button.publisher"):
-            self.result=self.publisher() 
+            self.result=self.submit('publisher') 
 
         if self.request.has_key("form.button.hider"):
-            self.result=self.hider() 
+            self.result=self.submit('hider') 
 
         if self.request.has_key("form.button.setEnableNextPrevious"):
-            self.result=self.setEnableNextPrevious(True) 
+            self.result=self.submit('setEnableNextPrevious', True) 
 
         if self.request.has_key("form.button.setDisableNextPrevious"):
-            self.result=self.setEnableNextPrevious(False) 
+            self.result=self.submit('setEnableNextPrevious', False) 
 
         if self.request.has_key("form.button.setExcludeFromNav"):
-            self.result=self.setExcludeFromNav(True) 
+            self.result=self.submit('setExcludeFromNav', True) 
 
         if self.request.has_key("form.button.setIncludeInNav"):
-            self.result=self.setExcludeFromNav(False) 
+            self.result=self.submit('setExcludeFromNav', False) 
 
         if self.request.has_key("form.button.setRichDocAttachment"):
-            self.result=self.setRichDocAttachment(True) 
+            self.result=self.submit('setRichDocAttachments', True) 
 
         if self.request.has_key("form.button.unsetRichDochAttachment"):
-            self.result=self.setRichDocAttachment(False) 
+            self.result=self.submit('setRichDocAttachments', False) 
 
         if self.request.has_key("form.button.deleter"):
             guessLanguage = self.request.get('guessLanguage', '')
             id = self.request.get('id', '')
-            self.result=self.deleter(id,guessLanguage) 
+            self.result=self.submit('deleter', id, guessLanguage) 
 
         if self.request.has_key("form.button.ChangeId"):
             oldid = self.request.get('oldid', "")
             newid = self.request.get('newid', '')
-            self.result=self.renamer(oldid,newid) 
+            self.result=self.submit('renamer', oldid, newid) 
 
         if self.request.has_key("form.button.setTranslateTitle"):
             label = self.request.get('label', "")
             domain = self.request.get('domain', "plone")
-            self.result=self.setTranslatedTitle(label,domain) 
+            self.result=self.submit('setTranslatedTitle', label, domain) 
 
         if self.request.has_key("form.button.setTranslateDescription"):
             label = self.request.get('label', "")
             domain = self.request.get('domain', "plone")
-            self.result=self.setTranslatedDescription(label,domain) 
+            self.result=self.submit('setTranslatedDescription', label, domain) 
 
         if self.request.has_key("form.button.createFolder"):
             excludeFromNav = self.request.get('excludeFromNav', 'true')
@@ -105,18 +206,18 @@ class LinguaToolsView(BrowserView):
 
         if self.request.has_key("form.button.subtyper"):
             subtype = self.request.get('subtype', "")
-            self.result=self.subtyper(subtype) 
+            self.result=self.submit('subtyper', subtype) 
 
         if self.request.has_key("form.button.delProperty"):
             id = self.request.get('id', "")
-            self.result=self.delProperty(id) 
+            self.result=self.submit('delProperty', id) 
 
         if self.request.has_key("form.button.blockPortlet"):
             manager = self.request.get('manager', "")
             #cat = self.request.get('cat', "")
             status = not not self.request.get('status', False)
             if manager:
-                self.result=self.blockPortlets(manager,status) 
+                self.result=self.submit('blockPortlets', manager, status) 
             else:
                 self.result = ["No manager selected."]
                 
@@ -124,7 +225,7 @@ class LinguaToolsView(BrowserView):
             id = self.request.get('id', "")
             typ = self.request.get('typ', "")
             value = self.request.get('value', "")
-            self.result=self.setProperty(id,typ,value) 
+            self.result=self.submit('setProperty', id, typ, value) 
 
         if self.request.has_key("form.button.cutAndPaste"):
             sourcepath = self.request.get('sourcepath', "")
@@ -135,12 +236,24 @@ class LinguaToolsView(BrowserView):
         if self.request.has_key("form.button.fixOrder"):
             order = self.request.get('order', "")
             orderlist = order.splitlines()
-            self.result=self.fixOrder(orderlist) 
+            self.result=self.submit('fixOrder', orderlist) 
 
         if self.request.has_key("form.button.translateThis"):
             attrs = self.request.get('attrs', "")
             attrslist = attrs.splitlines()
             self.result=self.translateThis(attrslist) 
+        if self.request.has_key("form.button.retryJob"):
+            jobid = self.request.get('jobid', "")
+            lang = self.request.get('lang', "")
+            self.result=self.retryJob(jobid, lang)
+
+        if self.request.has_key("form.button.resumeJob"):
+            jobid = self.request.get('jobid', "")
+            self.result=self.resumeJob(jobid)
+
+        if self.request.has_key("form.button.removeJob"):
+            jobid = self.request.get('jobid', "")
+            self.result=self.removeJob(jobid)
         return self.template()
 
     def __init__(self, context, request):
@@ -159,6 +272,66 @@ class LinguaToolsView(BrowserView):
         if self.dynamic_path[-1]== "/":
             self.dynamic_path = self.dynamic_path[:-1]
         
+    def submit(self, operation, *args):
+        """ queue operation as a background job that runs it language by
+            language. Runs it right away if plone.app.async is not available.
+        """
+        async = queryUtility(IAsyncService)
+        if async is None or operation not in JOB_OPERATIONS:
+            return getattr(self, operation)(*args)
+        context = Acquisition.aq_inner(self.context)
+        jobs = getLinguaToolsJobs(context, create=True)
+        jobid = '%s-%s' % (operation, int(time() * 1000))
+        jobs[jobid] = LinguaToolsJob(jobid, operation, args, self.langs)
+        async.queueJob(runLinguaToolsJob, context, jobid)
+        return ["Queued %s for %d languages as job %s" % (
+            operation, len(self.langs), jobid)]
+
+    def jobs(self):
+        """ the background jobs of the context, newest first """
+        jobs = getLinguaToolsJobs(Acquisition.aq_inner(self.context))
+        if not jobs:
+            return []
+        jobs = list(jobs.values())
+        jobs.sort(key=lambda job: job.created, reverse=True)
+        return jobs
+
+    def _queue(self, jobid, langs=None):
+        context = Acquisition.aq_inner(self.context)
+        jobs = getLinguaToolsJobs(context)
+        job = jobs is not None and jobs.get(jobid) or None
+        if job is None:
+            return None
+        for lang in langs or job.pending():
+            job.setStatus(lang, PENDING)
+        getUtility(IAsyncService).queueJob(
+            runLinguaToolsJob, context, jobid, langs)
+        return job
+
+    def retryJob(self, jobid, lang):
+        """ run a job again for a single language """
+        if self._queue(jobid, [lang]) is None:
+            return ["No job %s" % jobid]
+        return ["Queued job %s for language %s" % (jobid, lang)]
+
+    def resumeJob(self, jobid):
+        """ run a job for all languages that are not done yet, e.g. after
+            a restart
+        """
+        job = self._queue(jobid)
+        if job is None:
+            return ["No job %s" % jobid]
+        return ["Queued job %s for languages %s" % (
+            jobid, ", ".join(job.pending()))]
+
+    def removeJob(self, jobid):
+        """ forget about a job """
+        jobs = getLinguaToolsJobs(Acquisition.aq_inner(self.context))
+        if jobs is None or jobid not in jobs:
+            return ["No job %s" % jobid]
+        del jobs[jobid]
+        return ["Removed job %s" % jobid]
+
     def _forAllLangs(self, method, *args, **kw):
         """ helper method. Takes a method and executes it on all language versions of context """
         context = Acquisition.aq_inner(self.context)
@@ -625,23 +798,35 @@ class LinguaToolsView(BrowserView):
 
         return langob
 
-    def fixTranslationReference(self, recursive=False):
-        """ fixes translation references to the canonical.
-            Assumes that self is always en and canonical
-            tries to handle language extensions for files like hwp_xx.swf
-        """
-        context = Acquisition.aq_inner(self.context)
-        pl = context.portal_languages
-        langs = pl.getSupportedLanguages()
-
-        results = []
-        if recursive==True:
-            targetobs = context.ZopeFind(context, search_sub=1)
-        else:
-            targetobs = [(context.getId(), context)]
-        for id, ob in targetobs:
-
-            print "handling %s" % ob.absolute_url(1)
+    def _langPaths(self, ob, langidx, langs):
+        """ Used by FixTranslationReference
+            the paths at which the translations of ob in langs are expected,
+            as lang -> candidate paths, see _getLangOb """
+        obpath = ob.getPhysicalPath()
+        filename = obpath[-1]
+        stem = ''
+        if ob.portal_type in ['File', 'Image']:
+            # we try to also accept _xx language abbrevs
+            langabbrev, stem, ext = self._guessLanguage(filename)
+            if langabbrev == '':
+                stem = ''
+        paths = {}
+        for lang in langs:
+            langpath = list(obpath)
+            langpath[langidx] = lang
+            candidates = ["/".join(langpath)]
+            if stem:
+                langpath[-1] = "%s%s.%s" % (stem, lang, ext)
+                candidates.append("/".join(langpath))
+            paths[lang] = candidates
+        return paths
+
+    def _fixTranslationReferences(self, obs, langs, langidx, results):
+        """ fix the translation references of obs, looking up the objects
+            in the other language branches with one catalog query """
+        catalog = getToolByName(self.context, 'portal_catalog')
+        todo = []
+        for ob in obs:
             if hasattr(Acquisition.aq_base(ob), '_md') and ob._md.has_key('language') and ob._md['language']==u'':
                 ob._md['language'] = u'en'
 
@@ -650,27 +835,70 @@ class LinguaToolsView(BrowserView):
 
             if not ob.isCanonical():
                 results.append("Not Canonical: %s " %ob.absolute_url())
-                print "Not Canonical: %s " %ob.absolute_url()
 
-            for lang in langs:
-                if ob.hasTranslation(lang):           
+            missing = [lang for lang in langs if not ob.hasTranslation(lang)]
+            if missing:
+                todo.append((ob, self._langPaths(ob, langidx, missing)))
+
+        candidates = []
+        for ob, paths in todo:
+            for langpaths in paths.values():
+                candidates.extend(langpaths)
+        if not candidates:
+            return
+        found = {}
+        for brain in catalog(path={'query': candidates, 'depth': 0},
+                             Language='all'):
+            found[brain.getPath()] = brain
+
+        for ob, paths in todo:
+            for lang, langpaths in paths.items():
+                brains = [found[path] for path in langpaths if path in found]
+                if not brains:
                     continue
-                langob = self._getLangOb(ob, lang)
-
-                if langob is None:
-                    continue
-
+                langob = brains[0].getObject()
                 try:
                     langob.setLanguage('')
                     langob.setLanguage(lang)
                     langob.addTranslationReference(ob)
                     langpath = "/".join(langob.getPhysicalPath())
                     results.append( "Adding TransRef for %s" % langpath )
-                    print  "Adding TransRef for %s" % langpath
                 except Exception, at:
                     results.append( "Except %s" % str(at))
 
+    def fixTranslationReference(self, recursive=False):
+        """ fixes translation references to the canonical.
+            Assumes that self is always en and canonical
+            tries to handle language extensions for files like hwp_xx.swf
+
+            The recursive walk is driven by the catalog and done in chunks
+            of FIX_CHUNK_SIZE objects, which are committed and dropped from
+            the ZODB cache, so memory use does not grow with the subtree
+        """
+        context = Acquisition.aq_inner(self.context)
+        pl = context.portal_languages
+        langs = pl.getSupportedLanguages()
+        portal_url = getToolByName(context, 'portal_url')
+        langidx = len(portal_url.getPortalObject().getPhysicalPath())
+
+        results = []
+        if recursive==True:
+            catalog = getToolByName(context, 'portal_catalog')
+            brains = catalog(path="/".join(context.getPhysicalPath()),
+                             Language='all')
+            for start in range(0, len(brains), FIX_CHUNK_SIZE):
+                obs = [brain.getObject()
+                       for brain in brains[start:start + FIX_CHUNK_SIZE]]
+                self._fixTranslationReferences(obs, langs, langidx, results)
+                del obs
+                transaction.commit()
+                context._p_jar.cacheGC()
+                log.info('fixTranslationReference: %d of %d objects done' % (
+                    min(start + FIX_CHUNK_SIZE, len(brains)), len(brains)))
+        else:
+            self._fixTranslationReferences(
+                [context], langs, langidx, results)
+
         results.append("ok")
         return results
 
-        
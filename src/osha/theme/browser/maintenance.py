@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 """Do some maintenance on the migrated site."""
-from Acquisition import aq_base
+from Acquisition import aq_base, aq_inner, aq_parent
 import transaction
 from Products.Five.browser import BrowserView
 from zope.component import getMultiAdapter
@@ -9,40 +9,48 @@ from zope.interface import implements
 from plone.app.async.interfaces import IAsyncService
 
 from osha.theme.browser.interfaces import IMaintenanceView
+from osha.theme.browser.index_atoz import buildAtoZIndex
+from osha.theme.browser.search_ro import buildROMetadataIndex
 from Products.CMFCore.utils import getToolByName
 
 from Products.ATContentTypes.content.folder import ATFolder
 import logging
 log = logging.getLogger('osha.theme/maintenance.py')
 
-log_file = open("converted_large_plone_folders.log", "a")
+# children moved between two savepoints when converting a folder
+SAVEPOINT_SIZE = 5000
 
 
 def convertLPFolder(parent, folder):
-    """ convert Large Plone Folders to Folders """
+    """ convert Large Plone Folders to Folders
+
+    All children are moved to the new folder in one pass and its _objects
+    is written once, so that folders with many children convert in linear
+    time. The children are left in the BTree of the old folder, which is
+    unlinked from parent and goes away with it.
+    """
     id = folder.getId()
+    uid = folder._at_uid
     newfolder = ATFolder(id)
     newfolder._setId(id)
-    newfolder = newfolder.__of__(parent)
-
-    uid = folder._at_uid
-
-    for item_id, item in folder.objectItems():
-        folder._objects = tuple(
-            [i for i in folder._objects if i['id'] != item_id])
-        folder._delOb(item_id)
-
-        newfolder._objects = newfolder._objects + (
-            {'id': item_id, 'meta_type': item.meta_type},)
-        newfolder._setOb(item_id, aq_base(item))
+    newfolder._at_uid = uid
 
+    # put the new folder in place first, so that the savepoints below can
+    # store the parts of it that are filled already
     parent._objects = tuple([i for i in parent._objects if i['id'] != id])
     parent._delOb(id)
-
-    newfolder._at_uid = uid
     parent._objects = parent._objects + (
         {'id': id, 'meta_type': newfolder.meta_type},)
-    parent._setOb(id, aq_base(newfolder))
+    parent._setOb(id, newfolder)
+    newfolder = parent._getOb(id)
+
+    objects = []
+    for count, (item_id, item) in enumerate(folder.objectItems()):
+        objects.append({'id': item_id, 'meta_type': item.meta_type})
+        newfolder._setOb(item_id, aq_base(item))
+        if count and not count % SAVEPOINT_SIZE:
+            transaction.savepoint(optimistic=True)
+    newfolder._objects = tuple(objects)
 
     #transaction.abort()
     return "%s, %s" % (id, folder.absolute_url(1))
@@ -51,11 +59,16 @@ def findLPFolder(context):
     for id, item in context.ZopeFind(context, search_sub=0):
         if item.meta_type == 'ATBTreeFolder':
             msg = convertLPFolder(context, item)
-            print msg
-            log_file.write(msg + "\n")
+            log.info('Converted Large Plone Folder %s' % msg)
         if item.isPrincipiaFolderish:
             findLPFolder(item)
 
+def convertLPFolderJob(folder):
+    """ async job: convert a single Large Plone Folder """
+    parent = aq_parent(aq_inner(folder))
+    msg = convertLPFolder(parent, aq_inner(folder))
+    log.info('Converted Large Plone Folder %s' % msg)
+
 class MaintenanceView(BrowserView):
     """ the view to run the import steps """
 
@@ -66,9 +79,40 @@ class MaintenanceView(BrowserView):
 
     def convertLPFolders(self):
         """ find and convert all LP Folders """
-        print "starting conversion"
+        log.info("starting conversion")
         findLPFolder(self.context)
-        print "conversion done"
+        log.info("conversion done")
+
+    def queueLPFolderConversion(self):
+        """ queue a job for every LP Folder below the context, outer folders
+            first; every folder is converted in its own transaction
+        """
+        async = getUtility(IAsyncService)
+        catalog = getToolByName(self.context, 'portal_catalog')
+        brains = catalog.unrestrictedSearchResults(
+            path='/'.join(self.context.getPhysicalPath()),
+            meta_type='ATBTreeFolder')
+        paths = sorted([brain.getPath() for brain in brains],
+                       key=lambda path: path.count('/'))
+        for path in paths:
+            folder = self.context.unrestrictedTraverse(path)
+            async.queueJob(convertLPFolderJob, folder)
+            log.info('Queued conversion of Large Plone Folder %s' % path)
+        return "Queued %d Large Plone Folders" % len(paths)
+
+    def queueROMetadataIndexBuild(self):
+        """ queue a job that builds the Risk Observatory search index """
+        portal = getToolByName(self.context, 'portal_url').getPortalObject()
+        getUtility(IAsyncService).queueJob(buildROMetadataIndex, portal)
+        log.info('Queued the build of the Risk Observatory index')
+        return "Queued the build of the Risk Observatory index"
+
+    def queueAtoZIndexBuild(self):
+        """ queue a job that builds the A-Z index """
+        portal = getToolByName(self.context, 'portal_url').getPortalObject()
+        getUtility(IAsyncService).queueJob(buildAtoZIndex, portal)
+        log.info('Queued the build of the A-Z index')
+        return "Queued the build of the A-Z index"
 
 
 class QueueSize(BrowserView):
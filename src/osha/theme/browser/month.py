@@ -8,6 +8,28 @@ from Products.Archetypes.utils import shasattr
 from p4a.calendar.browser.month import MonthView as p4aMonthView
 from p4a.calendar.browser.month import hour_time_formatter
 
+def trimDescription(description, length=250, ellipsis='...'):
+    """ description cut after the last word within length characters """
+    if len(description) > length:
+        description = description[:length]
+        l = description.rfind(' ')
+        if l > length/2:
+            description = description[:l+1]
+        description += ellipsis
+    return description
+
+
+def visibleSpan(start, end, first, last):
+    """ (start, end) clipped to the visible days first to last, or None if
+        the event is not visible. An end before the start counts as the
+        start day.
+    """
+    end = max(end, start)
+    if end < first or start > last:
+        return None
+    return max(start, first), min(end, last)
+
+
 class MonthView(p4aMonthView):
     """View for a month.
     """
@@ -67,6 +89,10 @@ class MonthView(p4aMonthView):
     def _fill_events(self, days, description_length=250, ellipsis='...'):
         """Overriding this method so that the dateToBeConfirmed value
         can be returned in the event_dict"""
+        if not days:
+            return
+        first = min(days)
+        last = max(days)
         for event in self._events:
             dt = datetime.date(event.start.year,
                                event.start.month,
@@ -75,41 +101,29 @@ class MonthView(p4aMonthView):
                                   event.end.month,
                                   event.end.day)
 
-            dt_list = dt in days and [dt] or []
-            while dt != dtend:
-                dt = dt + datetime.timedelta(1)
-                if dt in days:
-                    # Don't append the date if it's outside the list of visible days
-                    dt_list.append(dt)
-
-            for dt in dt_list:
-                day = days.get(dt, None)
-                if day is None:
-                    # basically the date wasn't in our active month so
-                    # we set the date to the first day of the month
-                    randomday = days.itervalues().next().daydate
-                    newdate = datetime.date(randomday.year, randomday.month, 1)
-                    day = days[newdate]
-
-                description = event.description
-
-                if len(description)>description_length:
-                    description = description[:description_length]
-                    l = description.rfind(' ')
-                    if l > description_length/2:
-                        description = description[:l+1]
-                    description += ellipsis
-
-                timespan = '%s to %s %s' % (hour_time_formatter(self, event.start),
-                                            hour_time_formatter(self, event.end),
-                                            event.timezone)
-
-                event_dict = {'label': hour_time_formatter(self,event.start) + ' ' + event.title,
-                              'timespan': timespan,
-                              'local_url': event.local_url,
-                              'title': event.title,
-                              'location': event.location,
-                              'description': description,
-                              'type': event.type,
-                              'dateToBeConfirmed': event.dateToBeConfirmed}
-                day.add(event_dict)
+            # Clip the event to the visible days, however long it runs
+            span = visibleSpan(dt, dtend, first, last)
+            if span is None:
+                continue
+            dt, dtend = span
+
+            timespan = '%s to %s %s' % (hour_time_formatter(self, event.start),
+                                        hour_time_formatter(self, event.end),
+                                        event.timezone)
+
+            event_dict = {'label': hour_time_formatter(self,event.start) + ' ' + event.title,
+                          'timespan': timespan,
+                          'local_url': event.local_url,
+                          'title': event.title,
+                          'location': event.location,
+                          'description': trimDescription(
+                              event.description, description_length,
+                              ellipsis),
+                          'type': event.type,
+                          'dateToBeConfirmed': event.dateToBeConfirmed}
+
+            for offset in range((dtend - dt).days + 1):
+                day = days.get(dt + datetime.timedelta(offset), None)
+                if day is not None:
+                    # Don't add the event to days outside the visible days
+                    day.add(dict(event_dict))
@@ -25,6 +25,7 @@ from osha.policy.interfaces import ISingleEntryPoint
 from osha.theme.browser.interfaces import IOSHA
 from osha.theme.browser.osha_properties_controlpanel import \
     PropertiesControlPanelAdapter
+from osha.theme.browser.utils import PortalStylesheetLoader
 from osha.theme.config import *
 from osha.theme.cssselect import Converter
 
@@ -389,7 +390,8 @@ class OSHA(BrowserView):
         # ret = BeautifulSoup(
         #     f.read(), convertEntities=BeautifulSoup.HTML_ENTITIES)
         # return ret.text
-        converter = Converter()
+        converter = Converter(
+            cascade='indexed', loader=PortalStylesheetLoader(self.context))
         text = converter.perform(data)
         if not isinstance(text, unicode):
             text = text.decode('utf-8')
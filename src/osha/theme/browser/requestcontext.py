@@ -0,0 +1,131 @@
+"""A request scoped cache for the lookups every viewlet and portlet makes.
+
+Viewlets and portlets each compute the preferred language, the navigation
+root, the subsite etc. for their cache keys and templates, often more than
+once. IOSHARequestContext(request) returns one object per request that
+computes every such value once and hands it out to all of them afterwards.
+"""
+import logging
+
+from Acquisition import aq_inner
+from zope.annotation.interfaces import IAnnotations
+from zope.component import getMultiAdapter
+from zope.interface import implementer, implements
+
+from Products.CMFCore.utils import getToolByName
+
+from slc.subsite.interfaces import ISubsiteEnhanced
+from slc.subsite.root import getSubsiteRoot
+
+from osha.policy.interfaces import ISingleEntryPoint
+from osha.theme.browser.interfaces import IOSHARequestContext
+
+log = logging.getLogger('osha.theme.requestcontext')
+
+ANNOTATION_KEY = 'osha.theme.requestcontext'
+
+
+class OSHARequestContext(object):
+    """ Computes the values on first use. Values that depend on the context
+    are stored per context path, so viewlets of a different context never
+    see each other's values.
+    """
+    implements(IOSHARequestContext)
+
+    def __init__(self, request):
+        self.request = request
+        self._values = {}
+        self.computed = 0
+        self.shared = 0
+
+    def _get(self, key, compute):
+        try:
+            value = self._values[key]
+        except KeyError:
+            value = self._values[key] = compute()
+            self.computed += 1
+        else:
+            self.shared += 1
+        return value
+
+    def _path(self, context):
+        return '/'.join(aq_inner(context).getPhysicalPath())
+
+    def preferredLanguage(self, context):
+        return self._get('preferredLanguage', lambda: getToolByName(
+            context, 'portal_languages').getPreferredLanguage())
+
+    def defaultLanguage(self, context):
+        return self._get('defaultLanguage', lambda: getToolByName(
+            context, 'portal_languages').getDefaultLanguage())
+
+    def portalState(self, context):
+        return self._get(
+            ('portalState', self._path(context)),
+            lambda: getMultiAdapter(
+                (context, self.request), name=u'plone_portal_state'))
+
+    def oshaview(self, context):
+        return self._get(
+            ('oshaview', self._path(context)),
+            lambda: getMultiAdapter(
+                (context, self.request), name=u'oshaview'))
+
+    def navigationRootPath(self, context):
+        return self._get(
+            ('navigationRootPath', self._path(context)),
+            lambda: self.portalState(context).navigation_root_path())
+
+    def navigationRootUrl(self, context):
+        return self._get(
+            ('navigationRootUrl', self._path(context)),
+            lambda: self.portalState(context).navigation_root_url())
+
+    def subsiteRootPath(self, context):
+        return self._get(
+            ('subsiteRootPath', self._path(context)),
+            lambda: getSubsiteRoot(aq_inner(context)))
+
+    def _inPublishedPath(self, iface):
+        for parent in self.request.get('PARENTS', ()):
+            if iface.providedBy(parent):
+                return parent
+        return None
+
+    def currentSingleEntryPoint(self):
+        return self._get('currentSingleEntryPoint',
+                         lambda: self._inPublishedPath(ISingleEntryPoint))
+
+    def currentSubsite(self):
+        return self._get('currentSubsite',
+                         lambda: self._inPublishedPath(ISubsiteEnhanced))
+
+    def serverURL(self):
+        return self._get('serverURL', lambda: self.request.get('SERVER_URL'))
+
+    def info(self):
+        return dict(computed=self.computed, shared=self.shared)
+
+
+@implementer(IOSHARequestContext)
+def getRequestContext(request):
+    """ adapter factory: the OSHARequestContext of request """
+    annotations = IAnnotations(request)
+    context = annotations.get(ANNOTATION_KEY)
+    if context is None:
+        context = annotations[ANNOTATION_KEY] = OSHARequestContext(request)
+    return context
+
+
+def logRequestContext(event):
+    """ log how many lookups were shared, at debug level """
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    try:
+        context = IAnnotations(event.request).get(ANNOTATION_KEY)
+    except TypeError:
+        return
+    if context is not None:
+        log.debug('%s: %s lookups computed, %s shared' % (
+            event.request.get('ACTUAL_URL'), context.computed,
+            context.shared))
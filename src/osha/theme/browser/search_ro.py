@@ -1,11 +1,218 @@
 import Acquisition
+from BTrees.IIBTree import IITreeSet, intersection, multiunion
+from BTrees.IOBTree import IOBTree
+from BTrees.OOBTree import OOBTree, OOTreeSet
+from persistent import Persistent
 from Products.Five.browser import BrowserView
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from Products.CMFCore.utils import getToolByName
-from zope.component import getMultiAdapter
+from zope.annotation.interfaces import IAnnotations
+from zope.app.component.hooks import getSite
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
 from types import *
 from zLOG import LOG, INFO
 
+from osha.theme.browser.utils import getIndexableValues, getOldPath
+
+RO_KEY = 'osha.theme.search_ro'
+DIMENSIONS = ('ero_topic', 'ero_target_group', 'country', 'Language')
+
+
+def _dimensions(osha_metadata, country, language):
+    """ the (dimension, value) pairs of a document """
+    pairs = set()
+    for elem in osha_metadata or ():
+        if '::' not in elem:
+            continue
+        key, val = elem.split('::', 1)
+        if key in ('ero_topic', 'ero_target_group'):
+            pairs.add((key, val))
+    if isinstance(country, basestring):
+        country = (country, )
+    for code in country or ():
+        pairs.add(('country', code))
+    pairs.add(('Language', language or ''))
+    return tuple(sorted(pairs))
+
+
+class ROMetadataIndex(Persistent):
+    """The published Risk Observatory documents by ero_topic,
+    ero_target_group, country and Language, keyed by their catalog rid.
+
+    Every target group also keeps its documents sorted by title, so that
+    results come out grouped and sorted without re-parsing osha_metadata.
+    Built on first use (see build), kept up to date by updateROMetadataIndex.
+    """
+
+    def __init__(self):
+        # (dimension, value) -> IITreeSet of rids
+        self.postings = OOBTree()
+        # target group -> OOTreeSet of (sort key, rid)
+        self.runs = OOBTree()
+        # rid -> (path, sort key, pairs)
+        self.documents = IOBTree()
+        # path -> rid
+        self.rids = OOBTree()
+        self.built = False
+
+    def build(self, brains):
+        for brain in brains:
+            self.index(brain.getRID(), brain.getPath(), brain.Title,
+                       _dimensions(brain.getOsha_metadata, brain.getCountry,
+                                   brain.Language))
+        self.built = True
+
+    def index(self, rid, path, title, pairs):
+        self.unindex(path)
+        sortkey = (title or '').lower()
+        for pair in pairs:
+            rids = self.postings.get(pair)
+            if rids is None:
+                rids = self.postings[pair] = IITreeSet()
+            rids.insert(rid)
+            if pair[0] == 'ero_target_group':
+                run = self.runs.get(pair[1])
+                if run is None:
+                    run = self.runs[pair[1]] = OOTreeSet()
+                run.insert((sortkey, rid))
+        self.documents[rid] = (path, sortkey, pairs)
+        self.rids[path] = rid
+
+    def unindex(self, path):
+        rid = self.rids.get(path)
+        if rid is None:
+            return
+        del self.rids[path]
+        path, sortkey, pairs = self.documents[rid]
+        del self.documents[rid]
+        for pair in pairs:
+            rids = self.postings.get(pair)
+            if rids is not None and rids.has_key(rid):
+                rids.remove(rid)
+                if not rids:
+                    del self.postings[pair]
+            if pair[0] == 'ero_target_group':
+                run = self.runs.get(pair[1])
+                if run is not None and run.has_key((sortkey, rid)):
+                    run.remove((sortkey, rid))
+                    if not run:
+                        del self.runs[pair[1]]
+
+    def search(self, criteria):
+        """ the rids matching all criteria (AND), a list of (dimension,
+            values) where a document has to have one of values (OR)
+        """
+        result = None
+        for dimension, values in criteria:
+            if isinstance(values, basestring):
+                values = (values, )
+            sets = [self.postings.get((dimension, value)) for value in values]
+            matches = multiunion([s for s in sets if s is not None])
+            if result is None:
+                result = matches
+            else:
+                result = intersection(result, matches)
+            if not result:
+                return IITreeSet()
+        if result is None:
+            return IITreeSet(self.documents.keys())
+        return result
+
+    def byTargetGroup(self, rids, target_groups):
+        """ rids grouped by target group, in the order of target_groups, and
+            sorted by title within a group. A document with more than one
+            target group appears in each of them.
+        """
+        ordered = []
+        for tg in target_groups:
+            run = self.runs.get(tg)
+            if run is None:
+                continue
+            members = intersection(
+                rids, self.postings.get(('ero_target_group', tg)))
+            if not members:
+                continue
+            if len(members) * 8 < len(run):
+                # few matches in a large group: sorting them is cheaper
+                # than walking the whole run
+                documents = self.documents
+                ordered.extend(sorted(
+                    members, key=lambda rid: (documents[rid][1], rid)))
+            else:
+                ordered.extend([rid for key, rid in run
+                                if members.has_key(rid)])
+        return ordered
+
+
+def getROMetadataIndex(site, create=False):
+    """ returns the Risk Observatory index of site, None if it has never
+        been used unless create is True
+    """
+    ann = IAnnotations(site)
+    if create:
+        return ann.setdefault(RO_KEY, ROMetadataIndex())
+    return ann.get(RO_KEY)
+
+
+def _indexedValues(portal_catalog):
+    """ the osha_metadata values of the documents in the index """
+    return [v for v in portal_catalog.uniqueValuesFor('osha_metadata')
+            if v.startswith('ero_topic::') or
+            v.startswith('ero_target_group::')]
+
+
+def buildROMetadataIndex(portal):
+    """ async job: build the Risk Observatory index of portal from the
+        catalog. The search page queries the catalog directly until the
+        index is built.
+    """
+    portal_catalog = getToolByName(portal, 'portal_catalog')
+    index = ROMetadataIndex()
+    # unrestricted, the search filters the results by the permissions and
+    # effective dates of the current user
+    index.build(portal_catalog.unrestrictedSearchResults(
+        osha_metadata=_indexedValues(portal_catalog),
+        review_state='published'))
+    IAnnotations(portal)[RO_KEY] = index
+    LOG('osha.theme.search_ro', INFO,
+        'Built the Risk Observatory index, %d documents'
+        % len(index.documents))
+
+
+def updateROMetadataIndex(obj, event):
+    """ event handler: reindex obj in the Risk Observatory index """
+    site = getSite()
+    if site is None:
+        return
+    index = getROMetadataIndex(site)
+    if index is None or not index.built:
+        return
+    if 'portal_factory' in obj.getPhysicalPath():
+        return
+    path = '/'.join(obj.getPhysicalPath())
+    if IObjectMovedEvent.providedBy(event):
+        oldPath = getOldPath(obj, event)
+        if oldPath is not None:
+            index.unindex(oldPath)
+        if event.newParent is None:
+            # removed
+            return
+    values = getIndexableValues(obj, (
+        'review_state', 'Title', 'getOsha_metadata', 'getCountry',
+        'Language'))
+    pairs = _dimensions(values['getOsha_metadata'], values['getCountry'],
+                        values['Language'])
+    if values['review_state'] != 'published' or \
+            not [p for p in pairs if p[0] in ('ero_topic', 'ero_target_group')]:
+        index.unindex(path)
+        return
+    rid = getToolByName(obj, 'portal_catalog').getrid(path)
+    if rid is None:
+        # not cataloged (yet)
+        index.unindex(path)
+        return
+    index.index(rid, path, values['Title'], pairs)
+
 
 class SearchROView(BrowserView):
     """View for displaying the ro filter results
@@ -26,69 +233,95 @@ class SearchROView(BrowserView):
         return self.template()
 
 
-    def sortByTargetGroup(self, results):
-        context = Acquisition.aq_inner(self.context)
-        if not results:
-            return []
+    def _getIndex(self):
+        """ the Risk Observatory index, None if it is not built yet """
+        portal = getToolByName(self.context, 'portal_url').getPortalObject()
+        index = getROMetadataIndex(portal)
+        if index is None or not index.built:
+            return None
+        return index
 
+    def targetGroups(self):
+        """ the target groups in the order of the OSHAMetadata vocabulary """
+        context = Acquisition.aq_inner(self.context)
         pv = getToolByName(context, 'portal_vocabularies')
-        VOCAB = getattr(pv, 'OSHAMetadata', None) 
+        VOCAB = getattr(pv, 'OSHAMetadata', None)
         vocabDict = VOCAB.getVocabularyDict(VOCAB)
         ETG = vocabDict.get('ero_target_group', [])
-        tgs = ETG[1].keys()
+        # the terms are 'ero_target_group::<value>'
+        return [tg.split('::', 1)[-1] for tg in ETG[1].keys()]
 
-        sortedlist = []
-        sortmap = {}
-    
-        
-        for r in results:
-            OMD = r.getOsha_metadata
-            if not OMD:
-                continue
-            md = list()
-            for elem in OMD:
-                if elem.find('::'):
-                    key, val = elem.split('::')
-                    if key=='ero_target_group':
-                        md.append(elem)
-            if not len(md):
-                continue
-        
-            for m in md:
-                if not sortmap.has_key(m):
-                    sortmap[m]=[]
-                sortmap[m].append(r)
-
-        for tg in tgs:
-            if sortmap.has_key(tg):
-                sp = sortmap[tg]
-                sp.sort(lambda x, y: cmp(x.Title.lower(), y.Title.lower()))
-                for s in sp:
-                    sortedlist.append(s)
-        
-        return sortedlist
-
-
-    def results(self):
-        """ query the catalog """
+    def _criteria(self):
         context = Acquisition.aq_inner(self.context)
-        portal_catalog = getToolByName(context, 'portal_catalog')
+        portal_languages = getToolByName(context, 'portal_languages')
+        criteria = [('Language', (portal_languages.getPreferredLanguage(), ''))]
         if not self.country:
-            mdq =  {'query' : ('ero_topic::%s'%self.ero_topic, 'ero_target_group::%s'%self.ero_target_group),
-                    'operator': 'and'}
+            criteria.extend([('ero_topic', self.ero_topic),
+                             ('ero_target_group', self.ero_target_group)])
         else:
+            criteria.append(('country', self.country))
             if self.ero_target_group:
-                mdq = ('ero_target_group::%s'%self.ero_target_group, )
+                criteria.append(('ero_target_group', self.ero_target_group))
             elif self.ero_topic:
-                mdq = ('ero_topic::%s'%self.ero_topic,)
-        query = {'country':self.country, 
-                 'osha_metadata': mdq,
-                 'review_state':'published'
-                   }
-        LOG('osha.theme.search_ro', INFO, 'query: %s' %query)
-        results = portal_catalog(query)
-        LOG('osha.theme.search_ro', INFO, 'Number of results: %d' %len(results))
-        results = self.sortByTargetGroup(results)        
+                criteria.append(('ero_topic', self.ero_topic))
+        return [(dimension, values) for dimension, values in criteria
+                if values]
+
+    def results(self):
+        """ query the Risk Observatory index, results are grouped by target
+            group and sorted by title
+        """
+        context = Acquisition.aq_inner(self.context)
+        portal_catalog = getToolByName(context, 'portal_catalog')
+        criteria = self._criteria()
+        LOG('osha.theme.search_ro', INFO, 'query: %s' % criteria)
+        index = self._getIndex()
+        if index is None:
+            return self._catalogResults(criteria)
+        rids = index.byTargetGroup(index.search(criteria), self.targetGroups())
+        paths = [index.documents[rid][0] for rid in rids]
+        if not paths:
+            return []
+        # the catalog checks the permissions and effective dates of the
+        # documents and leaves out those that have gone in the meantime
+        brains = dict([(brain.getPath(), brain) for brain in portal_catalog(
+            path={'query': list(set(paths)), 'depth': 0},
+            review_state='published', Language='all')])
+        results = [brains[path] for path in paths if path in brains]
+        LOG('osha.theme.search_ro', INFO, 'Number of results: %d' % len(results))
+        return results
+
+    def _catalogResults(self, criteria):
+        """ results() without the index, straight from the catalog """
+        context = Acquisition.aq_inner(self.context)
+        portal_catalog = getToolByName(context, 'portal_catalog')
+        query = {'review_state': 'published'}
+        metadata = []
+        for dimension, values in criteria:
+            if isinstance(values, basestring):
+                values = (values, )
+            if dimension in ('ero_topic', 'ero_target_group'):
+                metadata.extend(['%s::%s' % (dimension, value)
+                                 for value in values])
+            else:
+                query[dimension] = values
+        if metadata:
+            query['osha_metadata'] = {'query': metadata, 'operator': 'and'}
+        else:
+            query['osha_metadata'] = _indexedValues(portal_catalog)
+
+        groups = {}
+        for brain in portal_catalog(query):
+            for dimension, value in _dimensions(
+                    brain.getOsha_metadata, brain.getCountry, brain.Language):
+                if dimension == 'ero_target_group':
+                    groups.setdefault(value, []).append(
+                        ((brain.Title or '').lower(), brain))
+        results = []
+        for tg in self.targetGroups():
+            results.extend([brain for key, brain in sorted(
+                groups.get(tg, ()), key=lambda item: item[0])])
+        LOG('osha.theme.search_ro', INFO, 'Number of results: %d' % len(results))
         return results
 
     def getCN(self, codes):
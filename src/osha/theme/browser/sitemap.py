@@ -1,19 +1,49 @@
  # -*- coding: utf-8 -*-
 
+from Acquisition import aq_base
+from BTrees.OOBTree import OOBTree, OOTreeSet
+from persistent import Persistent
 from plone.app.layout.sitemap.sitemap import SiteMapView as BaseView
 from Products.CMFCore.utils import getToolByName
+from zope.annotation.interfaces import IAnnotations
 from zope.app.component.hooks import getSite
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
 from zope.publisher.interfaces import NotFound
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
+from osha.theme.browser.utils import getOldPath, iterate_solr
 from DateTime import DateTime
 from gzip import GzipFile
+from itertools import islice
 from cStringIO import StringIO
+from tempfile import TemporaryFile
 import urlparse
+from urllib import quote
+import zlib
 
 
 MAX_SIZE = 1024 * 1024 * 9
+# maximum number of urls per part file, see the sitemap protocol
+MAX_URLS = 50000
+# number of entries rendered with one call of the link snippet
+BATCH_SIZE = 1000
+# types we only want to link in the search form results
+EXCLUDED_TYPES = frozenset(
+    ['Amendment', 'Modification', 'Note', 'Proposal', 'LinguaLink'])
+# the Solr fields needed to render the sitemap
+SOLR_FIELDS = ('path_string', 'modified', 'effective', 'portal_type',
+               'outdated')
+NEWSMAP_SOLR_FIELDS = ('path_string', 'modified', 'effective', 'Subject')
+DEFAULT_LASTMOD = '2008-01-01T1:00:00+00:00'
+# placeholder to split the envelope template into head and foot
+LINKS_MARKER = '<!-- LINKS -->'
 FILE_IDX = 'sitemap_index.xml.gz'
 FILE_PART = "sitemap_%s.xml.gz"
+JOURNAL_KEY = 'osha.theme.sitemap'
+# name of the shard holding the portal and its direct children
+ROOT_SHARD = ''
+# number of shards everything below the first level is spread over, by a
+# hash of the second level folder or item it is in
+SHARD_BUCKETS = 64
 
 
 class NewsMapView(BaseView):
@@ -76,25 +106,26 @@ class NewsMapView(BaseView):
             'path': ['%s/en/teaser' % portal_path, '%s/en/press' % portal_path],
         }
 
-        for item in catalog(query)[:1000]:
+        if sitemapUseSolr(self.context):
+            items = self._solrItems(portal_path)
+        else:
+            items = self._catalogItems(catalog, query)
+
+        for loc, modified, effective, subject, changefreq in items:
             try:
-                lastmod = item.modified.ISO8601()
+                lastmod = modified.ISO8601()
             except:
                 lastmod = '2008-01-01T1:00:00+00:00'
 
-            loc = item.getURL()
-
-            changefreq = item.get('changefreq', "monthly")
-            priority = item.get('priority', 0.9)
-            if item.effective < (DateTime() - 30):
+            if effective < (DateTime() - 30):
                 priority = 0.3
             else:
                 priority = 0.9
-            keywords = [x for x in item.Subject if x is not None]
+            keywords = [x for x in subject or () if x is not None]
             keywords = ",".join(keywords)
 
             try:
-                publication_date = item.effective.ISO8601()
+                publication_date = effective.ISO8601()
             except:
                 publication_date = '2008-01-01T1:00:00+00:00'
 
@@ -107,6 +138,166 @@ class NewsMapView(BaseView):
                 'publication_date': publication_date
             }
 
+    def _catalogItems(self, catalog, query):
+        """ yields (url, modified, effective, Subject, changefreq) """
+        for item in catalog(query)[:1000]:
+            yield (item.getURL(), item.modified, item.effective, item.Subject,
+                   item.get('changefreq', "monthly"))
+
+    def _solrItems(self, portal_path, search=None):
+        """ like _catalogItems, but reads the fields from Solr """
+        query = '+Language:en +review_state:published ' \
+            '+portal_type:("News Item" OR PressRelease) -outdated:true ' \
+            '+path_parents:("%(path)s/en/teaser" OR "%(path)s/en/press")' % \
+            {'path': portal_path}
+        base_url = self.request.physicalPathToURL(portal_path)
+        cut = len(portal_path)
+        docs = iterate_solr(query, NEWSMAP_SOLR_FIELDS, search=search)
+        for doc in islice(docs, 1000):
+            yield (base_url + quote(doc.get('path_string')[cut:]),
+                   doc.get('modified'), doc.get('effective'),
+                   doc.get('Subject'), "monthly")
+
+
+def sitemapUseSolr(context):
+    """ the sitemaps are read from Solr instead of portal_catalog if the site
+        property sitemap_use_solr is set
+    """
+    sp = getToolByName(context, 'portal_properties').site_properties
+    return bool(getattr(sp, 'sitemap_use_solr', False))
+
+
+class SitemapJournal(Persistent):
+    """Records which shards of the sitemap need to be regenerated.
+
+    The portal and its direct children form ROOT_SHARD. Everything deeper
+    is in one of SHARD_BUCKETS shards, picked by a hash of its second level
+    path, e.g. 'en/publications', see shardForPath.
+    """
+
+    def __init__(self):
+        # shard names that changed since their part files were written
+        self.dirty = OOTreeSet()
+        # shard name -> (tuple of part file ids, lastmod)
+        self.parts = OOBTree()
+
+    def markDirty(self, shard):
+        self.dirty.insert(shard)
+
+    def popDirty(self):
+        shards = list(self.dirty)
+        self.dirty.clear()
+        return shards
+
+
+def getSitemapJournal(site, create=False):
+    """ returns the sitemap journal of site, None if the sitemap has never
+        been generated unless create is True
+    """
+    ann = IAnnotations(site)
+    if create:
+        return ann.setdefault(JOURNAL_KEY, SitemapJournal())
+    return ann.get(JOURNAL_KEY)
+
+
+def shardForPrefix(prefix):
+    """ returns the name of the shard of the second level path prefix, e.g.
+        'en/publications'
+    """
+    if isinstance(prefix, unicode):
+        prefix = prefix.encode('utf-8')
+    return 'bucket-%02d' % ((zlib.crc32(prefix) & 0xffffffff) % SHARD_BUCKETS)
+
+
+def allShards():
+    """ returns the names of all shards """
+    return [ROOT_SHARD] + ['bucket-%02d' % bucket
+                           for bucket in range(SHARD_BUCKETS)]
+
+
+def shardForPath(portal_path, path):
+    """ returns the name of the shard that contains path """
+    path = path[len(portal_path):].strip('/')
+    elems = path.split('/')
+    if len(elems) < 2:
+        return ROOT_SHARD
+    return shardForPrefix('/'.join(elems[:2]))
+
+
+def markSitemapDirty(obj, event):
+    """ event handler: mark the shards of obj dirty so that the next
+        incremental sitemap generation picks up the change
+    """
+    site = getSite()
+    if site is None:
+        return
+    journal = getSitemapJournal(site)
+    if journal is None:
+        return
+    paths = []
+    if IObjectMovedEvent.providedBy(event):
+        # covers adding, removing and renaming, also of a parent of obj
+        old_path = getOldPath(obj, event)
+        if old_path is not None:
+            paths.append(old_path)
+        if event.newParent is not None:
+            paths.append('/'.join(obj.getPhysicalPath()))
+    else:
+        paths.append('/'.join(obj.getPhysicalPath()))
+    portal_path = '/'.join(site.getPhysicalPath())
+    for path in paths:
+        if 'portal_factory' in path.split('/'):
+            continue
+        journal.markDirty(shardForPath(portal_path, path))
+
+
+class ISO8601Formatter(object):
+    """Memoizes DateTime.ISO8601, many items share their modification date.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._cache = {}
+
+    def __call__(self, date):
+        try:
+            key = (date.timeTime(), date.timezone())
+        except AttributeError:
+            return DEFAULT_LASTMOD
+        value = self._cache.get(key)
+        if value is None:
+            if len(self._cache) >= self.maxsize:
+                self._cache.clear()
+            value = self._cache[key] = date.ISO8601()
+        return value
+
+
+class SitemapPart(object):
+    """A sitemap part file that is being written: the snippets go straight
+    into a gzipped temporary file.
+    """
+
+    def __init__(self, head):
+        self.fp = TemporaryFile()
+        self.gzip = GzipFile('sitemap.xml', 'wb', 9, self.fp)
+        self.size = 0
+        self.count = 0
+        self.gzip.write(head)
+
+    def write(self, xml, count):
+        """ write the snippets of count urls """
+        self.gzip.write(xml)
+        self.size += len(xml)
+        self.count += count
+
+    def close(self, foot):
+        """ write foot, returns the temporary file positioned at its start
+        """
+        self.gzip.write(foot)
+        self.gzip.close()
+        self.fp.seek(0)
+        return self.fp
+
 
 def _render_cachekey(fun, self):
     # Cache by filename
@@ -118,6 +309,11 @@ class SiteMapView(BaseView):
     """Creates the sitemap as explained in the specifications.
 
     http://www.sitemaps.org/protocol.php
+
+    The sitemap is split into one or more part files per shard (see
+    SitemapJournal). Once it has been generated, only the shards that were
+    marked dirty by markSitemapDirty are regenerated; pass full=1 to rebuild
+    all of them.
     """
 
     template = ViewPageTemplateFile('templates/sitemap.xml')
@@ -141,35 +337,126 @@ class SiteMapView(BaseView):
                                         'application/octet-stream')
         return self.generate()
 
-    def persistFiles(self, objects):
-        """ write the map into a file object to avoid google download timeouts """
+    def allShards(self):
+        """ returns the names of all shards of the site """
+        return allShards()
+
+    def shardPrefixes(self, shard):
+        """ returns the second level paths, relative to the portal, whose
+            items are in shard
+        """
+        prefixes = getattr(self, '_prefixes', None)
+        if prefixes is None:
+            prefixes = self._prefixes = {}
+            site = getSite()
+            for id, ob in site.contentItems():
+                if not getattr(aq_base(ob), 'isPrincipiaFolderish', False):
+                    continue
+                for child_id in ob.contentIds():
+                    prefix = '%s/%s' % (id, child_id)
+                    prefixes.setdefault(
+                        shardForPrefix(prefix), []).append(prefix)
+        return prefixes.get(shard, [])
+
+    def shardQuery(self, shard):
+        """ returns the catalog query for the items of shard, None if it is
+            empty
+        """
+        portal_path = getToolByName(self.context, 'portal_url').getPortalPath()
+        query = {'Language': 'all', 'review_state': 'published'}
+        if shard == ROOT_SHARD:
+            query['path'] = {'query': portal_path, 'depth': 1}
+            return query
+        prefixes = self.shardPrefixes(shard)
+        if not prefixes:
+            return None
+        query['path'] = ['%s/%s' % (portal_path, prefix)
+                         for prefix in prefixes]
+        return query
+
+    def shardFilename(self, shard, counter):
+        """ returns the id of the counter'th part file of shard """
+        name = shard.replace('/', '--') or 'root'
+        if counter > 1:
+            name = '%s_%d' % (name, counter)
+        return FILE_PART % name
+
+    def persistFiles(self, shards, journal, removed=()):
+        """ write the map of the given shards into file objects to avoid
+            google download timeouts, delete the files of the removed
+            shards, then rewrite the index
+        """
+        site = getSite()
         portal_url = getToolByName(self.context, 'portal_url')
         purl = portal_url()
         now = DateTime().ISO8601()
-        counter = 0
-        LINKS = ""
-        filenames = []
-        for ob in objects:
-            xml = self.link_snippet(obj=ob)
-            LINKS += xml
-
-            if len(LINKS) > MAX_SIZE and LINKS != "":
-                counter += 1
-                part_name = FILE_PART % counter
-                self._persist_file(part_name, self.env_snippet(LINKS=LINKS))
-                filenames.append("%s/%s" % (purl, part_name))
-                LINKS = ''
-
-        counter += 1
-        part_name = FILE_PART % counter
-        self._persist_file(part_name, self.env_snippet(LINKS=LINKS))
-        filenames.append("%s/%s" % (purl, part_name))
-
-        snip = self.index_snippet(filenames=filenames, now=now)
+        written = []
+        for shard in removed:
+            filenames = journal.parts.get(shard, ((), None))[0]
+            obsolete = [f for f in filenames if f in site.objectIds()]
+            if obsolete:
+                site.manage_delObjects(obsolete)
+            if shard in journal.parts:
+                del journal.parts[shard]
+            written.extend(["%s/%s" % (purl, f) for f in filenames])
+        for shard in shards:
+            filenames = self._persist_shard(shard)
+            old = journal.parts.get(shard, ((), None))[0]
+            obsolete = [f for f in old
+                        if f not in filenames and f in site.objectIds()]
+            if obsolete:
+                site.manage_delObjects(obsolete)
+            if filenames:
+                journal.parts[shard] = (tuple(filenames), now)
+            elif shard in journal.parts:
+                del journal.parts[shard]
+            written.extend(["%s/%s" % (purl, f) for f in filenames])
+
+        sitemaps = []
+        for filenames, lastmod in journal.parts.values():
+            for filename in filenames:
+                sitemaps.append(dict(
+                    loc="%s/%s" % (purl, filename), lastmod=lastmod))
+        snip = self.index_snippet(sitemaps=sitemaps)
         data = self._persist_file(FILE_IDX, snip)
-        self._purgeFilenamesFromCache(filenames)
+        self._purgeFilenamesFromCache(written)
         return data
 
+    def _persist_shard(self, shard):
+        """ write the part files of shard, returns their ids
+
+        The snippets are streamed into a gzipped temporary file, which rolls
+        over to a new part at MAX_SIZE bytes or MAX_URLS urls, so memory use
+        does not depend on the size of the shard.
+        """
+        head, foot = self.env_snippet(LINKS=LINKS_MARKER).split(LINKS_MARKER)
+        head, foot = head.encode('utf-8'), foot.encode('utf-8')
+        filenames = []
+        part = None
+        for batch in self.batches(shard):
+            xml = self.link_snippet(objects=batch).encode('utf-8')
+            if part is not None and (part.size + len(xml) > MAX_SIZE
+                                     or part.count + len(batch) > MAX_URLS):
+                filenames.append(
+                    self._close_part(shard, part, foot, filenames))
+                part = None
+            if part is None:
+                part = SitemapPart(head)
+            part.write(xml, len(batch))
+        if part is not None:
+            filenames.append(self._close_part(shard, part, foot, filenames))
+        return filenames
+
+    def _close_part(self, shard, part, foot, filenames):
+        """ finish part and upload it, returns the id of the file """
+        part_name = self.shardFilename(shard, len(filenames) + 1)
+        fp = part.close(foot)
+        try:
+            self._persist_stream(part_name, fp)
+        finally:
+            fp.close()
+        return part_name
+
     def _purgeFilenamesFromCache(self, filenames):
         """ if we have a portal_squid tool, try to purge the filenames """
         portal_squid = getToolByName(self.context, 'portal_squid')
@@ -182,7 +469,6 @@ class SiteMapView(BaseView):
         relative_urls = filenames + ['sitemap_index.xml.gz']
         domains = [urlparse.urlparse(d) for d in portal_cache_settings.getDomains()]
         relative_urls = self.context.rewritePurgeUrls(relative_urls, domains)
-        print relative_urls
         # purge!
         from Products.CMFSquidTool.utils import pruneAsync
         for url in relative_urls:
@@ -213,6 +499,17 @@ class SiteMapView(BaseView):
         F.content_type = 'application/octet-stream'
         return data
 
+    def _persist_stream(self, filename, fp):
+        """ persists the gzipped data in the file object fp to the site root
+        """
+        site = getSite()
+        if filename not in site.objectIds():
+            site.manage_addFile(filename)
+        F = getattr(site, filename)
+        # reads fp in chunks
+        F.manage_upload(fp)
+        F.content_type = 'application/octet-stream'
+
     def _make_zip(self, filename, data):
         """ generates a zipfile from data """
         fp = StringIO()
@@ -226,53 +523,139 @@ class SiteMapView(BaseView):
     #@ram.cache(_render_cachekey)
     def generate(self):
         """Generates the Gzipped sitemap."""
-        objects = self.objects()
-        data = self.persistFiles(objects)
+        journal = getSitemapJournal(getSite(), create=True)
+        present = set(self.allShards())
+        if self.request.get('full') or not journal.parts:
+            journal.popDirty()
+            shards = sorted(present)
+        else:
+            shards = [shard for shard in journal.popDirty()
+                      if shard in present]
+        # shards that are no longer used, e.g. those of an older layout
+        removed = [shard for shard in journal.parts.keys()
+                   if shard not in present]
+        data = self.persistFiles(shards, journal, removed)
         return data
 
-    def objects(self):
-        """Returns the data to create the sitemap."""
-        catalog = getToolByName(self.context, 'portal_catalog')
-        portal_url = getToolByName(self.context, 'portal_url')
+    def objects(self, shard=None):
+        """Returns the data to create the sitemap, either of the whole site
+        or of a single shard."""
+        for batch in self.batches(shard):
+            for ob in batch:
+                yield ob
 
-        # the main url does not turn up as a catalog result so we do it manually
-        yield {
-            'loc': portal_url(),
-            'lastmod': DateTime().ISO8601(),
-            'changefreq': 'always',
-            'priority': 1
-        }
+    def batches(self, shard=None):
+        """Returns the data to create the sitemap in lists of up to
+        BATCH_SIZE entries."""
+        portal_url = getToolByName(self.context, 'portal_url')
 
-        for item in catalog.searchResults({'Language': 'all', 'review_state': 'published'}):
+        if shard is None or shard == ROOT_SHARD:
+            # the main url does not turn up as a catalog result so we do it
+            # manually
+            yield [{
+                'loc': portal_url(),
+                'lastmod': DateTime().ISO8601(),
+                'changefreq': 'always',
+                'priority': 1
+            }]
+
+        if sitemapUseSolr(self.context):
+            query = self.solrQuery(shard)
+            records = query is not None and self._solrRecords(query) or ()
+        elif shard is None:
+            records = self._catalogRecords(
+                {'Language': 'all', 'review_state': 'published'})
+        else:
+            query = self.shardQuery(shard)
+            records = query is not None and self._catalogRecords(query) or ()
+
+        for batch in self._extract(records):
+            yield batch
+
+    def solrQuery(self, shard=None):
+        """ returns the Solr query for the items of shard, None if it is
+            empty
+        """
+        query = '+review_state:published'
+        if shard is None:
+            return query
+        portal_path = getToolByName(self.context, 'portal_url').getPortalPath()
+        if shard == ROOT_SHARD:
+            return '%s +path_parents:"%s" +path_depth:%d' % (
+                query, portal_path, len(portal_path.split('/')) + 1)
+        prefixes = self.shardPrefixes(shard)
+        if not prefixes:
+            return None
+        return '%s +path_parents:(%s)' % (query, ' OR '.join(
+            ['"%s/%s"' % (portal_path, prefix) for prefix in prefixes]))
+
+    def _catalogRecords(self, query):
+        """ yields (path, portal_type, outdated, effective, modified,
+            changefreq) for the results of a catalog query
+        """
+        catalog = getToolByName(self.context, 'portal_catalog')
+        has_changefreq = 'changefreq' in catalog.schema()
+        for item in catalog.searchResults(query):
+            yield (item.getPath(), item.portal_type, item.outdated,
+                   item.effective, item.modified,
+                   has_changefreq and item.changefreq or None)
+
+    def _solrRecords(self, query, search=None):
+        """ like _catalogRecords, but pages through the Solr results of
+            query, only fetching the fields the sitemap needs
+        """
+        for doc in iterate_solr(query, SOLR_FIELDS, search=search):
+            yield (doc.get('path_string'), doc.get('portal_type'),
+                   doc.get('outdated'), doc.get('effective'),
+                   doc.get('modified'), None)
+
+    def _extract(self, records):
+        """ computes the sitemap entries for records in a single pass;
+            everything that is the same for all of them is computed once up
+            front
+        """
+        portal_path = getToolByName(self.context, 'portal_url').getPortalPath()
+        # what brain.getURL() does, without going through the request for
+        # every single item
+        base_url = self.request.physicalPathToURL(portal_path)
+        cut = len(portal_path)
+        cutoff = DateTime() - 30
+        default_changefreq = "monthly"
+        iso8601 = ISO8601Formatter()
+        urlmap = self.urlmap
+
+        batch = []
+        for path, portal_type, outdated, effective, modified, changefreq in \
+                records:
             # We only want to link them in the search form results
-            if item.portal_type in ['Amendment', 'Modification', 'Note', 'Proposal', 'LinguaLink']:
+            if portal_type in EXCLUDED_TYPES:
                 continue
-            if item.outdated:
+            if outdated:
                 continue
-            try:
-                lastmod = item.modified.ISO8601()
-            except:
-                lastmod = '2008-01-01T1:00:00+00:00'
-
-            loc = item.getURL()
 
-            changefreq = item.get('changefreq', "monthly")
-            priority = item.get('priority', 0.3)
+            loc = base_url + quote(path[cut:])
 
-            if item.portal_type in ['Event', 'News Item']:
+            if portal_type in ('Event', 'News Item'):
                 changefreq = "never"
-            if item.effective < (DateTime() - 30):
+            elif not changefreq:
+                changefreq = default_changefreq
+            if effective < cutoff:
                 priority = 0.3
             else:
                 priority = 0.9
 
             # manually set urlmap overrides
-            if loc in self.urlmap:
-                changefreq, priority = self.urlmap[loc]
+            if loc in urlmap:
+                changefreq, priority = urlmap[loc]
 
-            yield {
+            batch.append({
                 'loc': loc,
-                'lastmod': lastmod,
+                'lastmod': iso8601(modified),
                 'changefreq': changefreq,  # hourly/daily/weekly/monthly/yearly/never
                 'priority': priority,  # 0.0 to 1.0
-            }
+            })
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
@@ -1,12 +1,27 @@
+from AccessControl.SecurityManagement import getSecurityManager
 from collective.solr.flare import PloneFlare
 from collective.solr.interfaces import ISearch
+from collective.solr.mangler import iso8601date
+from collective.solr.parser import SolrFlare
+from collective.solr.parser import SolrResponse
+from collective.solr.parser import SolrResults
 from collective.solr.utils import prepareData
 from collective.solr.utils import padResults
+from plone.indexer.interfaces import IIndexableObject
+from DateTime import DateTime
+from Products.CMFCore.permissions import AccessInactivePortalContent
 from Products.CMFCore.utils import getToolByName
 from Products.Five.browser import BrowserView
 from Products.LinguaPlone.catalog import languageFilter
+from zope.component import queryMultiAdapter
 from zope.component import queryUtility
 from zope.component.hooks import getSite
+import logging
+import urlparse
+
+from osha.theme.stylesheets import default_loader
+
+log = logging.getLogger('osha.theme.browser.utils')
 
 
 def search_solr(query, request=None, lang_query=True, **params):
@@ -30,6 +45,193 @@ def search_solr(query, request=None, lang_query=True, **params):
     return response
 
 
+def _quote(value):
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def allowedRolesAndUsers(context):
+    """ the allowedRolesAndUsers values of the current user, like the
+        catalog filters on them, as a sorted tuple
+    """
+    catalog = getToolByName(context, 'portal_catalog')
+    member = getToolByName(
+        context, 'portal_membership').getAuthenticatedMember()
+    return tuple(sorted(catalog._listAllowedRolesAndUsers(member)))
+
+
+def showInactive(context):
+    """ whether the current user sees expired and not yet effective items """
+    return bool(getSecurityManager().checkPermission(
+        AccessInactivePortalContent, context))
+
+
+def securityFilter(context):
+    """ the Solr query that restricts results to what the current user may
+        view, like portal_catalog.searchResults does: allowedRolesAndUsers
+        and, unless the user may access inactive content, the effective
+        range
+    """
+    filters = ['allowedRolesAndUsers:(%s)' % ' OR '.join(
+        [_quote(value) for value in allowedRolesAndUsers(context)])]
+    if not showInactive(context):
+        now = iso8601date(DateTime())
+        filters.append('effective:[* TO %s]' % now)
+        filters.append('expires:[%s TO *]' % now)
+    return ' AND '.join(filters)
+
+
+def search_facets(context, query, fields):
+    """ field -> value -> number of documents matching query that the
+        current user may view, for every field in fields. Only the facets
+        are requested from Solr, no documents.
+    """
+    facets = dict([(field, {}) for field in fields])
+    search = queryUtility(ISearch)
+    if search is None:
+        return facets
+    response = search('(%s) AND %s' % (query, securityFilter(context)),
+                      rows=0, facet='true', **{
+                          'facet.field': list(fields),
+                          'facet.limit': -1,
+                          'facet.mincount': 1})
+    counts = getattr(response, 'facet_counts', {}).get('facet_fields', {})
+    for field in fields:
+        facets[field].update(counts.get(field, {}))
+    return facets
+
+
+def completeFlares(context, flares, fields):
+    """Return flares as a list in which every flare that lacks one of fields,
+    e.g. because the field is not stored in Solr, is replaced by the
+    catalog brain of the item. If the catalog has no metadata column for one
+    of fields either, the item itself is used. Missing fields are logged.
+    """
+    flares = list(flares)
+    missing = {}
+    for index, flare in enumerate(flares):
+        data = getattr(flare, 'flare', flare)
+        if not isinstance(data, dict):
+            continue
+        lacking = [field for field in fields if field not in data]
+        if lacking:
+            missing[data.get('UID')] = (index, lacking)
+    if not missing:
+        return flares
+
+    lacking = set()
+    for index, fields_lacking in missing.values():
+        lacking.update(fields_lacking)
+    log.warn('Solr results lack the fields %s, using the catalog instead'
+             % ', '.join(sorted(lacking)))
+    catalog = getToolByName(context, 'portal_catalog')
+    columns = set(catalog.schema())
+    wake = not lacking.issubset(columns)
+    for brain in catalog(UID=[uid for uid in missing if uid],
+                         Language='all'):
+        index, fields_lacking = missing[brain.UID]
+        flares[index] = wake and brain.getObject() or brain
+    return flares
+
+
+def iterate_solr(query, fields, rows=1000, search=None):
+    """Iterate over all documents matching query, returning only fields.
+
+    Pages through the results with a cursor (deep paging); if the Solr
+    server does not return a nextCursorMark it falls back to start/rows
+    paging. search defaults to the collective.solr ISearch utility.
+    """
+    if search is None:
+        search = queryUtility(ISearch)
+    params = dict(fl=' '.join(fields), rows=rows, sort='UID asc')
+    cursor = '*'
+    start = 0
+    while True:
+        if cursor is None:
+            response = search.search(query, start=start, **params)
+        else:
+            response = search.search(query, cursorMark=cursor, **params)
+        results = response.results()
+        for doc in results:
+            yield doc
+        start += len(results)
+        if not results or start >= int(getattr(results, 'numFound', 0)):
+            break
+        if cursor is not None:
+            next_cursor = getattr(response, 'nextCursorMark', None)
+            if next_cursor == cursor:
+                break
+            cursor = next_cursor
+
+
+class FakeSolrSearch(object):
+    """A stand-in for the collective.solr ISearch utility that answers from
+    a list of documents (dicts), e.g. to run iterate_solr without a Solr
+    server. The query is ignored unless a filter callable is given; fl,
+    rows, start and cursorMark are honoured.
+    """
+
+    def __init__(self, documents, filter=None):
+        self.documents = list(documents)
+        self.filter = filter
+        self.queries = []
+
+    def search(self, query, fl=None, rows=10, start=0, cursorMark=None,
+               **params):
+        self.queries.append(query)
+        docs = self.documents
+        if self.filter is not None:
+            docs = [doc for doc in docs if self.filter(query, doc)]
+        rows = int(rows)
+        if cursorMark is not None:
+            start = cursorMark != '*' and int(cursorMark) or 0
+        start = int(start)
+        results = SolrResults()
+        results.numFound = len(docs)
+        results.start = start
+        fields = fl and fl.replace(',', ' ').split() or None
+        for doc in docs[start:start + rows]:
+            if fields is not None:
+                doc = dict((k, v) for k, v in doc.items() if k in fields)
+            results.append(SolrFlare(doc))
+        response = SolrResponse()
+        response.response = results
+        if cursorMark is not None:
+            response.nextCursorMark = str(min(start + rows, len(docs)))
+        return response
+
+
+def getIndexableValues(obj, names):
+    """Return a dict with the values of names for obj, computed the way the
+    catalog computes its metadata (through the indexable wrapper, so that
+    indexers and workflow variables like review_state are honoured).
+    """
+    catalog = getToolByName(obj, 'portal_catalog')
+    wrapper = queryMultiAdapter((obj, catalog), IIndexableObject)
+    if wrapper is None:
+        wrapper = obj
+    values = {}
+    for name in names:
+        value = getattr(wrapper, name, None)
+        if callable(value):
+            value = value()
+        values[name] = value
+    return values
+
+
+def getOldPath(obj, event):
+    """Return the path obj had before the IObjectMovedEvent event, None if
+    obj was added. The event may have been dispatched from a moved or
+    removed parent of obj (a sublocation event), in which case oldParent
+    and oldName are those of the parent.
+    """
+    if event.oldParent is None:
+        return None
+    moved = event.object.getPhysicalPath()
+    relative = obj.getPhysicalPath()[len(moved):]
+    return '/'.join(
+        event.oldParent.getPhysicalPath() + (event.oldName, ) + relative)
+
+
 class EnableJSView(BrowserView):
     """View for enabling/disabling javascript files in portal_javascripts
     (e.g. jquery.highlighsearchterms.js) to prevent js errors and long
@@ -47,3 +249,47 @@ class EnableJSView(BrowserView):
             if self.context.getLayout() == default_view:
                 return True
         return False
+
+
+class PortalStylesheetLoader(object):
+    """Stylesheet loader for the inline styler that serves stylesheets
+    registered in portal_css in-process, without an HTTP roundtrip. All other
+    urls are handed to the fallback loader.
+    """
+
+    def __init__(self, context, fallback=default_loader):
+        self.portal = getToolByName(context, 'portal_url').getPortalObject()
+        self.portal_css = getToolByName(context, 'portal_css')
+        self.fallback = fallback
+
+    def load(self, urls):
+        results = {}
+        remote = []
+        for url in urls:
+            css = self._lookup(url)
+            if css is None:
+                remote.append(url)
+            else:
+                results[url] = css
+        if remote:
+            results.update(self.fallback.load(remote))
+        return results
+
+    def _lookup(self, url):
+        """ return the content of the resource registered for url, or None
+        """
+        portal_url = self.portal.absolute_url()
+        if not url.startswith(portal_url + '/'):
+            return None
+        path = urlparse.urlparse(url)[2]
+        path = path[len(urlparse.urlparse(portal_url)[2]):].lstrip('/')
+        if path.startswith('portal_css/'):
+            # portal_css/<skin>/<resource id>
+            resource_id = path.split('/')[-1]
+        else:
+            resource_id = path
+        concatenated = getattr(self.portal_css, 'concatenatedresources', {})
+        if resource_id not in concatenated and \
+                resource_id not in self.portal_css.getResourcesDict():
+            return None
+        return self.portal_css.getResourceContent(resource_id, self.portal)
@@ -1,17 +1,20 @@
-from BeautifulSoup import BeautifulSoup
 from cgi import escape
+import re
 import types
 
 from zope.app.component.hooks import getSite
 from zope.component import getMultiAdapter
 from zope.component import getUtility
 from zope.i18n import translate
-from Acquisition import aq_base, aq_inner, aq_parent
+from Acquisition import aq_base, aq_chain, aq_inner, aq_parent
 from ZTUtils import make_query
 
 from AccessControl.SecurityManagement import getSecurityManager
 from Products.Archetypes.utils import shasattr
+from Products.CMFCore.interfaces import ISiteRoot
 from Products.CMFCore.utils import getToolByName
+from Products.CMFPlone.interfaces import IFactoryTool
+from Products.ATContentTypes.interfaces import IFactoryTempFolder
 from Products.CMFPlone.utils import safe_unicode
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from Products.LinguaPlone.browser.selector import TranslatableLanguageSelector
@@ -21,10 +24,10 @@ from zope.annotation.interfaces import IAnnotations, IAnnotatable
 from plone.memoize import ram
 from plone.memoize.compress import xhtml_compress
 
+from plone.app.layout.navigation.interfaces import INavigationRoot
 from plone.app.layout.viewlets import common
 from plone.app.portlets.cache import get_language
 
-from slc.subsite.interfaces import ISubsiteEnhanced
 from Products.CMFPlone.utils import isExpired
 from Products.RemoteProvider.content.interfaces import IProvider
 from Products.OSHContentLink.interfaces import IOSH_Link
@@ -32,9 +35,13 @@ from slc.googlesearch.interfaces import IGoogleSearchSettings
 from plone.app.layout.viewlets.common import DublinCoreViewlet
 
 from osha.theme import config
+from osha.theme.cache import LRUCache
 from osha.theme.browser.interfaces import IInlineContentViewlet
+from osha.theme.browser.interfaces import IOSHARequestContext
 from osha.theme.browser.osha_properties_controlpanel import PropertiesControlPanelAdapter
 from osha.theme.browser.topics_view import TopicsBrowserView
+from osha.theme.thesaurus import getCaptionTable
+from osha.theme.translations import getTranslationMap
 from slc.outdated.viewlet import OutdatedViewlet as OutdatedViewletBase
 from slc.outdated import Outdated
 
@@ -46,15 +53,77 @@ class OSHALanguageSelector(TranslatableLanguageSelector):
     _template = ViewPageTemplateFile('templates/languageselector.pt')
 
     def _render_cachekey(method, self):
-        preflang = getToolByName(self.context, 'portal_languages').getPreferredLanguage()
-        portal_state = getMultiAdapter((self.context, self.request), name=u'plone_portal_state')
-        navigation_root_path = portal_state.navigation_root_path()
+        request_context = IOSHARequestContext(self.request)
+        preflang = request_context.preferredLanguage(self.context)
+        navigation_root_path = request_context.navigationRootPath(self.context)
         return (navigation_root_path, preflang)
 
     #@ram.cache(_render_cachekey)
     def render(self):
         return xhtml_compress(self._template())
 
+    def _translations(self, missing):
+        """ For anonymous users the closest translations are looked up in
+            the cached translation maps, which spares waking up every
+            translation of the context. The translations are returned as
+            paths then instead of objects.
+        """
+        request_context = IOSHARequestContext(self.request)
+        if not request_context.portalState(self.context).anonymous():
+            return super(OSHALanguageSelector, self)._translations(missing)
+
+        # Copied from LinguaPlone
+        context = aq_inner(self.context)
+        translations = {}
+        first_pass = True
+        _checkPermission = getSecurityManager().checkPermission
+        for item in aq_chain(context):
+            if ISiteRoot.providedBy(item):
+                # We have a site root, which works as a fallback
+                has_view_permission = bool(_checkPermission('View', item))
+                path = '/'.join(item.getPhysicalPath())
+                for code in missing:
+                    translations[code] = (path, first_pass,
+                                          has_view_permission)
+                break
+            elif IFactoryTempFolder.providedBy(item) or \
+                    IFactoryTool.providedBy(item):
+                continue
+            elif not ITranslatable.providedBy(item):
+                continue
+            for code, (path, has_view_permission) in \
+                    getTranslationMap(context, item).items():
+                if code not in translations:
+                    if (not INavigationRoot.providedBy(item)
+                            and not has_view_permission):
+                        continue
+                    translations[code] = (path, first_pass,
+                                          has_view_permission)
+                    missing = missing - set((code, ))
+            if len(missing) <= 0:
+                break
+            if INavigationRoot.providedBy(item):
+                break
+            first_pass = False
+        return translations
+
+    def _translationURL(self, trans, direct):
+        """ the canonical url of a translation returned by _translations """
+        if not isinstance(trans, basestring):
+            state = getMultiAdapter((trans, self.request),
+                                    name='plone_context_state')
+            return state.canonical_object_url()
+        if direct and self._isDefaultPage():
+            # the translations of a default page are the default pages of
+            # the translations of its folder
+            trans = trans.rsplit('/', 1)[0]
+        return self.request.physicalPathToURL(trans)
+
+    def _isDefaultPage(self):
+        state = getMultiAdapter((aq_inner(self.context), self.request),
+                                name='plone_context_state')
+        return state.is_default_page()
+
     def languages(self):
         context = aq_inner(self.context)
         results = super(OSHALanguageSelector, self).languages()
@@ -63,9 +132,7 @@ class OSHALanguageSelector(TranslatableLanguageSelector):
         translations = self._translations(missing)
         # On the main portal, we want to be able to filter out unwanted
         # languages needes for subsites
-        oshaview = getMultiAdapter((self.context, self.request), name='oshaview')
-        subsite_path = oshaview.subsiteRootPath()
-        potential_subsite = self.context.restrictedTraverse(subsite_path)
+        subsite = IOSHARequestContext(self.request).currentSubsite()
         append_path = self._findpath(context.getPhysicalPath(),
                                      self.request.get('PATH_INFO', ''))
         formvariables = self._formvariables(self.request.form)
@@ -73,9 +140,8 @@ class OSHALanguageSelector(TranslatableLanguageSelector):
 
         # only interesting on the main portal
         # or on subsites without their own language tool
-        if not ISubsiteEnhanced.providedBy(potential_subsite) \
-            or (ISubsiteEnhanced.providedBy(potential_subsite) \
-                and not getattr(aq_base(potential_subsite), 'portal_languages', None)):
+        if subsite is None \
+            or not getattr(aq_base(subsite), 'portal_languages', None):
             portal_properties = getToolByName(self.context, 'portal_properties')
             site_properties = getattr(portal_properties, 'site_properties')
             languages_on_main_site = getattr(site_properties, 'languages_on_main_site', None)
@@ -108,12 +174,11 @@ class OSHALanguageSelector(TranslatableLanguageSelector):
                     non_viewable.add((data['code']))
                     continue
 
-                state = getMultiAdapter((trans, self.request),
-                        name='plone_context_state')
+                url = self._translationURL(trans, direct)
                 if direct:
-                    data['url'] = state.canonical_object_url() + appendtourl
+                    data['url'] = url + appendtourl
                 else:
-                    data['url'] = state.canonical_object_url() + set_language
+                    data['url'] = url + set_language
             else:
                 has_view_permission = bool(_checkPermission('View', context))
                 # Ideally, we should also check the View permission of default
@@ -154,11 +219,11 @@ class OSHASiteActionsViewlet(common.SiteActionsViewlet):
 
     def get_site_slogan(self):
         """ return the site or subsite slogan """
-        preflang = getToolByName(self.context, 'portal_languages').getPreferredLanguage()
-        defaultlang = getToolByName(self.context, 'portal_languages').getDefaultLanguage()
+        request_context = IOSHARequestContext(self.request)
+        preflang = request_context.preferredLanguage(self.context)
+        defaultlang = request_context.defaultLanguage(self.context)
 
-        oshaview = getMultiAdapter((self.context, self.request), name='oshaview')
-        subsite_path = oshaview.subsiteRootPath()
+        subsite_path = request_context.subsiteRootPath(self.context)
         subsite = self.context.restrictedTraverse(subsite_path)
         P = PropertiesControlPanelAdapter(subsite)
         slogans = [(x.language, x.text) for x in P.site_slogan]
@@ -171,9 +236,9 @@ class OSHANetworkchooser(common.ViewletBase):
     _template = ViewPageTemplateFile('templates/network_chooser.pt')
 
     def _render_cachekey(method, self):
-        preflang = getToolByName(self.context, 'portal_languages').getPreferredLanguage()
-        oshaview = getMultiAdapter((self.context, self.request), name='oshaview')
-        subsite_path = oshaview.subsiteRootPath()
+        request_context = IOSHARequestContext(self.request)
+        preflang = request_context.preferredLanguage(self.context)
+        subsite_path = request_context.subsiteRootPath(self.context)
         return (subsite_path, preflang)
 
     @ram.cache(_render_cachekey)
@@ -182,8 +247,8 @@ class OSHANetworkchooser(common.ViewletBase):
 
     def networks(self):
         """ returns a list of networks for display depending on the current subsite """
-        oshaview = getMultiAdapter((self.context, self.request), name='oshaview')
-        subsite_path = oshaview.subsiteRootPath()
+        subsite_path = IOSHARequestContext(self.request).subsiteRootPath(
+            self.context)
 
         if subsite_path.split('/')[-1]=='germany':
             return (self.de(),)
@@ -426,9 +491,10 @@ class OSHALogoViewlet(common.LogoViewlet):
         return portal_state.locale().getLocaleID()
 
     def getLink(self):
-        osha_view = getMultiAdapter((self.context, self.request), name=u'oshaview')
+        request_context = IOSHARequestContext(self.request)
+        osha_view = request_context.oshaview(self.context)
         link = osha_view.get_subsite_property('link_on_logo')
-        protocol = self.request.get('SERVER_URL').split(':')[0]
+        protocol = request_context.serverURL().split(':')[0]
         protocol = protocol == "https" and protocol or "http"
         if link:
             if ":" in link:
@@ -653,17 +719,41 @@ class GoogleSearchViewlet(common.ViewletBase):
         return '%s/site_search' % base_url
 
 
+# the meta tags of an object per language, see OSHADublinCoreViewlet
+metatags_cache = LRUCache(maxsize=2048)
+
+_comments = re.compile(r'<!--.*?-->', re.S)
+_tags = re.compile(r'<[^>]*>')
+
+
+def stripTags(html):
+    """ the text of html, without tags and comments """
+    return _tags.sub(u'', _comments.sub(u'', safe_unicode(html or u'')))
+
+
 class OSHADublinCoreViewlet(DublinCoreViewlet):
 
+    def _metatags_cachekey(self, context):
+        request_context = IOSHARequestContext(self.request)
+        uid = getattr(aq_base(context), 'UID', None)
+        if callable(uid):
+            uid = context.UID()
+        else:
+            uid = '/'.join(context.getPhysicalPath())
+        modified = getattr(aq_base(context), 'modified', None)
+        if callable(modified):
+            modified = str(context.modified())
+        return (uid, modified, request_context.preferredLanguage(context),
+                request_context.navigationRootPath(context))
+
     def listMetaTags(self, context):
         """ retrieve the metadata for the header and make osha specific
             additions """
         EASHW = 'European Agency for Safety and Health at Work'
 
         putils = getToolByName(context, 'plone_utils')
-        portal_state = getMultiAdapter((context, self.request),
-            name=u'plone_portal_state')
-        navigation_root_path = portal_state.navigation_root_path()
+        navigation_root_path = IOSHARequestContext(
+            self.request).navigationRootPath(context)
         navigation_root = context.restrictedTraverse(navigation_root_path)
 
         # fetch plone standard
@@ -679,7 +769,7 @@ class OSHADublinCoreViewlet(DublinCoreViewlet):
         if not desc:
             desc = context.Description() or navigation_root.Description()
 
-        desc = "".join(BeautifulSoup(desc).findAll(text = True))
+        desc = stripTags(desc)
         meta['description'] = desc
         meta['DC.description'] = desc
 
@@ -719,15 +809,13 @@ class OSHADublinCoreViewlet(DublinCoreViewlet):
         if hasattr(aq_inner(context), 'getField'):
             field = context.getField('multilingual_thesaurus')
             if field is not None:
-                pvt = getToolByName(context, 'portal_vocabularies')
                 portal_languages = getToolByName(context, 'portal_languages')
                 lang = portal_languages.getPreferredLanguage()
-                manager = pvt.MultilingualThesaurus._getManager()
+                table = getCaptionTable(context, lang)
 
                 thesitems = field.getAccessor(context)()
                 for thesitem in thesitems:
-                    THESAURUS.append(manager.getTermCaptionById(thesitem,
-                        lang))
+                    THESAURUS.append(table.caption(thesitem))
 
         keywords = PREFIX_KEYWORDS + SUBJECT + THESAURUS
         if isinstance(keywords, (list, tuple)):
@@ -757,7 +845,9 @@ class OSHADublinCoreViewlet(DublinCoreViewlet):
 
     def update(self):
         context = aq_inner(self.context)
-        self.metatags = self.listMetaTags(context).items()
+        meta = metatags_cache.get(self._metatags_cachekey(context),
+                                  lambda: self.listMetaTags(context))
+        self.metatags = meta.items()
 
 
 class OutdatedViewlet(OutdatedViewletBase):
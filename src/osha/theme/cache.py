@@ -0,0 +1,92 @@
+"""Process-wide caches."""
+import threading
+
+from ordereddict import OrderedDict
+
+
+class LRUCache(object):
+    """A small, thread safe LRU cache with hit and miss counters.
+
+    Meant to be instantiated at module level and shared by all threads of
+    the process.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """ return the value cached for key; on a miss compute it by calling
+            factory() and store it, evicting the least recently used entry
+            if the cache is full
+        """
+        self._lock.acquire()
+        try:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                pass
+            else:
+                self._data[key] = value
+                self.hits += 1
+                return value
+        finally:
+            self._lock.release()
+
+        # compute outside of the lock, parsing a stylesheet can take a while
+        value = factory()
+
+        self._lock.acquire()
+        try:
+            self.misses += 1
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        finally:
+            self._lock.release()
+        return value
+
+    def lookup(self, key, default=None):
+        """ return the value cached for key, or default; counts as a hit or
+            a miss
+        """
+        self._lock.acquire()
+        try:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+        finally:
+            self._lock.release()
+
+    def info(self):
+        return dict(
+            hits=self.hits, misses=self.misses, size=len(self._data),
+            maxsize=self.maxsize)
@@ -10,6 +10,10 @@ PRESS_CONTACTS_KEY = 'press_contacts'
 
 INLINE_CONTENT_VIEWLET_NAME = 'inline_content_viewlet'
 
+# lifetime in seconds of ram cached portlets whose cache keys include
+# generation counters, see osha.theme.generations
+RENDER_CACHE_TTL = 60 * 60 * 6
+
 # European network. Used by network_chooser view
 # Will later be factored out to be editable through the web
 EUROPEAN_NETWORK = (
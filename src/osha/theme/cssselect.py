@@ -8,13 +8,16 @@ This code was copied from https://github.com/davecranwell/inline-styler
 """
 
 import cssutils
+import hashlib
 import urlparse
-import urllib
 import sys
 import re
 from lxml import etree
 from lxml.html.builder import E
 
+from osha.theme.cache import LRUCache
+from osha.theme.stylesheets import default_loader
+
 __all__ = ['SelectorSyntaxError', 'ExpressionError',
            'CSSSelector']
 
@@ -988,17 +991,170 @@ class TokenStream(object):
         return self.peeked
 
 
+# parsed stylesheets, keyed by the md5 of the aggregated CSS
+stylesheet_cache = LRUCache(maxsize=16)
+# selector indexes of parsed stylesheets, keyed like stylesheet_cache
+stylesheet_index_cache = LRUCache(maxsize=16)
+# compiled CSSSelector (XPath) objects, keyed by selector text
+selector_cache = LRUCache(maxsize=4096)
+# parsed inline style attributes, keyed by the attribute text
+inline_style_cache = LRUCache(maxsize=1024)
+# serialized properties, keyed by (name, value, priority)
+property_cache = LRUCache(maxsize=4096)
+
+
+def _compile_selector(css):
+    try:
+        return CSSSelector(css)
+    except ExpressionError:
+        # remember unsupported selectors as well, so that they are not
+        # parsed again for every conversion
+        return sys.exc_info()[1]
+
+
+def get_selector(css):
+    """ return a compiled CSSSelector for css, shared process-wide """
+    selector = selector_cache.get(css, lambda: _compile_selector(css))
+    if isinstance(selector, ExpressionError):
+        raise selector
+    return selector
+
+
+def _parse_stylesheet(css):
+    """ parse css into a tuple of (selectors, properties) for every style
+        rule; selectors is a tuple of (selectorText, specificity)
+    """
+    sheet = cssutils.parseString(css)
+    rules = []
+    for rule in sheet:
+        if rule.type != rule.STYLE_RULE:
+            continue
+        selectors = tuple(
+            (selector.selectorText, selector.specificity)
+            for selector in rule.selectorList)
+        rules.append((selectors, tuple(rule.style)))
+    return tuple(rules)
+
+
+def _stylesheet_key(css):
+    if isinstance(css, _unicode):
+        css = css.encode('utf-8')
+    return hashlib.md5(css).hexdigest()
+
+
+def get_stylesheet_rules(css):
+    """ return the parsed style rules of css, shared process-wide """
+    return stylesheet_cache.get(
+        _stylesheet_key(css), lambda: _parse_stylesheet(css))
+
+
+def _simple_selector_keys(selector):
+    """ return the index keys of a simple selector, most selective first:
+        ('id', id), ('class', class_name) and ('tag', name)
+    """
+    ids = []
+    classes = []
+    tags = []
+    while selector is not None:
+        if isinstance(selector, Hash):
+            ids.append(('id', selector.id))
+        elif isinstance(selector, Class):
+            classes.append(('class', selector.class_name))
+        elif isinstance(selector, Element):
+            if selector.namespace == '*' and selector.element != '*':
+                tags.append(('tag', selector.element.lower()))
+            break
+        selector = getattr(selector, 'selector', None)
+    return ids + classes + tags
+
+
+def _selector_keys(css):
+    """ return a tuple (key, required) for css: key is the most selective
+        index key of the rightmost simple selector, or None if it can match
+        any element; required is the set of keys that all have to be present
+        in a document for css to match anything in it
+    """
+    try:
+        selector = parse(css)
+    except SelectorSyntaxError:
+        return None, frozenset()
+    if isinstance(selector, Or):
+        return None, frozenset()
+    required = set()
+    while isinstance(selector, CombinedSelector):
+        required.update(_simple_selector_keys(selector.selector))
+        selector = selector.subselector
+    keys = _simple_selector_keys(selector)
+    required.update(keys)
+    return keys and keys[0] or None, frozenset(required)
+
+
+def _index_stylesheet(css):
+    """ index the selectors of css by their rightmost simple selector; every
+        entry is (order, selectorText, specificity, required, properties)
+        with properties as tuples of (name, value, priority)
+    """
+    index = {}
+    order = 0
+    for selectors, properties in get_stylesheet_rules(css):
+        properties = tuple((p.name, p.value, p.priority) for p in properties)
+        for selectorText, specificity in selectors:
+            key, required = _selector_keys(selectorText)
+            index.setdefault(key, []).append(
+                (order, selectorText, specificity, required, properties))
+            order += 1
+    return index
+
+
+def get_stylesheet_index(css):
+    """ return the selector index of css, shared process-wide """
+    return stylesheet_index_cache.get(
+        _stylesheet_key(css), lambda: _index_stylesheet(css))
+
+
+def _parse_inline_style(text):
+    style = cssutils.css.CSSStyleDeclaration(cssText=text)
+    return tuple((p.name, p.value, p.priority) for p in style)
+
+
+def get_inline_properties(text):
+    """ return the properties of an inline style attribute as tuples of
+        (name, value, priority), shared process-wide
+    """
+    return inline_style_cache.get(text, lambda: _parse_inline_style(text))
+
+
+def _serialize_property(name, value, priority):
+    prop = cssutils.css.Property(name, value, priority)
+    return prop.cssText
+
+
+def serialize_property(name, value, priority):
+    """ return the cssText of a property, shared process-wide """
+    key = (name, value, priority)
+    return property_cache.get(
+        key, lambda: _serialize_property(name, value, priority))
+
+
 class Converter(object):
     """
     This code was copied from https://github.com/davecranwell/inline-styler
     (c) Dave Cranwell
     """
 
-    def __init__(self):
+    def __init__(self, cascade='classic', loader=None):
+        """ cascade is either 'classic', which evaluates every selector and
+            merges the styles with cssutils, or 'indexed', which uses the
+            single pass engine in _get_style_indexed.
+            loader retrieves the linked stylesheets, see
+            osha.theme.stylesheets; defaults to the shared URL loader
+        """
         self.CSSErrors = []
         self.CSSUnsupportErrors = dict()
         self.supportPercentage = 100
         self.convertedHTML = ""
+        self.cascade = cascade
+        self.loader = loader or default_loader
 
     def perform(self, sourceHTML, sourceURL=''):
         aggregateCSS = ""
@@ -1007,46 +1163,49 @@ class Converter(object):
         aggregateCSS = ""
 
         # retrieve CSS rel links from html pasted and aggregate into one string
-        CSSRelSelector = CSSSelector(
+        CSSRelSelector = get_selector(
             "link[rel=stylesheet],link[rel=StyleSheet],link[rel=STYLESHEET]")
         matching = CSSRelSelector.evaluate(document)
+        links = []
         for element in matching:
-            try:
-                csspath = element.get("href")
-                if len(sourceURL):
-                    if element.get("href").lower().find("http://", 0) < 0:
-                        parsedUrl = urlparse.urlparse(sourceURL)
-                        csspath = urlparse.urljoin(
-                            parsedUrl.scheme + "://" + parsedUrl.hostname,
-                            csspath
-                        )
-                f = urllib.urlopen(csspath)
-                aggregateCSS += ''.join(f.read())
-                element.getparent().remove(element)
-            except:
-                raise IOError(
-                    'The stylesheet ' + element.get("href") + ' could not be '
-                    'found'
-                )
+            csspath = element.get("href")
+            if len(sourceURL):
+                if element.get("href").lower().find("http://", 0) < 0:
+                    parsedUrl = urlparse.urlparse(sourceURL)
+                    csspath = urlparse.urljoin(
+                        parsedUrl.scheme + "://" + parsedUrl.hostname,
+                        csspath
+                    )
+            links.append((element, csspath))
+
+        # fetch all of them at once, the loader may do that concurrently
+        stylesheets = self.loader.load([csspath for element, csspath in links])
+        for element, csspath in links:
+            aggregateCSS += stylesheets[csspath]
+            element.getparent().remove(element)
 
         #include inline style elements
-        print aggregateCSS
-        CSSStyleSelector = CSSSelector("style,Style")
+        CSSStyleSelector = get_selector("style,Style")
         matching = CSSStyleSelector.evaluate(document)
         for element in matching:
             aggregateCSS += element.text
             element.getparent().remove(element)
 
         #convert  document to a style dictionary compatible with etree
-        styledict = self._get_style(document, aggregateCSS)
+        if self.cascade == 'indexed':
+            styledict = self._get_style_indexed(document, aggregateCSS)
+        else:
+            styledict = {}
+            for element, style in self._get_style(
+                    document, aggregateCSS).items():
+                styledict[element] = style.getCssText(separator=u'')
 
         #set inline style attribute if not one of the elements not worth
         #styling
         ignoreList = ['html', 'head', 'title', 'meta', 'link', 'script']
         for element, style in styledict.items():
             if element.tag not in ignoreList:
-                v = style.getCssText(separator=u'')
-                element.set('style', v)
+                element.set('style', style)
 
         self.replace_youtube_videos_with_links(document)
 
@@ -1064,14 +1223,11 @@ class Converter(object):
         supportratios = {}
         compliance = dict()
 
-        sheet = cssutils.parseString(css)
-
-        rules = (rule for rule in sheet if rule.type == rule.STYLE_RULE)
-        for rule in rules:
+        for selectors, properties in get_stylesheet_rules(css):
 
-            for selector in rule.selectorList:
+            for selectorText, specificity in selectors:
                 try:
-                    cssselector = CSSSelector(selector.selectorText)
+                    cssselector = get_selector(selectorText)
                     matching = cssselector.evaluate(document)
 
                     for element in matching:
@@ -1095,7 +1251,7 @@ class Converter(object):
                                     specificities[element][p.name] = (
                                         1, 0, 0, 0)
 
-                        for p in rule.style:
+                        for p in properties:
                             #create supportratio dic item for this property
                             if p.name not in supportratios:
                                 supportratios[p.name] = {
@@ -1129,10 +1285,10 @@ class Converter(object):
                             if p not in view[element]:
                                 view[element].setProperty(
                                     p.name, p.value, p.priority)
-                                specificities[element][p.name] = selector.specificity
+                                specificities[element][p.name] = specificity
                             else:
                                 sameprio = (p.priority == view[element].getPropertyPriority(p.name))
-                                if not sameprio and bool(p.priority) or (sameprio and selector.specificity >= specificities[element][p.name]):
+                                if not sameprio and bool(p.priority) or (sameprio and specificity >= specificities[element][p.name]):
                                     # later, more specific or higher prio
                                     view[element].setProperty(p.name, p.value, p.priority)
 
@@ -1142,6 +1298,107 @@ class Converter(object):
                     pass
         return view
 
+    def _get_style_indexed(self, document, css):
+        """ Single pass variant of _get_style with the same cascade.
+
+        The selectors are indexed by their rightmost simple selector, so
+        walking the tree once only visits the rules that can apply to an
+        element. A selector is evaluated against the document the first time
+        one of its candidate elements shows up. The cascade is kept in a
+        plain dict per element and serialized once at the end.
+        Returns a dict of element to style text.
+        """
+        index = get_stylesheet_index(css)
+        universal = index.get(None, [])
+
+        elements = []
+        present = set()
+        for element in document.iter():
+            tag = element.tag
+            if not isinstance(tag, _basestring):
+                # comments and processing instructions
+                continue
+            keys = [('tag', tag.lower())]
+            element_id = element.get('id')
+            if element_id is not None:
+                keys.append(('id', element_id))
+            classes = element.get('class')
+            if classes:
+                keys.extend(('class', c) for c in set(classes.split()))
+            present.update(keys)
+            elements.append((element, keys))
+
+        matches = {}
+        view = {}
+        for element, keys in elements:
+            candidates = list(universal)
+            for key in keys:
+                candidates.extend(index.get(key, []))
+            if not candidates:
+                continue
+            candidates.sort()
+
+            for order, selectorText, specificity, required, properties in \
+                    candidates:
+                matching = matches.get(selectorText)
+                if matching is None:
+                    matching = matches[selectorText] = self._match_selector(
+                        document, selectorText, required, present)
+                if element not in matching:
+                    continue
+
+                style = view.get(element)
+                if style is None:
+                    # name -> [value, priority, specificity], names in the
+                    # order they were first set
+                    style = view[element] = ({}, [])
+                    inlinestyletext = element.get('style')
+                    if inlinestyletext:
+                        for name, value, priority in \
+                                get_inline_properties(inlinestyletext):
+                            if name not in style[0]:
+                                style[1].append(name)
+                            style[0][name] = [value, priority, (1, 0, 0, 0)]
+                values, names = style
+
+                for name, value, priority in properties:
+                    current = values.get(name)
+                    if current is None:
+                        values[name] = [value, priority, specificity]
+                        names.append(name)
+                        continue
+                    sameprio = (priority == current[1])
+                    if not sameprio and bool(priority) or \
+                            (sameprio and specificity >= current[2]):
+                        # later, more specific or higher prio; like
+                        # _get_style the specificity is kept
+                        current[0] = value
+                        current[1] = priority
+
+        styledict = {}
+        for element, (values, names) in view.items():
+            texts = []
+            for name in names:
+                value, priority, specificity = values[name]
+                text = serialize_property(name, value, priority)
+                if text:
+                    texts.append(text)
+            styledict[element] = u';'.join(texts)
+        return styledict
+
+    def _match_selector(self, document, selectorText, required, present):
+        """ return the set of elements of document matching selectorText """
+        if not required.issubset(present):
+            # an id, class or tag of the selector is not in the document
+            return frozenset()
+        try:
+            cssselector = get_selector(selectorText)
+        except ExpressionError:
+            if str(sys.exc_info()[1]) not in self.CSSErrors:
+                self.CSSErrors.append(str(sys.exc_info()[1]))
+            return frozenset()
+        return frozenset(cssselector.evaluate(document))
+
     def replace_youtube_videos_with_links(self, doc):
         """Replace any iframe elements found with a link to the src and a
         placeholder image from youtube"""
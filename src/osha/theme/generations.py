@@ -0,0 +1,267 @@
+"""Generation counters for cache invalidation.
+
+A generation counter is bumped whenever content it stands for changes, e.g.
+when a News Item is published. Cache keys that include the counters change
+with them, so the cached value is invalidated on every ZEO client at once
+instead of having to age out. The counters are stored persistently on the
+portal.
+"""
+from Acquisition import aq_base
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from zope.annotation.interfaces import IAnnotations
+from zope.app.component.hooks import getSite
+from zope.app.container.interfaces import IContainerModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
+from Products.CMFCore.interfaces import IActionSucceededEvent
+
+GENERATIONS_KEY = 'osha.theme.generations'
+# on News Items and Events: the language and subjects last bumped
+SEEN_KEY = 'osha.theme.generations.seen'
+# on content: the values shown in the navigation last bumped
+NAVIGATION_SEEN_KEY = 'osha.theme.generations.navigation'
+# the values of an item the navigation shows
+NAVIGATION_FIELDS = ('Title', 'Description', 'exclude_from_nav')
+
+NEWS = 'news'
+EVENTS = 'events'
+NAVIGATION = 'navigation'
+TRANSLATIONS = 'translations'
+HOMEPAGE = 'homepage'
+THESAURUS = 'thesaurus'
+# the id of the thesaurus vocabulary in portal_vocabularies
+THESAURUS_VOCABULARY = 'MultilingualThesaurus'
+# the folders below a language folder the homepage lists
+HOMEPAGE_FOLDERS = ('teaser', 'in-focus')
+
+
+def _counters(site, create=False):
+    ann = IAnnotations(site)
+    if create:
+        return ann.setdefault(GENERATIONS_KEY, OOBTree())
+    return ann.get(GENERATIONS_KEY, {})
+
+
+def getGenerations(*keys):
+    """ returns the current generation of every key as a tuple """
+    site = getSite()
+    if site is None:
+        return (0, ) * len(keys)
+    counters = _counters(site)
+    generations = []
+    for key in keys:
+        counter = counters.get(key)
+        generations.append(counter is not None and counter() or 0)
+    return tuple(generations)
+
+
+def bumpGenerations(*keys):
+    """ increments the generation of every key """
+    site = getSite()
+    if site is None:
+        return
+    counters = _counters(site, create=True)
+    for key in keys:
+        counter = counters.get(key)
+        if counter is None:
+            counters[key] = Length(1)
+        else:
+            # Length resolves conflicting increments
+            counter.change(1)
+
+
+def newsGenerationKeys(languages, subjects=()):
+    """ returns the keys of the news generations a listing depends on: the
+        counters of its subjects if it is restricted to subjects, otherwise
+        those of languages and of language neutral content
+    """
+    return _generationKeys(NEWS, languages, subjects)
+
+
+def eventsGenerationKeys(languages, subjects=()):
+    """ see newsGenerationKeys """
+    return _generationKeys(EVENTS, languages, subjects)
+
+
+def _generationKeys(kind, languages, subjects):
+    if subjects:
+        return tuple((kind, 'subject', subject) for subject in subjects)
+    return tuple((kind, 'language', language)
+                 for language in tuple(languages) + ('', ))
+
+
+def _kind(obj):
+    """ news, events or None for content the portlets don't list """
+    portal_type = getattr(aq_base(obj), 'portal_type', None)
+    if portal_type == 'Event':
+        return EVENTS
+    if portal_type == 'News Item':
+        return NEWS
+    isNews = getattr(aq_base(obj), 'isNews', None)
+    if callable(isNews):
+        isNews = obj.isNews()
+    if isNews:
+        return NEWS
+    return None
+
+
+def _annotations(obj):
+    try:
+        return IAnnotations(obj)
+    except TypeError:
+        return None
+
+
+def bumpContentGenerations(obj, event):
+    """ event handler: bump the generations of the language and subjects of
+        a News Item or Event that was modified, published, retracted, added
+        or removed. The language and subjects it had when it was last bumped
+        are bumped as well, so that listings it was removed from by an edit
+        are invalidated too.
+    """
+    kind = _kind(obj)
+    if kind is None:
+        return
+    if 'portal_factory' in obj.getPhysicalPath():
+        return
+    language = getattr(aq_base(obj), 'Language', None)
+    language = callable(language) and obj.Language() or ''
+    subjects = getattr(aq_base(obj), 'Subject', None)
+    subjects = callable(subjects) and tuple(obj.Subject()) or ()
+    keys = set([(kind, 'language', language)])
+    keys.update([(kind, 'subject', subject) for subject in subjects])
+
+    ann = _annotations(obj)
+    if ann is not None:
+        seen = ann.get(SEEN_KEY)
+        if seen is not None:
+            seen_language, seen_subjects = seen
+            keys.add((kind, 'language', seen_language))
+            keys.update([(kind, 'subject', subject)
+                         for subject in seen_subjects])
+        if seen != (language, subjects):
+            ann[SEEN_KEY] = (language, subjects)
+    bumpGenerations(*keys)
+
+
+def navigationGenerationKey(path):
+    """ returns the key of the navigation generation of the folder at path,
+        which stands for the children of the folder
+    """
+    return (NAVIGATION, path)
+
+
+def _navigationChanged(obj):
+    """ whether the values of obj the navigation shows changed since they
+        were last seen
+    """
+    values = []
+    for name in NAVIGATION_FIELDS:
+        value = getattr(aq_base(obj), name, None)
+        if callable(value):
+            value = getattr(obj, name)()
+        values.append(value)
+    values = tuple(values)
+    ann = _annotations(obj)
+    if ann is None:
+        return True
+    if ann.get(NAVIGATION_SEEN_KEY) == values:
+        return False
+    ann[NAVIGATION_SEEN_KEY] = values
+    return True
+
+
+def bumpNavigationGeneration(obj, event):
+    """ event handler: bump the navigation generation of the folders whose
+        children changed: the parent of content that was published,
+        retracted, added, moved or removed or whose title, description or
+        exclude_from_nav was modified, and a folder whose children were
+        reordered
+    """
+    path = obj.getPhysicalPath()
+    if 'portal_factory' in path:
+        return
+    folderish = getattr(aq_base(obj), 'isPrincipiaFolderish', False)
+    paths = set()
+    if IObjectMovedEvent.providedBy(event):
+        # imported here, browser.utils pulls in collective.solr
+        from osha.theme.browser.utils import getOldPath
+        old_path = getOldPath(obj, event)
+        if old_path is not None:
+            if event.object is obj:
+                paths.add(old_path.rsplit('/', 1)[0])
+            if folderish:
+                # a folder that is put at the same path again starts afresh
+                paths.add(old_path)
+        if event.newParent is not None:
+            if event.object is obj:
+                paths.add('/'.join(path[:-1]))
+            if folderish:
+                paths.add('/'.join(path))
+    elif IContainerModifiedEvent.providedBy(event):
+        # children added, removed or reordered
+        paths.add('/'.join(path))
+    elif IActionSucceededEvent.providedBy(event) or _navigationChanged(obj):
+        paths.add('/'.join(path[:-1]))
+    if paths:
+        bumpGenerations(*[navigationGenerationKey(p) for p in paths])
+
+
+def bumpTranslationGeneration(obj, event):
+    """ event handler: bump the translations generation when translatable
+        content was translated, published, retracted, added, moved or
+        removed. Edits leave the translation maps alone.
+    """
+    if 'portal_factory' in obj.getPhysicalPath():
+        return
+    bumpGenerations(TRANSLATIONS)
+
+
+def _inThesaurus(path):
+    for i in range(1, len(path)):
+        if path[i - 1] == 'portal_vocabularies' and \
+                path[i] == THESAURUS_VOCABULARY:
+            return True
+    return False
+
+
+def bumpThesaurusGeneration(obj, event):
+    """ event handler: bump the thesaurus generation when the thesaurus
+        vocabulary or one of its terms was modified, added, moved or removed
+    """
+    path = obj.getPhysicalPath()
+    if 'portal_factory' in path:
+        return
+    paths = [path]
+    oldParent = getattr(event, 'oldParent', None)
+    if oldParent is not None:
+        paths.append(oldParent.getPhysicalPath())
+    if [p for p in paths if _inThesaurus(p)]:
+        bumpGenerations(THESAURUS)
+
+
+def homepageGenerationKey(language):
+    """ returns the key of the homepage generation of language """
+    return (HOMEPAGE, language)
+
+
+def _homepageKeys(path):
+    return [homepageGenerationKey(path[i - 1]) for i in range(1, len(path))
+            if path[i] in HOMEPAGE_FOLDERS]
+
+
+def bumpHomepageGenerations(obj, event):
+    """ event handler: bump the homepage generation of a language when
+        content in its teaser or in-focus folder was modified, published,
+        retracted, added, moved or removed
+    """
+    path = obj.getPhysicalPath()
+    if 'portal_factory' in path:
+        return
+    keys = _homepageKeys(path)
+    oldParent = getattr(event, 'oldParent', None)
+    if oldParent is not None:
+        keys.extend(_homepageKeys(
+            oldParent.getPhysicalPath() + (event.oldName, )))
+    if keys:
+        bumpGenerations(*set(keys))
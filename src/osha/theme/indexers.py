@@ -0,0 +1,16 @@
+"""Catalog metadata of News Items, so that they can be listed (e.g. on the
+homepage, see osha.theme.browser.homepage) without waking them up.
+"""
+from plone.indexer import indexer
+from Products.ATContentTypes.interface.news import IATNewsItem
+
+
+@indexer(IATNewsItem)
+def hasImage(obj):
+    return bool(obj.getImage())
+
+
+@indexer(IATNewsItem)
+def getExternalLink(obj):
+    field = obj.getField('external_link')
+    return field and field.getRaw(obj) or ''
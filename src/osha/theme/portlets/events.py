@@ -1,21 +1,21 @@
 from Acquisition import aq_inner, aq_parent
 from DateTime import DateTime
-from zope.component import getMultiAdapter
 from plone.memoize import ram
 from plone.memoize.compress import xhtml_compress
 from plone.memoize.instance import memoize
 from plone.app.portlets.portlets import events
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from Products.CMFCore.utils import getToolByName
+from osha.theme.browser.interfaces import IOSHARequestContext
 
 class Renderer(events.Renderer):
     """ """
     _template = ViewPageTemplateFile('events.pt')
 
     def _render_cachekey(method, self):
-        preflang = getToolByName(self.context, 'portal_languages').getPreferredLanguage()
-        portal_state = getMultiAdapter((self.context, self.request), name=u'plone_portal_state')
-        navigation_root_path = portal_state.navigation_root_path()
+        request_context = IOSHARequestContext(self.request)
+        preflang = request_context.preferredLanguage(self.context)
+        navigation_root_path = request_context.navigationRootPath(self.context)
         return (preflang, navigation_root_path)
 
     @ram.cache(_render_cachekey)
@@ -26,14 +26,14 @@ class Renderer(events.Renderer):
     def _data(self):
         context = aq_inner(self.context)
         catalog = getToolByName(context, 'portal_catalog')
-        portal_languages = getToolByName(self.context, 'portal_languages')
-        preflang = portal_languages.getPreferredLanguage()
+        request_context = IOSHARequestContext(self.request)
+        preflang = request_context.preferredLanguage(self.context)
 
         # search in the navigation root of the currently selected language and in the canonical path
         # with Language = preferredLanguage or neutral
         paths = list()
-        portal_state = getMultiAdapter((self.context, self.request), name=u'plone_portal_state')
-        navigation_root_path = portal_state.navigation_root_path()
+        portal_state = request_context.portalState(self.context)
+        navigation_root_path = request_context.navigationRootPath(self.context)
         paths.append(navigation_root_path)
         try:
             navigation_root = portal_state.portal().restrictedTraverse(navigation_root_path)
@@ -42,8 +42,7 @@ class Renderer(events.Renderer):
         except:
             pass
 
-        oshaview = getMultiAdapter((self.context, self.request), name=u'oshaview')
-        mySEP = oshaview.getCurrentSingleEntryPoint()
+        mySEP = request_context.currentSingleEntryPoint()
         kw = ''
         if mySEP is not None:
             kw = mySEP.getProperty('keyword', '')
@@ -69,8 +68,8 @@ class Renderer(events.Renderer):
         context = aq_inner(self.context)
         catalog = getToolByName(context, 'portal_catalog')
         
-        portal_state = getMultiAdapter((self.context, self.request), name=u'plone_portal_state')
-        navigation_root_path = portal_state.navigation_root_path()
+        navigation_root_path = IOSHARequestContext(
+            self.request).navigationRootPath(self.context)
         query = dict(portal_type="Folder",
                     path=navigation_root_path,
                     object_provides="p4a.calendar.interfaces.ICalendarEnhanced"
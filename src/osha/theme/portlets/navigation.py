@@ -16,7 +16,11 @@ from zope.component import adapts
 from zope.interface import Interface
 from zope.interface import implements
 
+from osha.theme.cache import LRUCache
+from osha.theme.generations import getGenerations, navigationGenerationKey
+
 import collections
+import time
 
 
 def get_language(context, request):
@@ -65,6 +69,78 @@ class INavtreeFactory(Interface):
         """Return a CatalogNavTree instance."""
 
 
+# the children of a folder in the navigation tree, shared by all requests
+# of the same language and permissions, see NavtreeSkeleton
+navtree_cache = LRUCache(maxsize=4096)
+# seconds after which cached children are refetched at the latest, so that
+# items whose effective or expiration date passes appear and disappear
+NAVTREE_MAXAGE = 600
+
+
+class NavtreeSkeleton(object):
+    """The parts of the navigation tree that are the same for every page:
+    the children of a folder, in the order of the folder, as plain dicts.
+
+    The children are cached by folder, language, the roles and groups the
+    catalog filters the results on, and the navigation generation of the
+    folder, which is bumped whenever its children change (see
+    osha.theme.generations.bumpNavigationGeneration). Everything that
+    depends on the current page is left to CatalogNavTree. The dicts are
+    shared between requests and must not be modified.
+    """
+
+    def __init__(self, context, language):
+        self.context = context
+        self.language = language
+        self.catalog = getToolByName(context, "portal_catalog")
+        member = getToolByName(
+            context, "portal_membership").getAuthenticatedMember()
+        self.allowed = tuple(sorted(
+            self.catalog._listAllowedRolesAndUsers(member)))
+        self.slot = int(time.time() / NAVTREE_MAXAGE)
+
+    def children(self, path):
+        generation = getGenerations(navigationGenerationKey(path))[0]
+        key = (path, self.language, self.allowed, generation, self.slot)
+        return navtree_cache.get(key, lambda: self._children(path))
+
+    def _children(self, path):
+        context = self.context
+        portal_types = getToolByName(context, "portal_types")
+        portal_properties = getToolByName(context, "portal_properties")
+        use_view_types = \
+            portal_properties.site_properties.typesUseViewActionInListings
+        normalize = getUtility(IIDNormalizer).normalize
+
+        query = {}
+        query["path"] = dict(query=path, depth=1)
+        query["portal_type"] = typesToList(context)
+        query["sort_on"] = "getObjPositionInParent"
+        query["sort_order"] = "asc"
+        query["Language"] = self.language
+
+        type_titles = {}
+        children = []
+        for brain in self.catalog.searchResults(query):
+            portal_type = brain.portal_type
+            if portal_type not in type_titles:
+                fti = portal_types.getTypeInfo(portal_type)
+                type_titles[portal_type] = \
+                    fti is not None and fti.Title() or portal_type
+            children.append({
+                "path": brain.getPath(),
+                "title": brain.Title,
+                "description": brain.Description or None,
+                "portal_type": normalize(portal_type),
+                "portal_type_title": type_titles[portal_type],
+                "use_view": portal_type in use_view_types,
+                "review_state": normalize(brain.review_state),
+                "folderish": brain.is_folderish,
+                "exclude_from_nav": brain.exclude_from_nav,
+            })
+        return tuple(children)
+
+
 class CatalogNavTree(object):
     def __init__(self, context, request, portlet):
         self.build(context, request, portlet)
@@ -91,20 +167,18 @@ class CatalogNavTree(object):
             navrootPath = "/".join(getNavigationRoot(context).getPhysicalPath())
             navrootLang = getNavigationRoot(context).Language()
 
-        contextPathLen = len(contextPath)
         parentDepth = (contextPath.count("/") - 1)
 
-        query = {}
-        query["path"] = dict(query=contextPath,
-                           navtree=True,
-                           navtree_start=navrootPath.count("/"))
-        query["portal_type"] = typesToList(context)
-        query["sort_on"] = "getObjPositionInParent"
-        query["sort_order"] = "asc"
-        query["Language"] = navrootLang
+        # the navtree query returns the children of the navigation root and
+        # of every folder between it and the context, including the context
+        folders = [navrootPath]
+        if contextPath.startswith(navrootPath + "/"):
+            path = navrootPath
+            for id in contextPath[len(navrootPath) + 1:].split("/"):
+                path = "%s/%s" % (path, id)
+                folders.append(path)
 
-        catalog = getToolByName(context, "portal_catalog")
-        results = catalog.searchResults(query)
+        skeleton = NavtreeSkeleton(context, navrootLang)
         cache = {}
 
         cache[navrootPath] = {
@@ -113,41 +187,32 @@ class CatalogNavTree(object):
             "children": []
         }
 
-        for brain in results:
-            path = brain.getPath()
-            pathLen = len(path)
-            parentPath = path.rsplit("/", 1)[0]
-            ancestor = current = currentParent = False
-            if path == contextPath:
-                current = True
-            elif contextPathLen > pathLen:
-                ancestor = contextPath.startswith(path + "/")
-                currentParent = ancestor and path.count("/") == parentDepth
-
-            if brain.exclude_from_nav and not currentParent:
-                continue
-
-            oldNode = cache.get(path, None)
-            node = {"brain": brain,
-                  "path": path,
-                  "current": current,
-                  "currentParent": currentParent,
-                  "ancestor": ancestor }
-
-            oldNode = cache.get(path, None)
-            if oldNode is not None:
-                oldNode.update(node)
-                node = oldNode
-            else:
-                node["children"] = []
-                cache[path] = node
-
-            parentNode = cache.get(parentPath, None)
+        for folder in folders:
+            parentNode = cache.get(folder, None)
             if parentNode is None:
-                parentNode = cache[parentPath] = dict(children=[node])
-            else:
+                # excluded from the navigation, so are its children
+                break
+            for info in skeleton.children(folder):
+                path = info["path"]
+                ancestor = current = currentParent = False
+                if path == contextPath:
+                    current = True
+                elif contextPath.startswith(path + "/"):
+                    ancestor = True
+                    currentParent = path.count("/") == parentDepth
+
+                if info["exclude_from_nav"] and not currentParent:
+                    continue
+
+                node = {"info": info,
+                        "path": path,
+                        "current": current,
+                        "currentParent": currentParent,
+                        "ancestor": ancestor,
+                        "children": [],
+                        "parent": parentNode}
+                cache[path] = node
                 parentNode["children"].append(node)
-            node["parent"] = parentNode
         self.tree = cache
         self.root = cache[navrootPath]
 
@@ -217,41 +282,34 @@ class Renderer(navigation.Renderer):
         return True
 
     def update(self):
-        portal_types = getToolByName(self.context, "portal_types")
-        type_titles = dict([(fti.getId(), fti.Title())
-                            for fti in portal_types.listTypeInfo()])
-
-        portal_properties = getToolByName(self.context, "portal_properties")
-        site_properties = portal_properties.site_properties
-        use_view_types = site_properties.typesUseViewActionInListings
-        normalize = getUtility(IIDNormalizer).normalize
         treefactory = getMultiAdapter((self.context, self.request),
                                       INavtreeFactory)
         tree = treefactory(self)
+        physicalPathToURL = self.request.physicalPathToURL
 
         for node in tree.iter():
-            brain = node.get("brain", None)
-            if brain is None:
+            info = node.get("info", None)
+            if info is None:
                 continue
-            node["title"] = brain.Title
-            node["description"] = brain.Description or None
-            node["portal_type"] = normalize(brain.portal_type)
-            node["portal_type_title"] = type_titles.get(brain.portal_type,
-                                                        brain.portal_type)
-            node["url"] = ("%s/view" % brain.getURL()if brain.portal_type
-                           in use_view_types else brain.getURL())
+            inPath = node["current"] or node["currentParent"]
+            node["title"] = info["title"]
+            node["description"] = info["description"]
+            node["portal_type"] = info["portal_type"]
+            node["portal_type_title"] = info["portal_type_title"]
+            url = physicalPathToURL(info["path"])
+            node["url"] = info["use_view"] and "%s/view" % url or url
             node["link_class"] = " ".join(filter(None,
-                [normalize(brain.review_state),
-                 "navTreeItemInPath" if node["current"] or node["currentParent"] else None,
-                 "navTreeCurrentItem" if node["current"] else None])) 
-            node["folderish"] = brain.is_folderish
+                [info["review_state"],
+                 "navTreeItemInPath" if inPath else None,
+                 "navTreeCurrentItem" if node["current"] else None]))
+            node["folderish"] = info["folderish"]
             node["class"] = " ".join(filter(None,
                 ["navTreeItem",
-                 "navTreeFolderish" if brain.is_folderish else None, 
-                 "navTreeItemInPath" if node["current"] or node["currentParent"] else None,
+                 "navTreeFolderish" if info["folderish"] else None,
+                 "navTreeItemInPath" if inPath else None,
                  "navTreeCurrentNode" if node["current"] else None])) or None
 
-        if "brain" in tree.root:
+        if "info" in tree.root:
             self.tree = [tree.root]
         else:
             self.tree = tree.root["children"]
@@ -2,7 +2,7 @@ import Acquisition
 from collective.solr.mangler import iso8601date
 from DateTime.DateTime import DateTime
 
-from osha.theme.browser.utils import search_solr
+from osha.theme.browser.utils import completeFlares, search_solr
 from plone.memoize.instance import memoize
 from plone.memoize import ram
 from plone.memoize.compress import xhtml_compress
@@ -15,6 +15,7 @@ from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone import PloneMessageFactory as _
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 
+from time import time
 from types import UnicodeType
 
 from zope import schema
@@ -22,6 +23,15 @@ from zope.component import getMultiAdapter
 from zope.formlib import form
 from zope.interface import implements
 
+from osha.theme.browser.interfaces import IOSHARequestContext
+from osha.theme.config import RENDER_CACHE_TTL
+from osha.theme.generations import getGenerations, eventsGenerationKeys
+
+# read by the template, fetched from the catalog when Solr does not return
+# them
+TEMPLATE_FIELDS = (
+    'Description', 'location', 'start', 'dateToBeConfirmed')
+
 
 class IEventsPortlet(IPortletDataProvider):
     count = schema.Int(
@@ -101,14 +111,11 @@ class Renderer(events.Renderer):
 
     def __init__(self, *args):
         events.Renderer.__init__(self, *args)
-        portal_languages = getToolByName(self.context, 'portal_languages')
-        self.preflang = portal_languages.getPreferredLanguage()
-
-        portal_state = getMultiAdapter(
-                            (self.context, self.request),
-                            name=u'plone_portal_state'
-                            )
-        self.navigation_root_path = portal_state.navigation_root_path()
+        request_context = IOSHARequestContext(self.request)
+        self.preflang = request_context.preferredLanguage(self.context)
+        portal_state = request_context.portalState(self.context)
+        self.navigation_root_path = request_context.navigationRootPath(
+            self.context)
         portal = portal_state.portal()
         self.root = portal.restrictedTraverse(self.navigation_root_path)
 
@@ -121,15 +128,21 @@ class Renderer(events.Renderer):
             self.data.rss_explanation_path=''
 
     def _render_cachekey(method, self):
-        portal_languages = getToolByName(self.context, 'portal_languages')
-        preflang = portal_languages.getPreferredLanguage()
+        request_context = IOSHARequestContext(self.request)
+        preflang = request_context.preferredLanguage(self.context)
         calendar_path = self.data.calendar_path
         subject = self.data.subject
         navigation_root_path = self.navigation_root_path
         # http or https?
-        server_url = self.request.get('SERVER_URL', '')
+        server_url = request_context.serverURL() or ''
         protocol, domain = server_url.split("://")
-        return (calendar_path, preflang, subject, navigation_root_path, protocol, domain)
+        # invalidated when events are published, see osha.theme.generations;
+        # the time slot catches events that are over
+        generations = getGenerations(*eventsGenerationKeys(
+            (preflang, request_context.defaultLanguage(self.context)),
+            subject))
+        return (calendar_path, preflang, subject, navigation_root_path, protocol, domain,
+                generations, time() // RENDER_CACHE_TTL)
 
     @ram.cache(_render_cachekey)
     def render(self):
@@ -145,8 +158,8 @@ class Renderer(events.Renderer):
     def _data(self):
         context = Acquisition.aq_inner(self.context)
         catalog = getToolByName(context, 'portal_catalog')
-        portal_languages = getToolByName(context, 'portal_languages')
-        preflang = portal_languages.getPreferredLanguage()
+        request_context = IOSHARequestContext(self.request)
+        preflang = request_context.preferredLanguage(context)
 
         # search in the navigation root of the currently selected
         # language and in the canonical path
@@ -161,9 +174,7 @@ class Renderer(events.Renderer):
             path = "/osha/portal/en/events"
             INFOP = False
 
-        oshaview = getMultiAdapter((context, self.request),
-            name=u'oshaview')
-        subsite = oshaview.getCurrentSubsite()
+        subsite = request_context.currentSubsite()
         # calendar = self.getCalendar(preflang)
         # # If we're in the root (i.e. no in a subiste), and a valid pointer to a
         # # calendar exists, use its path as a query parameter
@@ -193,15 +204,8 @@ class Renderer(events.Renderer):
             results = lf_search_view.search_solr(
                 query, sort='start asc', rows=limit, lang_query=False)
 
-        items = list()
-        for res in results[:limit]:
-            try:
-                items.append(res.getObject())
-            except AttributeError:
-                pass
-            if len(items) >= limit:
-                break
-        return items
+        # render from the flares, the template only needs TEMPLATE_FIELDS
+        return completeFlares(self.context, results[:limit], TEMPLATE_FIELDS)
 
     def _render_cachekey_calendar(method, self, preflang):
         calendar_path = self.data.calendar_path
@@ -249,7 +253,7 @@ class Renderer(events.Renderer):
 
     @memoize
     def prev_events_link(self):
-        osha_view = getMultiAdapter((self.context, self.request), name=u'oshaview')
+        osha_view = IOSHARequestContext(self.request).oshaview(self.context)
         show_previous_events = osha_view.get_subsite_property('show_previous_events')
         if show_previous_events is None: #Property does not yet exist. Old
                                          #behaviour was to show previous_events
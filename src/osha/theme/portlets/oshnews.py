@@ -1,23 +1,31 @@
 from Acquisition import aq_parent, aq_inner
 from DateTime import DateTime
 from collective.solr.mangler import iso8601date
-from osha.theme.browser.utils import search_solr
+from osha.theme.browser.utils import completeFlares, search_solr
 from plone.memoize import ram
 from plone.memoize.compress import xhtml_compress
 from plone.memoize.instance import memoize
 from plone.portlets.interfaces import IPortletDataProvider
 from plone.app.portlets.portlets import base
 from plone.app.portlets.interfaces import IPortletPermissionChecker
-from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone import PloneMessageFactory as _
 from Products.CMFPlone.utils import isExpired
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
+from time import time
 from types import UnicodeType
 from zope import schema
 from zope.component import getMultiAdapter
 from zope.formlib import form
 from zope.interface import implements
 
+from osha.theme.browser.interfaces import IOSHARequestContext
+from osha.theme.config import RENDER_CACHE_TTL
+from osha.theme.generations import getGenerations, newsGenerationKeys
+
+# read by the template, fetched from the catalog when Solr does not return
+# them
+TEMPLATE_FIELDS = ('Description', 'Date')
+
 
 class INewsPortlet(IPortletDataProvider):
 
@@ -101,15 +109,11 @@ class Renderer(base.Renderer):
     def __init__(self, *args):
         base.Renderer.__init__(self, *args)
 
-        portal_lang = getToolByName(self.context, 'portal_languages')
-        self.preflang = portal_lang.getPreferredLanguage()
-
-        portal_state = getMultiAdapter(
-            (self.context, self.request),
-            name=u'plone_portal_state'
-        )
-
-        self.navigation_root_path = portal_state.navigation_root_path()
+        request_context = IOSHARequestContext(self.request)
+        self.preflang = request_context.preferredLanguage(self.context)
+        portal_state = request_context.portalState(self.context)
+        self.navigation_root_path = request_context.navigationRootPath(
+            self.context)
         portal = portal_state.portal()
         self.root = portal.restrictedTraverse(self.navigation_root_path)
 
@@ -127,12 +131,18 @@ class Renderer(base.Renderer):
         return self._data()
 
     def _render_cachekey(method, self):
-        portal_languages = getToolByName(self.context, 'portal_languages')
-        preflang = portal_languages.getPreferredLanguage()
+        request_context = IOSHARequestContext(self.request)
+        preflang = request_context.preferredLanguage(self.context)
         newsfolder_path = self.data.newsfolder_path
         subject = self.data.subject
         navigation_root_path = self.navigation_root_path
-        return (newsfolder_path, preflang, subject, navigation_root_path)
+        # invalidated when news is published, see osha.theme.generations;
+        # the time slot catches items whose effective date has come
+        generations = getGenerations(*newsGenerationKeys(
+            (preflang, request_context.defaultLanguage(self.context)),
+            subject))
+        return (newsfolder_path, preflang, subject, navigation_root_path,
+                generations, time() // RENDER_CACHE_TTL)
 
     @ram.cache(_render_cachekey)
     def available(self):
@@ -142,6 +152,7 @@ class Renderer(base.Renderer):
     def render(self):
         return xhtml_compress(self._template())
 
+    @memoize
     def _data(self):
         """Search for news everywhere, then try to find translations in the
         current language. If no translation is found, use the 'en' version.
@@ -177,15 +188,13 @@ class Renderer(base.Renderer):
                 "@@language-fallback-search")
             results = lf_search_view.search_solr(
                 query, sort='Date desc', rows=limit)  # lang_query=False)
+        # render from the flares, the template only needs TEMPLATE_FIELDS
         items = list()
         for res in results[:limit]:
             if isExpired(res) and getattr(res, 'outdated', False):
                 continue
-            try:
-                items.append(res.getObject())
-            except Exception:
-                pass
-        return items
+            items.append(res)
+        return completeFlares(self.context, items, TEMPLATE_FIELDS)
 
     def showRSS(self):
         return bool(self.getRSSLink())
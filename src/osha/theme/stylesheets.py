@@ -0,0 +1,158 @@
+"""Loaders for the stylesheets linked from the HTML passed to the inline
+styler (see cssselect.Converter).
+
+A loader has a single method, load(urls), that returns a dict mapping every
+url to the text of the stylesheet and raises IOError if one of them can not
+be retrieved.
+"""
+import logging
+import os
+import threading
+import time
+import urllib2
+import urlparse
+from Queue import Empty, Queue
+
+from osha.theme.cache import LRUCache
+
+log = logging.getLogger('osha.theme.stylesheets')
+
+
+class URLStylesheetLoader(object):
+    """ Fetches stylesheets over HTTP, concurrently and with a timeout.
+
+    Stylesheets are kept in a bounded cache for ttl seconds. After that they
+    are revalidated with the ETag / Last-Modified headers of the previous
+    response; if the host can not be reached the stale copy is used.
+    """
+
+    def __init__(self, timeout=10, ttl=3600, maxsize=64, workers=4):
+        self.timeout = timeout
+        self.ttl = ttl
+        self.workers = workers
+        self.cache = LRUCache(maxsize=maxsize)
+
+    def load(self, urls):
+        results = {}
+        pending = []
+        now = time.time()
+        for url in urls:
+            if url in results or url in pending:
+                continue
+            entry = self.cache.lookup(url)
+            if entry is not None and now - entry['fetched'] < self.ttl:
+                results[url] = entry['css']
+            else:
+                pending.append(url)
+
+        if len(pending) == 1:
+            results[pending[0]] = self._fetch(pending[0])
+        elif pending:
+            results.update(self._fetch_all(pending))
+        return results
+
+    def _fetch_all(self, urls):
+        """ fetch urls with a small pool of threads """
+        queue = Queue()
+        for url in urls:
+            queue.put(url)
+        results = {}
+        errors = []
+
+        def worker():
+            while True:
+                try:
+                    url = queue.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[url] = self._fetch(url)
+                except IOError, err:
+                    errors.append(err)
+
+        threads = [threading.Thread(target=worker)
+                   for i in range(min(self.workers, len(urls)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def _fetch(self, url):
+        """ fetch or revalidate a single stylesheet """
+        entry = self.cache.lookup(url)
+        request = urllib2.Request(url)
+        if entry is not None:
+            if entry['etag']:
+                request.add_header('If-None-Match', entry['etag'])
+            if entry['last_modified']:
+                request.add_header('If-Modified-Since', entry['last_modified'])
+        try:
+            response = urllib2.urlopen(request, timeout=self.timeout)
+            try:
+                css = response.read()
+                headers = response.info()
+            finally:
+                response.close()
+        except urllib2.HTTPError, err:
+            if err.code == 304 and entry is not None:
+                entry = dict(entry, fetched=time.time())
+                self.cache.set(url, entry)
+                return entry['css']
+            return self._stale(url, entry, err)
+        except Exception, err:
+            # URLError, socket timeouts and friends
+            return self._stale(url, entry, err)
+
+        self.cache.set(url, dict(
+            css=css,
+            etag=headers.get('ETag'),
+            last_modified=headers.get('Last-Modified'),
+            fetched=time.time(),
+        ))
+        return css
+
+    def _stale(self, url, entry, err):
+        if entry is None:
+            raise IOError(
+                'The stylesheet %s could not be found: %s' % (url, err))
+        log.warn('Could not revalidate stylesheet %s, using the cached '
+                 'copy: %s' % (url, err))
+        return entry['css']
+
+
+class FileStylesheetLoader(object):
+    """ Reads stylesheets from a local directory instead of fetching them,
+    e.g. to run the inline styler offline. The path of the url is looked up
+    below directory, falling back to the file name.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def load(self, urls):
+        results = {}
+        for url in urls:
+            path = urlparse.urlparse(url)[2].lstrip('/')
+            candidates = [
+                os.path.join(self.directory, path),
+                os.path.join(self.directory, os.path.basename(path)),
+            ]
+            for filename in candidates:
+                if os.path.isfile(filename):
+                    f = open(filename)
+                    try:
+                        results[url] = f.read()
+                    finally:
+                        f.close()
+                    break
+            else:
+                raise IOError('The stylesheet %s could not be found' % url)
+        return results
+
+
+# shared by all Converters that do not get a loader of their own, so that
+# fetched stylesheets are cached process-wide
+default_loader = URLStylesheetLoader()
@@ -0,0 +1,86 @@
+import unittest
+
+from osha.theme.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def factory(self, value):
+        calls = []
+
+        def factory():
+            calls.append(value)
+            return value
+        return factory, calls
+
+    def test_get_computes_on_a_miss_only(self):
+        cache = LRUCache(maxsize=2)
+        factory, calls = self.factory('a value')
+        self.assertEqual(cache.get('a', factory), 'a value')
+        self.assertEqual(cache.get('a', factory), 'a value')
+        self.assertEqual(calls, ['a value'])
+        self.assertEqual(cache.info(),
+                         dict(hits=1, misses=1, size=1, maxsize=2))
+
+    def test_lookup(self):
+        cache = LRUCache(maxsize=2)
+        self.assertEqual(cache.lookup('a'), None)
+        self.assertEqual(cache.lookup('a', 'default'), 'default')
+        cache.set('a', 1)
+        self.assertEqual(cache.lookup('a'), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_set_replaces(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('a', 2)
+        self.assertEqual(cache.lookup('a'), 2)
+        self.assertEqual(cache.info()['size'], 1)
+
+    def test_evicts_the_least_recently_set(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        self.assertEqual(cache.lookup('a'), None)
+        self.assertEqual(cache.lookup('b'), 2)
+        self.assertEqual(cache.lookup('c'), 3)
+        self.assertEqual(cache.info()['size'], 2)
+
+    def test_evicts_the_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # a hit makes 'a' the most recently used entry
+        self.assertEqual(cache.lookup('a'), 1)
+        cache.get('c', lambda: 3)
+        self.assertEqual(cache.lookup('b'), None)
+        self.assertEqual(cache.lookup('a'), 1)
+        self.assertEqual(cache.lookup('c'), 3)
+
+    def test_get_hit_counts_as_use(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        factory, calls = self.factory(1)
+        cache.get('a', factory)
+        cache.set('c', 3)
+        self.assertEqual(calls, [])
+        self.assertEqual(cache.lookup('a'), 1)
+        self.assertEqual(cache.lookup('b'), None)
+
+    def test_clear(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.lookup('a')
+        cache.lookup('b')
+        cache.clear()
+        self.assertEqual(cache.info(),
+                         dict(hits=0, misses=0, size=0, maxsize=2))
+        self.assertEqual(cache.lookup('a'), None)
+
+
+def test_suite():
+    return unittest.TestSuite([
+        unittest.makeSuite(TestLRUCache),
+    ])
@@ -0,0 +1,221 @@
+import unittest
+
+from zope.annotation.interfaces import IAnnotations
+from zope.app.container.contained import ContainerModifiedEvent
+from zope.interface import implements
+from zope.lifecycleevent import ObjectModifiedEvent, ObjectMovedEvent, \
+    ObjectRemovedEvent
+from Products.CMFCore.WorkflowCore import ActionSucceededEvent
+
+from osha.theme import generations
+from osha.theme.generations import bumpContentGenerations, \
+    bumpGenerations, bumpHomepageGenerations, bumpNavigationGeneration, \
+    bumpThesaurusGeneration, eventsGenerationKeys, getGenerations, \
+    homepageGenerationKey, navigationGenerationKey, newsGenerationKeys, \
+    THESAURUS
+
+
+class Content(dict):
+    """ content at path that keeps its annotations in itself """
+    implements(IAnnotations)
+
+    def __init__(self, path, **attributes):
+        dict.__init__(self)
+        self.path = tuple(path.split('/'))
+        self.__dict__.update(attributes)
+
+    def getPhysicalPath(self):
+        return self.path
+
+
+def newsItem(path, language='en', subjects=()):
+    return Content(path, portal_type='News Item',
+                   Language=lambda: language, Subject=lambda: subjects)
+
+
+def page(path, title='A page', **attributes):
+    return Content(path, portal_type='Document', Title=lambda: title,
+                   Description=lambda: '', exclude_from_nav=False,
+                   **attributes)
+
+
+class GenerationsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.site = Content('/osha')
+        self._getSite = generations.getSite
+        generations.getSite = lambda: self.site
+
+    def tearDown(self):
+        generations.getSite = self._getSite
+
+
+class TestCounters(GenerationsTestCase):
+
+    def test_no_site(self):
+        generations.getSite = lambda: None
+        bumpGenerations('a')
+        self.assertEqual(getGenerations('a', 'b'), (0, 0))
+
+    def test_unknown_keys_are_zero(self):
+        self.assertEqual(getGenerations('a', 'b'), (0, 0))
+        self.failIf(self.site)
+
+    def test_bump(self):
+        bumpGenerations('a')
+        self.assertEqual(getGenerations('a', 'b'), (1, 0))
+        bumpGenerations('a', 'b')
+        bumpGenerations('a')
+        self.assertEqual(getGenerations('a', 'b'), (3, 1))
+
+    def test_keys(self):
+        self.assertEqual(
+            newsGenerationKeys(['en', 'fr']),
+            (('news', 'language', 'en'), ('news', 'language', 'fr'),
+             ('news', 'language', '')))
+        self.assertEqual(
+            eventsGenerationKeys(['en'], ['a', 'b']),
+            (('events', 'subject', 'a'), ('events', 'subject', 'b')))
+
+
+class TestContentGenerations(GenerationsTestCase):
+
+    def test_news_item(self):
+        item = newsItem('/osha/en/news/item', 'en', ('a', ))
+        bumpContentGenerations(item, ObjectModifiedEvent(item))
+        self.assertEqual(
+            getGenerations(*newsGenerationKeys(['en'], ['a'])), (1, ))
+        self.assertEqual(
+            getGenerations(*newsGenerationKeys(['en'])), (1, 0))
+        self.assertEqual(
+            getGenerations(*eventsGenerationKeys(['en'])), (0, 0))
+
+    def test_edit_bumps_what_the_item_was_listed_in(self):
+        item = newsItem('/osha/en/news/item', 'en', ('a', ))
+        bumpContentGenerations(item, ObjectModifiedEvent(item))
+        item.Language = lambda: 'fr'
+        item.Subject = lambda: ('b', )
+        bumpContentGenerations(item, ObjectModifiedEvent(item))
+        self.assertEqual(
+            getGenerations(*newsGenerationKeys(['en', 'fr'])), (2, 1, 0))
+        self.assertEqual(
+            getGenerations(*newsGenerationKeys([], ['a', 'b'])), (2, 1))
+
+    def test_other_content(self):
+        document = page('/osha/en/news/page')
+        bumpContentGenerations(document, ObjectModifiedEvent(document))
+        self.failIf(self.site)
+
+    def test_portal_factory(self):
+        item = newsItem('/osha/en/portal_factory/News Item/item')
+        bumpContentGenerations(item, ObjectModifiedEvent(item))
+        self.failIf(self.site)
+
+
+class TestNavigationGeneration(GenerationsTestCase):
+
+    def generation(self, path):
+        return getGenerations(navigationGenerationKey(path))[0]
+
+    def test_modified(self):
+        document = page('/osha/en/page')
+        bumpNavigationGeneration(document, ObjectModifiedEvent(document))
+        self.assertEqual(self.generation('/osha/en'), 1)
+        # nothing the navigation shows changed
+        bumpNavigationGeneration(document, ObjectModifiedEvent(document))
+        self.assertEqual(self.generation('/osha/en'), 1)
+        document.Title = lambda: 'Another title'
+        bumpNavigationGeneration(document, ObjectModifiedEvent(document))
+        self.assertEqual(self.generation('/osha/en'), 2)
+        self.assertEqual(self.generation('/osha/en/page'), 0)
+
+    def test_workflow_transition(self):
+        document = page('/osha/en/page')
+        bumpNavigationGeneration(document, ObjectModifiedEvent(document))
+        bumpNavigationGeneration(document, ActionSucceededEvent(
+            document, None, 'publish', None))
+        self.assertEqual(self.generation('/osha/en'), 2)
+
+    def test_reordered(self):
+        folder = page('/osha/en/folder', isPrincipiaFolderish=True)
+        bumpNavigationGeneration(folder, ContainerModifiedEvent(folder))
+        self.assertEqual(self.generation('/osha/en/folder'), 1)
+        self.assertEqual(self.generation('/osha/en'), 0)
+
+    def test_moved(self):
+        folder = page('/osha/fr/folder', isPrincipiaFolderish=True)
+        document = page('/osha/fr/folder/page')
+        event = ObjectMovedEvent(folder, Content('/osha/en'), 'folder',
+                                 Content('/osha/fr'), 'folder')
+        bumpNavigationGeneration(folder, event)
+        bumpNavigationGeneration(document, event)
+        for path in ('/osha/en', '/osha/fr', '/osha/en/folder',
+                     '/osha/fr/folder'):
+            self.assertEqual(self.generation(path), 1)
+        # the sublocation event of the page leaves its parents alone
+        self.assertEqual(self.generation('/osha/fr/folder/page'), 0)
+
+    def test_removed(self):
+        document = page('/osha/en/page')
+        bumpNavigationGeneration(document, ObjectRemovedEvent(
+            document, Content('/osha/en'), 'page'))
+        self.assertEqual(self.generation('/osha/en'), 1)
+
+
+class TestThesaurusGeneration(GenerationsTestCase):
+
+    def test_term_modified(self):
+        term = Content('/osha/portal_vocabularies/MultilingualThesaurus/t1')
+        bumpThesaurusGeneration(term, ObjectModifiedEvent(term))
+        self.assertEqual(getGenerations(THESAURUS), (1, ))
+
+    def test_term_removed(self):
+        term = Content('/t1')
+        bumpThesaurusGeneration(term, ObjectRemovedEvent(
+            term,
+            Content('/osha/portal_vocabularies/MultilingualThesaurus'),
+            't1'))
+        self.assertEqual(getGenerations(THESAURUS), (1, ))
+
+    def test_other_vocabulary(self):
+        term = Content('/osha/portal_vocabularies/Other/MultilingualThesaurus')
+        bumpThesaurusGeneration(term, ObjectModifiedEvent(term))
+        self.failIf(self.site)
+
+
+class TestHomepageGenerations(GenerationsTestCase):
+
+    def generations(self):
+        return getGenerations(homepageGenerationKey('en'),
+                              homepageGenerationKey('fr'))
+
+    def test_modified(self):
+        item = newsItem('/osha/en/teaser/item')
+        bumpHomepageGenerations(item, ObjectModifiedEvent(item))
+        bumpHomepageGenerations(item, ActionSucceededEvent(
+            item, None, 'retract', None))
+        self.assertEqual(self.generations(), (2, 0))
+
+    def test_moved(self):
+        item = newsItem('/osha/fr/in-focus/item')
+        bumpHomepageGenerations(item, ObjectMovedEvent(
+            item, Content('/osha/en/teaser'), 'item',
+            Content('/osha/fr/in-focus'), 'item'))
+        self.assertEqual(self.generations(), (1, 1))
+
+    def test_elsewhere(self):
+        item = newsItem('/osha/en/news/item')
+        bumpHomepageGenerations(item, ObjectModifiedEvent(item))
+        item = newsItem('/osha/en/portal_factory/News Item/teaser')
+        bumpHomepageGenerations(item, ObjectModifiedEvent(item))
+        self.assertEqual(self.generations(), (0, 0))
+
+
+def test_suite():
+    return unittest.TestSuite([
+        unittest.makeSuite(TestCounters),
+        unittest.makeSuite(TestContentGenerations),
+        unittest.makeSuite(TestNavigationGeneration),
+        unittest.makeSuite(TestThesaurusGeneration),
+        unittest.makeSuite(TestHomepageGenerations),
+    ])
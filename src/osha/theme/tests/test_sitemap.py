@@ -0,0 +1,208 @@
+import unittest
+
+from DateTime import DateTime
+from zope.annotation.interfaces import IAnnotations
+from zope.interface import implements
+from zope.lifecycleevent import ObjectModifiedEvent, ObjectMovedEvent, \
+    ObjectRemovedEvent
+
+from osha.theme.browser import sitemap
+from osha.theme.browser.sitemap import allShards, DEFAULT_LASTMOD, \
+    getSitemapJournal, markSitemapDirty, ROOT_SHARD, SHARD_BUCKETS, \
+    shardForPath, shardForPrefix, SiteMapView, SitemapJournal
+
+
+class Content(dict):
+    """ content at path that keeps its annotations in itself """
+    implements(IAnnotations)
+
+    def __init__(self, path):
+        dict.__init__(self)
+        self.path = tuple(path.split('/'))
+
+    def getPhysicalPath(self):
+        return self.path
+
+
+class PortalURL(object):
+
+    def getPortalPath(self):
+        return '/osha'
+
+
+class Context(object):
+    portal_url = PortalURL()
+
+
+class Request(object):
+
+    def physicalPathToURL(self, path):
+        return 'http://nohost' + path
+
+
+class TestShards(unittest.TestCase):
+
+    def test_allShards(self):
+        shards = allShards()
+        self.assertEqual(len(shards), SHARD_BUCKETS + 1)
+        self.assertEqual(len(set(shards)), len(shards))
+        self.assertEqual(shards[0], ROOT_SHARD)
+
+    def test_shardForPrefix(self):
+        shard = shardForPrefix('en/publications')
+        self.failUnless(shard in allShards())
+        self.assertNotEqual(shard, ROOT_SHARD)
+        self.assertEqual(shardForPrefix(u'en/publications'), shard)
+        self.failUnless(shardForPrefix(u'de/ver\xf6ffentlichungen')
+                        in allShards())
+
+    def test_shardForPath(self):
+        self.assertEqual(shardForPath('/osha', '/osha'), ROOT_SHARD)
+        self.assertEqual(shardForPath('/osha', '/osha/en'), ROOT_SHARD)
+        shard = shardForPrefix('en/publications')
+        self.assertEqual(shardForPath('/osha', '/osha/en/publications'),
+                         shard)
+        self.assertEqual(
+            shardForPath('/osha', '/osha/en/publications/reports/report'),
+            shard)
+
+    def test_spread(self):
+        shards = set([shardForPrefix('en/folder-%d' % i)
+                      for i in range(1000)])
+        self.assertEqual(len(shards), SHARD_BUCKETS)
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.site = Content('/osha')
+        self._getSite = sitemap.getSite
+        sitemap.getSite = lambda: self.site
+
+    def tearDown(self):
+        sitemap.getSite = self._getSite
+
+    def test_dirty(self):
+        journal = SitemapJournal()
+        journal.markDirty('bucket-01')
+        journal.markDirty(ROOT_SHARD)
+        journal.markDirty('bucket-01')
+        self.assertEqual(journal.popDirty(), [ROOT_SHARD, 'bucket-01'])
+        self.assertEqual(journal.popDirty(), [])
+
+    def test_getSitemapJournal(self):
+        self.assertEqual(getSitemapJournal(self.site), None)
+        journal = getSitemapJournal(self.site, create=True)
+        self.failUnless(getSitemapJournal(self.site) is journal)
+
+    def test_not_generated_yet(self):
+        obj = Content('/osha/en/publications/report')
+        markSitemapDirty(obj, ObjectModifiedEvent(obj))
+        self.assertEqual(getSitemapJournal(self.site), None)
+
+    def test_modified(self):
+        journal = getSitemapJournal(self.site, create=True)
+        obj = Content('/osha/en/publications/report')
+        markSitemapDirty(obj, ObjectModifiedEvent(obj))
+        self.assertEqual(journal.popDirty(),
+                         [shardForPrefix('en/publications')])
+        obj = Content('/osha/en')
+        markSitemapDirty(obj, ObjectModifiedEvent(obj))
+        self.assertEqual(journal.popDirty(), [ROOT_SHARD])
+
+    def test_moved(self):
+        journal = getSitemapJournal(self.site, create=True)
+        obj = Content('/osha/en/publications/report')
+        markSitemapDirty(obj, ObjectMovedEvent(
+            obj, Content('/osha/fr/news'), 'report',
+            Content('/osha/en/publications'), 'report'))
+        self.assertEqual(
+            sorted(journal.popDirty()),
+            sorted(set([shardForPrefix('en/publications'),
+                        shardForPrefix('fr/news')])))
+
+    def test_removed(self):
+        journal = getSitemapJournal(self.site, create=True)
+        obj = Content('/report')
+        markSitemapDirty(obj, ObjectRemovedEvent(
+            obj, Content('/osha/fr/news'), 'report'))
+        self.assertEqual(journal.popDirty(), [shardForPrefix('fr/news')])
+
+    def test_portal_factory(self):
+        journal = getSitemapJournal(self.site, create=True)
+        obj = Content('/osha/en/portal_factory/Document/page')
+        markSitemapDirty(obj, ObjectModifiedEvent(obj))
+        self.assertEqual(journal.popDirty(), [])
+
+
+class TestExtract(unittest.TestCase):
+
+    def setUp(self):
+        self.view = SiteMapView(Context(), Request())
+        self._batch_size = sitemap.BATCH_SIZE
+
+    def tearDown(self):
+        sitemap.BATCH_SIZE = self._batch_size
+
+    def extract(self, records):
+        return [entry for batch in self.view._extract(records)
+                for entry in batch]
+
+    def test_priority(self):
+        now = DateTime()
+        entries = self.extract([
+            ('/osha/en/old', 'Document', False, now - 31, now, None),
+            ('/osha/en/new', 'Document', False, now - 29, now, None),
+        ])
+        self.assertEqual([entry['priority'] for entry in entries],
+                         [0.3, 0.9])
+        self.assertEqual(entries[0]['loc'], 'http://nohost/osha/en/old')
+        self.assertEqual(entries[0]['lastmod'], now.ISO8601())
+
+    def test_changefreq(self):
+        now = DateTime()
+        entries = self.extract([
+            ('/osha/en/a', 'Document', False, now, now, None),
+            ('/osha/en/b', 'Document', False, now, now, 'daily'),
+            ('/osha/en/c', 'News Item', False, now, now, 'daily'),
+            ('/osha/en/d', 'Event', False, now, now, None),
+        ])
+        self.assertEqual([entry['changefreq'] for entry in entries],
+                         ['monthly', 'daily', 'never', 'never'])
+
+    def test_skipped(self):
+        now = DateTime()
+        entries = self.extract([
+            ('/osha/en/outdated', 'Document', True, now, now, None),
+            ('/osha/en/note', 'Note', False, now, now, None),
+            ('/osha/en/a page', 'Document', False, now, None, None),
+        ])
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['loc'], 'http://nohost/osha/en/a%20page')
+        self.assertEqual(entries[0]['lastmod'], DEFAULT_LASTMOD)
+
+    def test_urlmap(self):
+        now = DateTime()
+        self.view.urlmap = {'http://nohost/osha/en/a': ('yearly', '0.1')}
+        entries = self.extract([
+            ('/osha/en/a', 'Document', False, now, now, None),
+        ])
+        self.assertEqual(
+            (entries[0]['changefreq'], entries[0]['priority']),
+            ('yearly', '0.1'))
+
+    def test_batches(self):
+        sitemap.BATCH_SIZE = 2
+        now = DateTime()
+        records = [('/osha/en/%d' % i, 'Document', False, now, now, None)
+                   for i in range(5)]
+        self.assertEqual(
+            [len(batch) for batch in self.view._extract(records)], [2, 2, 1])
+
+
+def test_suite():
+    return unittest.TestSuite([
+        unittest.makeSuite(TestShards),
+        unittest.makeSuite(TestJournal),
+        unittest.makeSuite(TestExtract),
+    ])
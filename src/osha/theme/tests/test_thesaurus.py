@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from osha.theme.thesaurus import CaptionTable, StringArray
+
+
+class TestStringArray(unittest.TestCase):
+
+    def test_sequence(self):
+        strings = StringArray([u'a', u'', u'bc', u'd\xe9f'])
+        self.assertEqual(len(strings), 4)
+        self.assertEqual(list(strings), [u'a', u'', u'bc', u'd\xe9f'])
+        self.assertEqual(strings[-1], u'd\xe9f')
+        self.assertRaises(IndexError, strings.__getitem__, 4)
+        self.assertRaises(IndexError, strings.__getitem__, -5)
+
+    def test_empty(self):
+        strings = StringArray([])
+        self.assertEqual(len(strings), 0)
+        self.assertEqual(list(strings), [])
+
+
+class TestCaptionTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = CaptionTable([
+            ('t3', u'accident'),
+            ('t1', u' Biological agents '),
+            ('t2', u'Asbestos'),
+            ('t5', None),
+            ('t4', u'b\xe9ton'),
+            ('t6', u''),
+        ])
+
+    def test_caption(self):
+        self.assertEqual(self.table.caption('t1'), u'Biological agents')
+        self.assertEqual(self.table.caption('t4'), u'b\xe9ton')
+        self.assertEqual(self.table.caption('t5'), u'')
+        self.assertEqual(self.table.caption('t0'), u'')
+        self.assertEqual(self.table.caption('t9', None), None)
+        self.assertEqual(len(self.table), 6)
+
+    def test_termId(self):
+        self.assertEqual(self.table.termId(u'Asbestos'), 't2')
+        self.assertEqual(self.table.termId(u' accident '), 't3')
+        self.assertEqual(self.table.termId(u'asbestos'), '')
+        self.assertEqual(self.table.termId(u'unknown', None), None)
+        self.assertEqual(self.table.termId(u''), '')
+        self.assertEqual(self.table.termId(None), '')
+
+    def test_initials(self):
+        # terms without a caption are left out
+        self.assertEqual(self.table.initials(), [u'A', u'B'])
+
+    def test_items(self):
+        # sorted case insensitively
+        self.assertEqual(self.table.items(u'A'),
+                         [(u'accident', 't3'), (u'Asbestos', 't2')])
+        self.assertEqual(self.table.items(u'B'),
+                         [(u'Biological agents', 't1'), (u'b\xe9ton', 't4')])
+        self.assertEqual(self.table.items(u'Z'), [])
+        self.assertEqual(self.table.captions(u'A'),
+                         [u'accident', u'Asbestos'])
+
+    def test_empty(self):
+        table = CaptionTable([])
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.caption('t1'), u'')
+        self.assertEqual(table.termId(u'accident'), '')
+        self.assertEqual(table.initials(), [])
+
+
+def test_suite():
+    return unittest.TestSuite([
+        unittest.makeSuite(TestStringArray),
+        unittest.makeSuite(TestCaptionTable),
+    ])
@@ -0,0 +1,164 @@
+"""Caption tables of the MultilingualThesaurus.
+
+The A-Z and alphabetical indexes and the Dublin Core viewlet need the
+captions of many thesaurus terms in the current language. Asking the vdex
+manager for them one term at a time is slow, so getCaptionTable builds a
+table per language once and shares it process-wide. A table is rebuilt when
+the thesaurus generation is bumped, which happens whenever the vocabulary or
+one of its terms is modified (see osha.theme.generations).
+
+The captions and term ids of a table are kept in a few strings and arrays
+instead of a dict per language, a thesaurus with 10000 terms in 24 languages
+would otherwise mean millions of small objects.
+"""
+from array import array
+
+from Products.CMFCore.utils import getToolByName
+
+from osha.theme.cache import LRUCache
+from osha.theme.generations import getGenerations, THESAURUS_VOCABULARY, \
+    THESAURUS as THESAURUS_GENERATION
+
+THESAURUS = THESAURUS_VOCABULARY
+
+# a table per language, see getCaptionTable
+caption_tables = LRUCache(maxsize=32)
+
+
+class StringArray(object):
+    """ An immutable sequence of strings stored in one string plus an array
+    of offsets.
+    """
+
+    def __init__(self, strings):
+        offsets = array('l', [0])
+        position = 0
+        for string in strings:
+            position += len(string)
+            offsets.append(position)
+        self._data = u''.join(strings)
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._data[self._offsets[index]:self._offsets[index + 1]]
+
+
+def _sortkey(caption):
+    return (caption.lower(), caption)
+
+
+class CaptionTable(object):
+    """ The captions of all terms of the thesaurus in one language:
+    term id -> caption, initial -> captions sorted case insensitively and
+    caption -> term id. Terms without a caption in the language are left out
+    of the latter two.
+    """
+
+    def __init__(self, captions):
+        """ captions is a sequence of (term id, caption) pairs """
+        captions = sorted([(term_id, (caption or u'').strip())
+                           for term_id, caption in captions])
+        self._ids = StringArray([term_id for term_id, c in captions])
+        self._captions = StringArray([caption for t, caption in captions])
+
+        order = [i for i, (t, caption) in enumerate(captions) if caption]
+        order.sort(key=lambda i: _sortkey(captions[i][1]))
+        self._order = array('l', order)
+
+        # initial -> (start, stop) in self._order
+        self._initials = {}
+        for position, index in enumerate(order):
+            initial = captions[index][1][0].upper()
+            start, stop = self._initials.get(initial, (position, position))
+            self._initials[initial] = (start, position + 1)
+
+    def _bisect(self, sequence, value, key=None, lo=0, hi=None):
+        """ bisect_left for a sequence of indexes sorted by key """
+        if hi is None:
+            hi = len(sequence)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key(sequence[mid]) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _index(self, term_id):
+        ids = self._ids
+        index = self._bisect(ids, term_id, key=lambda term_id: term_id)
+        if index < len(ids) and ids[index] == term_id:
+            return index
+        return None
+
+    def caption(self, term_id, default=u''):
+        """ the caption of term_id """
+        index = self._index(term_id)
+        if index is None:
+            return default
+        return self._captions[index]
+
+    def termId(self, caption, default=''):
+        """ the id of the term with caption """
+        caption = (caption or u'').strip()
+        if not caption:
+            return default
+        captions = self._captions
+        position = self._bisect(
+            self._order, _sortkey(caption),
+            key=lambda index: _sortkey(captions[index]))
+        if position < len(self._order):
+            index = self._order[position]
+            if captions[index] == caption:
+                return self._ids[index]
+        return default
+
+    def initials(self):
+        """ the sorted initials of the captions """
+        return sorted(self._initials.keys())
+
+    def items(self, initial):
+        """ the (caption, term id) pairs of the captions starting with
+            initial, sorted by caption
+        """
+        start, stop = self._initials.get(initial, (0, 0))
+        return [(self._captions[index], self._ids[index])
+                for index in self._order[start:stop]]
+
+    def captions(self, initial):
+        """ the captions starting with initial, sorted """
+        return [caption for caption, term_id in self.items(initial)]
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def getCaptionTable(context, lang, manager=None):
+    """ the CaptionTable of the thesaurus in lang. manager is the vdex
+        manager of the thesaurus, if the caller already has it.
+    """
+    vocabulary = getattr(getToolByName(context, 'portal_vocabularies'),
+                         THESAURUS)
+    # modified() changes when a new vdex file is uploaded, the generation
+    # when the vocabulary or one of its terms is edited
+    stamp = (getGenerations(THESAURUS_GENERATION)[0],
+             str(vocabulary.modified()))
+    key = ('/'.join(vocabulary.getPhysicalPath()), lang)
+    entry = caption_tables.lookup(key)
+    if entry is not None and entry[0] == stamp:
+        return entry[1]
+
+    if manager is None:
+        manager = vocabulary._getManager()
+    getCaption = manager.getTermCaptionById
+    table = CaptionTable([(term_id, getCaption(term_id, lang))
+                          for term_id in manager.term_dict.keys()])
+    caption_tables.set(key, (stamp, table))
+    return table
@@ -0,0 +1,55 @@
+"""Translation maps for the language selector.
+
+The language selector is rendered on every page and needs to know in which
+languages the current item is translated and whether those translations can
+be viewed. LinguaPlone answers that by waking up every translation, so
+getTranslationMap builds a map per item from the reference and portal
+catalogs instead and shares it process-wide. The maps are invalidated by the
+translations generation, which is bumped whenever translatable content is
+translated, added, moved, removed or changes its workflow state.
+"""
+from Products.CMFCore.utils import getToolByName
+from Products.LinguaPlone.config import RELATIONSHIP
+
+from osha.theme.cache import LRUCache
+from osha.theme.generations import getGenerations, TRANSLATIONS
+
+# a map per item, see getTranslationMap
+translation_maps = LRUCache(maxsize=4096)
+
+
+def _buildTranslationMap(context, uid):
+    reference_catalog = getToolByName(context, 'reference_catalog')
+    catalog = getToolByName(context, 'portal_catalog')
+    references = reference_catalog(sourceUID=uid, relationship=RELATIONSHIP)
+    canonical = references and references[0].targetUID or uid
+    uids = [canonical] + [
+        reference.sourceUID for reference in
+        reference_catalog(targetUID=canonical, relationship=RELATIONSHIP)]
+
+    # unrestrictedSearchResults does not filter by language
+    anonymous = set([brain.UID for brain in catalog.unrestrictedSearchResults(
+        UID=uids, allowedRolesAndUsers=['Anonymous'])])
+    translations = {}
+    for brain in catalog.unrestrictedSearchResults(UID=uids):
+        if brain.Language:
+            translations[str(brain.Language)] = (
+                brain.getPath(), brain.UID in anonymous)
+    return translations
+
+
+def getTranslationMap(context, obj):
+    """ language -> (path, viewable by anonymous) for obj and all of its
+        translations. Neither obj nor the translations are woken up.
+    """
+    uid = obj.UID()
+    key = ('/'.join(getToolByName(context, 'portal_url').getPortalObject()
+                    .getPhysicalPath()), uid)
+    stamp = getGenerations(TRANSLATIONS)[0]
+    entry = translation_maps.lookup(key)
+    if entry is not None and entry[0] == stamp:
+        return entry[1]
+
+    translations = _buildTranslationMap(context, uid)
+    translation_maps.set(key, (stamp, translations))
+    return translations